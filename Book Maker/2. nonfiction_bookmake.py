@@ -1,128 +1,335 @@
 import os
-import re
-import openai
-import pandas as pd
+import asyncio
+import argparse
 from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 
-# ── CONFIGURATION ──────────────────────────────────────────────────────────────
+from bookmaker import llm
+from bookmaker.engine import DEFAULT_CONCURRENCY, PriorityGate, Section, generate_sections
+from bookmaker.retry import GenerationError
+from bookmaker.batch import custom_id, make_backend, run_batch
+from bookmaker.documents import (DEFAULT_DOCX_WORKERS, EXPORT_BACKEND, EXPORT_BACKENDS, EXTRA_FORMATS, DocumentPool,
+                                 nonfiction_doc, nonfiction_title_page, save_nonfiction_book)
+from bookmaker.journal import SectionJournal, journal_path
+from bookmaker.manifest import input_hash, load_manifest, manifest_path, reuse_unchanged, save_manifest
+from bookmaker.prompts import NONFICTION_RULES, nonfiction_context
+from bookmaker.schedule import FAST_MODEL, SCHEDULE, Scheduler, share_goal
+from bookmaker.sheets import group_ends, iter_groups, iter_sheet_groups
 
-openai.api_key = os.getenv("OPENAI_API_KEY", "").strip()
-if not openai.api_key:
-    raise RuntimeError("OPENAI_API_KEY environment variable not set.")
+# ── CONFIGURATION ──────────────────────────────────────────────────────────────
 
 MODEL = "gpt-4o-mini"
 PROMPTS_EXCEL = "/Users/kuldeepsharma/Desktop/projectcode/Book_Generated_Content.xlsx"
 WORD_OUTPUT_DIR = "/Users/kuldeepsharma/Desktop/projectcode/WordOutput"
+BOOKS_IN_FLIGHT = 4
 
-# ── HELPERS ────────────────────────────────────────────────────────────────────
+# Section calls skipped and books kept by an --incremental run
+incremental_stats = {"skipped": 0, "sections": 0, "kept": 0}
 
-def format_text(text: str) -> str:
-    return re.sub(r"[\*#\"]", "", text or "").strip()
+# Output budgets, model routing and dispatch order of the section calls
+scheduler = Scheduler(MODEL)
 
-def clean_intro(text: str, chapter_title: str) -> str:
-    lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
-    cleaned = []
-    subtitle = chapter_title.split(":")[-1].strip().lower()
-    full_title = chapter_title.strip().lower()
+# ── HELPERS ────────────────────────────────────────────────────────────────────
 
-    for line in lines:
-        l = line.lower()
-        if subtitle in l or full_title in l or re.match(r'chapter\s*\d+', l):
-            continue
-        cleaned.append(line)
-    return "\n".join(cleaned).strip()
+def request_messages(prompt: str, context: str = "") -> list[dict]:
+    """The book's shared context as a cacheable system prefix, then the per-section prompt."""
+    messages = [{"role": "system", "content": context}] if context else []
+    return messages + [{"role": "user", "content": prompt}]
 
-def clean_subsection(text: str, subheading: str) -> str:
-    lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
-    cleaned = []
-    sub_name = subheading.strip().lower()
+def section_request(section: Section, context: str = "") -> dict:
+    """A section's chat parameters; max_tokens is only sent when the scheduler set a budget."""
+    request = {"model": section.model or MODEL, "messages": request_messages(section.prompt, context)}
+    if section.max_tokens:
+        request["max_tokens"] = section.max_tokens
+    return request
 
-    for line in lines:
-        if sub_name in line.lower():
-            continue
-        cleaned.append(line)
-    return "\n".join(cleaned).strip()
-
-def generate_text(prompt: str) -> str:
+def generate_text(prompt: str, context: str = "", model: str = MODEL, max_tokens: int | None = None) -> str:
     if not isinstance(prompt, str) or not prompt.strip():
         return ""
     try:
         print("🧠 Generating:", prompt[:60].strip().replace('\n', ' ') + "...")
-        response = openai.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print("❌ OpenAI error with prompt:", prompt[:60], "\n→", e)
+        return llm.chat(request_messages(prompt, context), model=model, max_tokens=max_tokens)
+    except GenerationError as e:
+        print(f"❌ OpenAI error ({e.kind}) with prompt:", prompt[:60], "\n→", e)
+        raise
+
+async def agenerate_text(prompt: str, on_delta=None, context: str = "", model: str = MODEL,
+                         max_tokens: int | None = None) -> str:
+    if not isinstance(prompt, str) or not prompt.strip():
         return ""
+    try:
+        print("🧠 Generating:", prompt[:60].strip().replace('\n', ' ') + "...")
+        return await llm.achat(request_messages(prompt, context), model=model, max_tokens=max_tokens,
+                               on_delta=on_delta)
+    except GenerationError as e:
+        print(f"❌ OpenAI error ({e.kind}) with prompt:", prompt[:60], "\n→", e)
+        raise
 
 def init_doc(title: str) -> Document:
-    doc = Document()
     os.makedirs(WORD_OUTPUT_DIR, exist_ok=True)
+    return nonfiction_title_page(title)
 
-    # Title Page
-    title_heading = doc.add_heading(title, level=0)
-    title_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    title_heading.runs[0].font.size = Pt(20)
-
-    author_para = doc.add_paragraph("By AI Book Generator")
-    author_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    author_para.runs[0].font.size = Pt(14)
-    doc.add_page_break()
-    return doc
+def book_path(title: str) -> str:
+    return os.path.join(WORD_OUTPUT_DIR, f"{title}.docx")
 
 def save_doc(title: str, doc: Document):
-    path = os.path.join(WORD_OUTPUT_DIR, f"{title}.docx")
+    path = book_path(title)
     doc.save(path)
-    print(f"💾 Saved progress to: {path}")
+    print(f"💾 Saved book to: {path}")
+    return path
 
-# ── MAIN PIPELINE ──────────────────────────────────────────────────────────────
+# ── BOOK PLANNING & ASSEMBLY ───────────────────────────────────────────────────
 
-if __name__ == "__main__":
-    df = pd.read_excel(PROMPTS_EXCEL)
-    books = {}
-
-    for _, row in df.iterrows():
-        title = row['Book_Title']
-        if title not in books:
-            print(f"\n📘 Starting new book: {title}")
-            doc = init_doc(title)
-            books[title] = doc
+def plan_book(title: str, rows) -> list[Section]:
+    """
+    Turns one book's prompt-sheet rows (dicts) into its ordered section list.
+    Every section shares one context prefix built from the book's profile
+    columns (taken from its first row) and its full outline. Each row's
+    sections get their target lengths from their prompts and Word_Goal.
+    """
+    sections: list[Section] = []
+    outline = []
+    profile = None
 
+    for chapter_number, row in enumerate(rows, start=1):
+        first = len(sections)
+        if profile is None:
+            profile = row
             if isinstance(row['Intro_Prompt'], str) and row['Intro_Prompt'].strip():
-                print(f"📄 Generating Introduction for: {title}")
-                intro_text = generate_text(row['Intro_Prompt'])
-                if intro_text.strip():
-                    doc.add_heading("Introduction", level=1)
-                    doc.add_paragraph(format_text(intro_text))
-                    doc.add_paragraph("")  # spacing
-                    doc.add_page_break()
-                    save_doc(title, doc)
-
-        doc = books[title]
-        chapter_title = row['Chapter_Title']
-        print(f"📚 Chapter: {chapter_title}")
-        chapter_intro = generate_text(row['Chapter_Intro'])
-        chapter_intro = clean_intro(chapter_intro, chapter_title)
+                sections.append(Section(title, "intro", "intro", "Introduction", 1, row['Intro_Prompt']))
 
-        doc.add_heading(chapter_title, level=1)
-        doc.add_paragraph(format_text(chapter_intro))
-        doc.add_paragraph("")
+        chapter_key = f"ch{chapter_number:02d}"
+        chapter_title = row['Chapter_Title']
+        sections.append(Section(title, chapter_key, "chapter_intro", chapter_title, 1, row['Chapter_Intro']))
+        outline.append((chapter_title, []))
 
         for i in range(1, 5):
             sub_prompt = row.get(f'Subheading_{i}_Prompt')
             sub_title = row.get(f'Subheading_{i}')
             if isinstance(sub_prompt, str) and isinstance(sub_title, str):
                 if sub_prompt.strip() and sub_title.strip():
-                    print(f"   🔹 Subheading: {sub_title}")
-                    sub_text = generate_text(sub_prompt)
-                    sub_text = clean_subsection(sub_text, sub_title)
-                    doc.add_heading(sub_title.strip(), level=2)
-                    doc.add_paragraph(format_text(sub_text))
-                    doc.add_paragraph("")
-
-        doc.add_page_break()
-        save_doc(title, doc)
+                    sections.append(Section(title, f"{chapter_key}.sub{i}", "subheading", sub_title.strip(), 2, sub_prompt))
+                    outline[-1][1].append(sub_title.strip())
+
+        row_sections = sections[first:]
+        for section, words in zip(row_sections, share_goal([s.prompt for s in row_sections], row.get('Word_Goal'))):
+            scheduler.assign(section, words)
+
+    rules = (profile or {}).get("Style_Rules") or NONFICTION_RULES
+    context = nonfiction_context(title, profile or {}, outline, rules)
+    # The context without its outline: rules, description and profile fields (see bookmaker.manifest).
+    book = nonfiction_context(title, profile or {}, [], rules)
+    for section in sections:
+        section.context = context
+        section.digest = input_hash(section_request(section), section.heading, book)
+    return sections
+
+def iter_book_groups(rows):
+    """
+    (title, rows) per book in order of first appearance, like the groupby(sort=False) this replaced:
+    a title's rows are merged even when other books' rows sit between them. `rows` is a prompts
+    workbook path, which is read twice and streamed, or an iterable of row dicts.
+    """
+    if isinstance(rows, str):
+        return iter_sheet_groups(rows, "Book_Title")
+    rows = list(rows)
+    return iter_groups(rows, "Book_Title", group_ends(rows, "Book_Title"))
+
+def plan_books(rows) -> dict[str, list[Section]]:
+    """Plans every book in the prompt-sheet rows (see iter_book_groups); see plan_book."""
+    return {title: plan_book(title, group) for title, group in iter_book_groups(rows)}
+
+def build_doc(title: str, sections: list[Section]) -> Document:
+    """Assembles a generated book in section order, matching the original layout."""
+    os.makedirs(WORD_OUTPUT_DIR, exist_ok=True)
+    return nonfiction_doc(title, sections)
+
+def open_journals(books: dict[str, list[Section]], resume: bool = False,
+                  incremental: bool = False) -> dict[str, SectionJournal]:
+    """
+    Opens one section journal per book; on resume, already journaled sections
+    are filled in. An incremental run only fills in the sections whose inputs
+    still match the book's manifest from the previous run.
+    """
+    journals = {}
+    for title, sections in books.items():
+        journal = SectionJournal(journal_path(WORD_OUTPUT_DIR, title), resume=resume or incremental)
+        done = journal.load()
+        if incremental:
+            reused = reuse_unchanged(sections, done, load_manifest(manifest_path(WORD_OUTPUT_DIR, title)))
+            incremental_stats["skipped"] += reused
+            incremental_stats["sections"] += len(sections)
+            if reused < len(sections):
+                print(f"✏️ '{title}': {len(sections) - reused} of {len(sections)} sections changed or missing")
+        else:
+            for section in sections:
+                section.text = done.get(section.key, "")
+            if done:
+                print(f"⏩ Resuming '{title}': {len(done)} of {len(sections)} sections already journaled")
+        journals[title] = journal
+    return journals
+
+async def generate_books(books: dict[str, list[Section]], concurrency: int = DEFAULT_CONCURRENCY,
+                         journals: dict[str, SectionJournal] | None = None, semaphore=None):
+    """
+    Sends every section of every book concurrently, at most `concurrency` at a
+    time, longest expected call first. Callers generating several batches at
+    once share one `semaphore`; when it is a PriorityGate, the longest call of
+    all those batches goes first.
+    """
+    pending = scheduler.dispatch(section for sections in books.values() for section in sections)
+    print(f"🚀 Generating {len(pending)} sections for {len(books)} book(s), {concurrency} in flight")
+
+    async def agenerate(section: Section) -> str:
+        on_delta = None
+        if journals is not None and llm.STREAM:
+            journal = journals[section.book]
+            on_delta = lambda delta, attempt: journal.append_delta(section.key, delta, attempt)
+        with scheduler.timed(section):
+            return await agenerate_text(section.prompt, on_delta, section.context, section.model or MODEL,
+                                        section.max_tokens)
+
+    def record(section: Section):
+        if journals is not None and section.text.strip():
+            journals[section.book].append(section.key, section.text)
+
+    await generate_sections(pending, agenerate, concurrency, on_complete=record, semaphore=semaphore,
+                            priority=scheduler.predict if scheduler.lpt else None)
+
+def generate_books_batch(books: dict[str, list[Section]], journals: dict[str, SectionJournal],
+                         backend: str = "openai", poll_interval: float = 60.0):
+    """Generates every pending section through one Batch API job instead of interactive calls."""
+    pending = [section for sections in books.values() for section in sections
+               if not section.text and isinstance(section.prompt, str) and section.prompt.strip()]
+    requests = [(custom_id(section.book, section.key), section_request(section, section.context))
+                for section in pending]
+    workdir = os.path.join(WORD_OUTPUT_DIR, ".batch")
+    texts, errors = run_batch(requests, make_backend(backend, workdir), workdir, poll_interval)
+
+    for section in pending:
+        cid = custom_id(section.book, section.key)
+        if cid in texts:
+            section.text = texts[cid]
+            if section.text.strip():
+                journals[section.book].append(section.key, section.text)
+        else:
+            section.error = errors.get(cid, "missing from batch output")
+
+def finish_books(books: dict[str, list[Section]], journals: dict[str, SectionJournal], pool: DocumentPool,
+                 incremental: bool = False) -> list:
+    """
+    Closes each book's journal, records its manifest and hands every book
+    whose sections all succeeded to `pool` for assembly. An incremental run
+    keeps the existing document of a book whose sections are all unchanged.
+    Returns futures of the saved paths.
+    """
+    futures = []
+    for title, sections in books.items():
+        journals[title].close()
+        path = manifest_path(WORD_OUTPUT_DIR, title)
+        previous = load_manifest(path)
+        hashes = save_manifest(path, sections)
+        failed = [section for section in sections if section.error]
+        if failed:
+            print(f"\n⚠️ Not assembling '{title}': {len(failed)} section(s) failed. Rerun with --resume to retry them.")
+            continue
+        if incremental and hashes == previous and os.path.exists(book_path(title)):
+            incremental_stats["kept"] += 1
+            print(f"⏩ '{title}' is unchanged, keeping {book_path(title)}")
+            continue
+        print(f"\n📘 Assembling book: {title}")
+        futures.append(pool.submit(save_nonfiction_book, book_path(title), title, sections))
+    return futures
+
+async def build_books(rows, pool: DocumentPool, concurrency: int = DEFAULT_CONCURRENCY,
+                      books_in_flight: int = BOOKS_IN_FLIGHT, resume: bool = False,
+                      incremental: bool = False) -> list[str]:
+    """
+    Streams the prompt rows (see iter_book_groups; pass the workbook path to
+    keep memory bounded) one book at a time and takes each book from plan
+    to saved DOCX on its own. At most `books_in_flight` books are held at
+    once, and nothing of a book is kept after its document is saved, so
+    memory depends on `books_in_flight` rather than on the size of the sheet.
+    All books share one cap of `concurrency` requests in flight, which starts
+    the longest pending section of all books in flight first. Returns the
+    saved paths.
+    """
+    semaphore = PriorityGate(concurrency)
+    groups = iter_book_groups(rows)
+    saved = []
+
+    async def build():
+        # The workers share one row iterator; next() never awaits, so each book goes to exactly one worker.
+        for title, group in groups:
+            books = {title: plan_book(title, group)}
+            del group
+            journals = open_journals(books, resume, incremental)
+            await generate_books(books, concurrency, journals, semaphore)
+            for future in finish_books(books, journals, pool, incremental):
+                saved.append(await asyncio.wrap_future(future))
+                print(f"💾 Saved book to: {saved[-1]}")
+            del books, journals
+
+    await asyncio.gather(*(build() for _ in range(max(1, int(books_in_flight)))))
+    return saved
+
+# ── MAIN PIPELINE ──────────────────────────────────────────────────────────────
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate non-fiction books from the stage-1 prompts workbook.")
+    parser.add_argument("--prompts", default=PROMPTS_EXCEL, help="Prompts workbook produced by stage 1.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Maximum number of OpenAI requests in flight.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse sections already in each book's journal instead of regenerating them.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only regenerate sections whose prompt, model or parameters changed since the last "
+                             "run, and only rebuild the books they belong to. Editing a book's description, "
+                             "profile or style rules regenerates the whole book; editing its outline (chapter "
+                             "or subheading titles) does not regenerate the other sections.")
+    parser.add_argument("--stream", action="store_true", default=llm.STREAM,
+                        help="Stream completions, journaling text as it arrives and re-issuing stalled calls.")
+    parser.add_argument("--stall-timeout", type=float, default=llm.STALL_TIMEOUT,
+                        help="Seconds without a streamed chunk before a call is abandoned and re-issued.")
+    parser.add_argument("--docx-workers", type=int, default=DEFAULT_DOCX_WORKERS,
+                        help="Processes assembling DOCX files (0 or 1 builds them on a background thread).")
+    parser.add_argument("--export", choices=EXPORT_BACKENDS, default=EXPORT_BACKEND,
+                        help="DOCX writer: python-docx, or 'stream' to write the zip directly.")
+    parser.add_argument("--formats", default=",".join(EXTRA_FORMATS),
+                        help="Extra formats written next to each DOCX, comma-separated: epub, md.")
+    parser.add_argument("--schedule", action="store_true", default=SCHEDULE,
+                        help="Cap each section's max_tokens from its prompt's word count and Word_Goal, and send "
+                             "short sections to --fast-model. Sections of all books in flight are always "
+                             "started longest expected call first.")
+    parser.add_argument("--fast-model", default=FAST_MODEL,
+                        help="Model for sections of at most BOOKMAKER_FAST_MAX_WORDS words (needs --schedule).")
+    parser.add_argument("--books-in-flight", type=int, default=BOOKS_IN_FLIGHT,
+                        help="Books generated at the same time; each is released once its DOCX is saved.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit all pending sections as one Batch API job instead of interactive calls "
+                             "(plans and holds every book at once).")
+    parser.add_argument("--batch-backend", choices=["openai", "local"], default="openai",
+                        help="Where to run the batch; 'local' executes it in-process.")
+    parser.add_argument("--poll-interval", type=float, default=60.0,
+                        help="Seconds between batch status checks.")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    llm.STREAM, llm.STALL_TIMEOUT = args.stream, args.stall_timeout
+    scheduler.budgets, scheduler.fast_model = args.schedule, args.fast_model
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    with DocumentPool(args.docx_workers, args.export, formats) as pool:
+        if args.batch:
+            books = plan_books(args.prompts)
+            journals = open_journals(books, resume=args.resume, incremental=args.incremental)
+            generate_books_batch(books, journals, args.batch_backend, args.poll_interval)
+            for future in finish_books(books, journals, pool, incremental=args.incremental):
+                print(f"💾 Saved book to: {future.result()}")
+        else:
+            asyncio.run(build_books(args.prompts, pool, args.concurrency, args.books_in_flight,
+                                    args.resume, args.incremental))
+            print(scheduler.summary(min(args.concurrency, llm.MAX_IN_FLIGHT)))
+    if args.incremental:
+        print(f"⏭️ Incremental run: skipped {incremental_stats['skipped']} of {incremental_stats['sections']} "
+              f"section calls, kept {incremental_stats['kept']} unchanged book(s)")
+    print(llm.summary())
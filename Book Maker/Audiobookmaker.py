@@ -0,0 +1,72 @@
+import os
+import sys
+import glob
+import argparse
+
+from bookmaker import llm
+from bookmaker.audio import (DEFAULT_CACHE_DIR, DEFAULT_TTS_WORKERS, MAX_CHUNK_CHARS, TTS_MODEL, TTS_VOICE,
+                             AudioCache, make_audiobook, make_tts)
+from bookmaker.retry import GenerationError
+
+# ── CONFIGURATION ──────────────────────────────────────────────────────────────
+
+BOOKS_DIR = "/Users/kuldeepsharma/Desktop/projectcode/WordOutput"
+AUDIO_OUTPUT_DIR = "/Users/kuldeepsharma/Desktop/projectcode/Audiobooks"
+
+# ── HELPERS ────────────────────────────────────────────────────────────────────
+
+def find_books(paths: list[str]) -> list[str]:
+    """DOCX files given directly, plus every DOCX directly inside the given directories."""
+    books = []
+    for path in paths:
+        if os.path.isdir(path):
+            books.extend(sorted(p for p in glob.glob(os.path.join(glob.escape(path), "*.docx"))
+                                if not os.path.basename(p).startswith("~$")))
+        else:
+            books.append(path)
+    return books
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Turn generated DOCX books into audiobooks, one audio file per chapter.")
+    parser.add_argument("books", nargs="*", default=[BOOKS_DIR],
+                        help="DOCX files or directories of them (default: the non-fiction output folder).")
+    parser.add_argument("--output-dir", default=AUDIO_OUTPUT_DIR, help="Where each book's audio folder is written.")
+    parser.add_argument("--backend", choices=["openai", "tone"], default="openai",
+                        help="TTS backend; 'tone' renders synthetic tones locally, for tests.")
+    parser.add_argument("--model", default=TTS_MODEL, help="OpenAI TTS model.")
+    parser.add_argument("--voice", default=TTS_VOICE, help="OpenAI TTS voice (alloy, echo, fable, onyx, nova, shimmer).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_TTS_WORKERS, help="Chunks synthesised in parallel.")
+    parser.add_argument("--max-chars", type=int, default=MAX_CHUNK_CHARS,
+                        help="Longest chunk of whole sentences sent in one TTS call.")
+    parser.add_argument("--format", choices=["wav", "mp3"], default="wav",
+                        help="Chapter file format; mp3 needs pydub and ffmpeg.")
+    parser.add_argument("--author", default="", help="Author read in the intro (default: the book's 'By' line).")
+    parser.add_argument("--cache-dir", default=os.getenv("BOOKMAKER_TTS_CACHE_DIR", DEFAULT_CACHE_DIR),
+                        help="Cache of rendered chunks, so edited books only re-render changed text.")
+    parser.add_argument("--no-cache", action="store_true", help="Render every chunk, and cache nothing.")
+    return parser.parse_args(argv)
+
+# ── MAIN ───────────────────────────────────────────────────────────────────────
+
+if __name__ == "__main__":
+    args = parse_args()
+    backend = make_tts(args.backend, args.voice, args.model)
+    cache = None if args.no_cache else AudioCache(args.cache_dir)
+    books = find_books(args.books)
+    if not books:
+        sys.exit(f"No DOCX books found in: {', '.join(args.books)}")
+
+    failed = 0
+    for path in books:
+        try:
+            make_audiobook(path, args.output_dir, backend, cache, args.workers, args.max_chars, args.author,
+                           args.format)
+        except GenerationError as e:
+            failed += 1
+            print(f"❌ Skipped audiobook for {path}: TTS failed ({e.kind}): {e}")
+
+    print(f"🎧 {len(books) - failed} of {len(books)} audiobook(s) rendered")
+    if cache is not None:
+        print(f"🗄️ TTS chunk cache: {cache.hits} hits, {cache.misses} rendered")
+    if args.backend == "openai":
+        print(llm.summary())
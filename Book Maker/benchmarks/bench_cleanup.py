@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the section cleanup stage (bookmaker.cleanup).
+
+Builds a synthetic corpus of --words words (1M by default) split into
+non-fiction and kids sections. The sections carry the usual noise of
+generated text: echoed headings, "Chapter N" labels, markdown markers and
+dialogue in quotes. The corpus is cleaned by:
+
+    legacy   the per-call passes the builders used before bookmaker.cleanup:
+             format_text after clean_intro/clean_subsection, which split the
+             lines again, lowercase the title per line and use uncompiled
+             regexes
+    engine   clean_sections inline, in one process
+    pool     clean_sections on --workers spawned processes (at most one per CPU,
+             so it runs inline on a single CPU)
+
+Before timing, a few fixed cases check that echo removal only drops
+lines that are nothing but the heading or a "Chapter N" label: dialogue
+and sentences that mention the heading survive, in kids fiction any line
+does. Each mode is timed over --repeat runs and the best run is kept. The
+run fails if a case fails, or if the engine is slower than legacy or below
+--min-words-per-sec.
+
+    python benchmarks/bench_cleanup.py
+    python benchmarks/bench_cleanup.py --words 5000000 --workers 4
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bookmaker.cleanup import clean_sections, clean_text  # noqa: E402
+from bookmaker.engine import Section  # noqa: E402
+
+MODES = ("legacy", "engine", "pool")
+WORDS = ("habit focus river lantern quiet brave garden window morning carefully system method "
+         "result question answer simple together practice reader change").split()
+
+
+def sentence(rng: random.Random) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+    roll = rng.random()
+    if roll < 0.15:
+        return f'"{text}" said Mia.'
+    if roll < 0.25:
+        return f"**{text}**"
+    return text
+
+
+def section_text(rng: random.Random, heading: str, words: int) -> str:
+    lines = [f"## {heading}", ""] if rng.random() < 0.5 else []
+    count = 0
+    while count < words:
+        paragraph = " ".join(sentence(rng) for _ in range(rng.randint(3, 7)))
+        lines += [paragraph, ""]
+        count += len(paragraph.split())
+    return "\n".join(lines)
+
+
+def make_corpus(words: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    sections, total, n = [], 0, 0
+    while total < words:
+        n += 1
+        chapter = f"Chapter {n}: The {rng.choice(WORDS).title()} {rng.choice(WORDS).title()}"
+        batch = [Section("Bench", f"ch{n:03d}", "chapter_intro", chapter, 1, ""),
+                 Section("Bench", f"ch{n:03d}.sub1", "subheading", f"The {rng.choice(WORDS)} method", 2, ""),
+                 Section("Bench", f"k{n:03d}", "chapter", f"The {rng.choice(WORDS).title()} Adventure", 1, "")]
+        for section, size in zip(batch, (200, 500, 900)):
+            section.text = section_text(rng, section.heading, size)
+            total += len(section.text.split())
+        sections += batch
+    return sections
+
+
+# (kind, heading, text, expected paragraphs)
+CASES = [
+    ("chapter", "Chapter 1: Home",
+     'Chapter 1: Home\n"Let\'s go home," said Mia.\nChapter 2 was where the fun began.\nMia ran to the door.',
+     ["Chapter 1: Home", '"Let\'s go home," said Mia.', "Chapter 2 was where the fun began.", "Mia ran to the door."]),
+    ("chapter_intro", "Chapter 3: The Power of Habits",
+     '## Chapter 3: The Power of Habits\nThe Power of Habits.\nChapter 3\nChapter 3 - Habits\n'
+     '"The power of habits," she said, "is real."\nChapter 3 shows how habits form.',
+     ['"The power of habits," she said, "is real."', "Chapter 3 shows how habits form."]),
+    ("subheading", "Home", '**Home**\n"Home," said Mia.\nHome is where we start.',
+     ['"Home," said Mia.', "Home is where we start."]),
+]
+
+
+def check_cases() -> list[str]:
+    """The CASES whose cleaned paragraphs differ from the expected ones."""
+    problems = []
+    for kind, heading, text, expected in CASES:
+        got = clean_text(kind, heading, text)
+        if got != expected:
+            problems.append(f"{kind} '{heading}': expected {expected!r}, got {got!r}")
+    return problems
+
+
+# The cleanup passes of the builders before bookmaker.cleanup, kept here as the baseline.
+
+def legacy_format_text(text: str) -> str:
+    return re.sub(r"[\*#\"]", "", text or "").strip()
+
+
+def legacy_clean_intro(text: str, chapter_title: str) -> str:
+    lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
+    cleaned = []
+    subtitle = chapter_title.split(":")[-1].strip().lower()
+    full_title = chapter_title.strip().lower()
+    for line in lines:
+        l = line.lower()
+        if subtitle in l or full_title in l or re.match(r'chapter\s*\d+', l):
+            continue
+        cleaned.append(line)
+    return "\n".join(cleaned).strip()
+
+
+def legacy_clean_subsection(text: str, subheading: str) -> str:
+    lines = [line.strip() for line in text.strip().split("\n") if line.strip()]
+    sub_name = subheading.strip().lower()
+    return "\n".join(line for line in lines if sub_name not in line.lower()).strip()
+
+
+def legacy(sections) -> list:
+    out = []
+    for section in sections:
+        if section.kind == "chapter_intro":
+            text = legacy_clean_intro(section.text, section.heading)
+        elif section.kind == "subheading":
+            text = legacy_clean_subsection(section.text, section.heading)
+        else:
+            text = section.text
+        out.append([line for line in legacy_format_text(text).split("\n") if line.strip()])
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--words", type=int, default=1_000_000, help="Words in the synthetic corpus.")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated subset of " + ", ".join(MODES) + ".")
+    parser.add_argument("--workers", type=int, default=max(2, min(4, os.cpu_count() or 1)),
+                        help="Processes for the pool mode.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode; the fastest is reported.")
+    parser.add_argument("--min-words-per-sec", type=float, default=1_000_000,
+                        help="Fail if the inline engine cleans fewer words per second.")
+    args = parser.parse_args(argv)
+
+    problems = check_cases()
+    for problem in problems:
+        print(f"❌ {problem}")
+    if not problems:
+        print(f"✅ {len(CASES)} echo cases keep dialogue and body lines")
+
+    sections = make_corpus(args.words)
+    words = sum(len(section.text.split()) for section in sections)
+    print(f"📚 {len(sections):,} sections, {words:,} words")
+    runners = {"legacy": lambda: legacy(sections), "engine": lambda: clean_sections(sections),
+               "pool": lambda: clean_sections(sections, args.workers)}
+    results = {}
+    print(f"{'mode':<10}{'best':>9}{'words/sec':>14}{'paragraphs':>12}")
+    for mode in (m.strip() for m in args.modes.split(",") if m.strip()):
+        best, out = None, None
+        for _ in range(max(1, args.repeat)):
+            started = time.perf_counter()
+            out = runners[mode]()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[mode] = best
+        print(f"{mode:<10}{best:>8.3f}s{words / best:>14,.0f}{sum(len(p) for p in out):>12,}")
+
+    failed = bool(problems)
+    if "engine" in results:
+        failed |= words / results["engine"] < args.min_words_per_sec
+        if "legacy" in results:
+            print(f"engine vs legacy: {results['legacy'] / results['engine']:.2f}x")
+            failed |= results["engine"] > results["legacy"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
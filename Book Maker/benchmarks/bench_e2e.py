@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for the Book Maker scripts against a local fake OpenAI server.
+
+Starts `bookmaker.fakeserver` in this process with the requested latency
+distribution, tokens/sec and 429/timeout injection. Then, for every
+workload and input size, it runs one fresh interpreter against a synthetic
+input sheet:
+
+    prompts       create_prompts_excel from "2. nonfiction_prompts.py"
+    nonfiction    build_books from "2. nonfiction_bookmake.py"
+    kids_fiction  process_books from "kids fiction stage 2/kids_fiction_bookmake.py"
+
+For each run it reports makespan, throughput (books/min and calls/sec),
+peak RSS (including the DOCX worker processes), and bytes written. As with
+bench_startup.py, results can be saved with --json and compared against a
+saved baseline with --baseline. With --interleave, the stage-2 sheets list
+chapter 1 of every book, then chapter 2, and so on, and a run fails unless
+every book is saved.
+
+    python benchmarks/bench_e2e.py --sizes 1,50 --json e2e.json
+    python benchmarks/bench_e2e.py --sizes 1,50 --baseline e2e.json --tolerance 0.25
+    python benchmarks/bench_e2e.py --latency-distribution lognormal --rate-limit-prob 0.05 --timeout-prob 0.01
+    python benchmarks/bench_e2e.py --workloads nonfiction,kids_fiction --sizes 5 --interleave
+    BOOKMAKER_HEDGE=1 python benchmarks/bench_e2e.py --latency-distribution lognormal --latency-sigma 1.0
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bookmaker.fakeserver import FakeOpenAIServer, FakeServerConfig  # noqa: E402
+
+WORKLOADS = ("prompts", "nonfiction", "kids_fiction")
+SCRIPTS = {
+    "prompts": "2. nonfiction_prompts.py",
+    "nonfiction": "2. nonfiction_bookmake.py",
+    "kids_fiction": os.path.join("kids fiction stage 2", "kids_fiction_bookmake.py"),
+}
+
+# ── SYNTHETIC INPUT SHEETS ─────────────────────────────────────────────────────
+
+def write_title_sheet(path: str, books: int, chapters: int):
+    from bookmaker.sheets import RowWriter
+    with RowWriter(path, ["Book Title", "Chapters_required", "Chapter_Structure"]) as writer:
+        for b in range(books):
+            writer.append({"Book Title": f"Benchmark Book {b:04d}", "Chapters_required": chapters,
+                           "Chapter_Structure": "Problem, insight, practice"})
+
+
+def write_prompt_sheet(path: str, columns: list, books: int, chapters: int, interleave: bool = False):
+    """One row per chapter; with `interleave`, chapter 1 of every book, then chapter 2 of every book, ..."""
+    from bookmaker.sheets import RowWriter
+    order = ([(b, c) for c in range(chapters) for b in range(books)] if interleave
+             else [(b, c) for b in range(books) for c in range(chapters)])
+    with RowWriter(path, columns) as writer:
+        for b, c in order:
+            title = f"Benchmark Book {b:04d}"
+            row = {"Book_Title": title, "Chapter_Title": f"Chapter {c + 1}: Topic {c + 1}",
+                   "Intro_Prompt": f"Write an introduction for '{title}'." if c == 0 else "",
+                   "Chapter_Intro": f"Write a 200-word introduction for Chapter {c + 1} of '{title}'.",
+                   "Word_Goal": 2000}
+            for j in range(1, 5):
+                row[f"Subheading_{j}"] = f"Part {c + 1}.{j}"
+                row[f"Subheading_{j}_Prompt"] = f"Write a 500-word section on 'Part {c + 1}.{j}' of '{title}'."
+            writer.append(row)
+
+
+def write_kids_sheet(path: str, books: int, chapters: int, interleave: bool = False):
+    """One row per chapter; with `interleave`, chapter 1 of every book, then chapter 2 of every book, ..."""
+    from bookmaker.sheets import RowWriter
+    columns = ["Book Title", "Author Name", "Chapter", "Chapter Prompt", "Prologue"]
+    order = ([(b, c) for c in range(chapters) for b in range(books)] if interleave
+             else [(b, c) for b in range(books) for c in range(chapters)])
+    with RowWriter(path, columns) as writer:
+        for b, c in order:
+            title = f"Benchmark Kids Book {b:04d}"
+            last = c == chapters - 1
+            writer.append({"Book Title": title, "Author Name": "Bench Author",
+                           "Chapter": "Epilogue" if last else f"Chapter {c + 1}: Adventure {c + 1}",
+                           "Chapter Prompt": f"Write chapter {c + 1} of the children's story '{title}'.",
+                           "Prologue": f"Write a short prologue for '{title}'." if c == 0 else None})
+
+# ── CHILD: ONE WORKLOAD IN A FRESH INTERPRETER ─────────────────────────────────
+
+def run_workload(workload: str, size: int, chapters: int, workdir: str, concurrency: int, workers: int,
+                 docx_workers: int, interleave: bool = False) -> dict:
+    from bookmaker import llm
+    from bookmaker.scripts import load_script
+
+    inputs, outputs = os.path.join(workdir, "input"), os.path.join(workdir, "output")
+    os.makedirs(inputs, exist_ok=True)
+    os.makedirs(outputs, exist_ok=True)
+    module = load_script(SCRIPTS[workload])
+
+    if workload == "prompts":
+        source = os.path.join(inputs, "book_input.xlsx")
+        write_title_sheet(source, size, chapters)
+        started = time.perf_counter()
+        module.create_prompts_excel(source, os.path.join(outputs, "Book_Generated_Content.xlsx"), workers,
+                                    sidecars=(), dedupe=False)
+    elif workload == "nonfiction":
+        import asyncio
+        from bookmaker.documents import DocumentPool
+        source = os.path.join(inputs, "Book_Generated_Content.xlsx")
+        write_prompt_sheet(source, load_script(SCRIPTS["prompts"]).PROMPT_COLUMNS, size, chapters, interleave)
+        module.WORD_OUTPUT_DIR = outputs
+        started = time.perf_counter()
+        with DocumentPool(docx_workers) as pool:
+            asyncio.run(module.build_books(source, pool, concurrency))
+    else:
+        from bookmaker.documents import DocumentPool
+        source = os.path.join(inputs, "kids_fiction_output.xlsx")
+        write_kids_sheet(source, size, chapters, interleave)
+        module.INPUT_PATH, module.OUTPUT_DIR = source, outputs
+        started = time.perf_counter()
+        with DocumentPool(docx_workers) as pool:
+            module.process_books(pool)
+    makespan = time.perf_counter() - started
+    if interleave and workload != "prompts":
+        saved = sum(name.endswith(".docx") for _, _, names in os.walk(outputs) for name in names)
+        if saved != size:
+            raise RuntimeError(f"interleaved sheet: {saved} of {size} books saved")
+
+    written = sum(os.path.getsize(os.path.join(folder, name))
+                  for folder, _, names in os.walk(outputs) for name in names)
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform != "darwin":
+        peak *= 1024  # Linux reports KiB, macOS bytes
+    return {
+        "books": size,
+        "makespan_s": makespan,
+        "books_per_min": size / makespan * 60 if makespan else 0.0,
+        "calls": llm.stats["calls"],
+        "calls_per_s": llm.stats["calls"] / makespan if makespan else 0.0,
+        "retries": llm.stats["retries"],
+        "hedges": llm.stats["hedges"],
+        "failures": llm.stats["failures"],
+        "peak_rss_mb": peak / (1024 * 1024),
+        "bytes_written": written,
+    }
+
+# ── PARENT: SERVER, RUNS AND REPORT ────────────────────────────────────────────
+
+def measure(workload: str, size: int, args, base_url: str) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"bench-{workload}-{size}-", dir=args.workdir)
+    result_path = os.path.join(workdir, "result.json")
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench", BOOKMAKER_CACHE="off",
+               BOOKMAKER_TIMEOUT=str(args.client_timeout), BOOKMAKER_RETRY_BASE_DELAY="0.05",
+               BOOKMAKER_RETRY_MAX_DELAY="1", BOOKMAKER_RPM=str(args.rpm), BOOKMAKER_TPM=str(args.tpm),
+               PYTHONDONTWRITEBYTECODE="1")
+    env.pop("BOOKMAKER_TRACE", None)
+    command = [sys.executable, os.path.abspath(__file__), "--child", workload, "--size", str(size),
+               "--chapters", str(args.chapters), "--workdir", workdir, "--result", result_path,
+               "--concurrency", str(args.concurrency), "--workers", str(args.workers),
+               "--docx-workers", str(args.docx_workers)] + (["--interleave"] if args.interleave else [])
+    try:
+        out = subprocess.run(command, capture_output=True, text=True, env=env, cwd=ROOT)
+        if out.returncode != 0 or not os.path.exists(result_path):
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,50,500", help="Comma-separated numbers of titles per run.")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="Comma-separated subset of " +
+                        ", ".join(WORKLOADS) + ".")
+    parser.add_argument("--chapters", type=int, default=5, help="Chapters per synthetic title.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Stage-2 requests in flight.")
+    parser.add_argument("--workers", type=int, default=8, help="Stage-1 titles in parallel.")
+    parser.add_argument("--docx-workers", type=int, default=2)
+    parser.add_argument("--interleave", action="store_true",
+                        help="Interleave the stage-2 sheets' rows across books and require every book to be saved.")
+    parser.add_argument("--min-latency", type=float, default=0.02)
+    parser.add_argument("--max-latency", type=float, default=0.08)
+    parser.add_argument("--latency-distribution", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--completion-words", type=int, default=300, help="Words per fake completion.")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0)
+    parser.add_argument("--timeout-prob", type=float, default=0.0)
+    parser.add_argument("--client-timeout", type=float, default=5.0,
+                        help="BOOKMAKER_TIMEOUT for the runs; injected timeouts hang just past it.")
+    parser.add_argument("--rpm", type=float, default=1e6,
+                        help="BOOKMAKER_RPM for the runs; the default keeps the client budget out of the way.")
+    parser.add_argument("--tpm", type=float, default=1e9, help="BOOKMAKER_TPM for the runs.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--workdir", help="Parent directory for run outputs (default: system temp).")
+    parser.add_argument("--keep", action="store_true", help="Keep each run's generated files.")
+    parser.add_argument("--json", help="Write results to this file.")
+    parser.add_argument("--baseline", help="Compare against results saved with --json.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative slowdown / RSS growth before failing.")
+    parser.add_argument("--child", choices=WORKLOADS, help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        result = run_workload(args.child, args.size, args.chapters, args.workdir, args.concurrency,
+                              args.workers, args.docx_workers, args.interleave)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+        return 0
+
+    random.seed(args.seed)
+    config = FakeServerConfig(min_latency=args.min_latency, max_latency=args.max_latency,
+                              rate_limit_prob=args.rate_limit_prob, retry_after=0.05,
+                              tokens_per_sec=args.tokens_per_sec, latency_distribution=args.latency_distribution,
+                              latency_sigma=args.latency_sigma, timeout_prob=args.timeout_prob,
+                              timeout_seconds=args.client_timeout + 1, completion_words=args.completion_words)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    workloads = [name.strip() for name in args.workloads.split(",") if name.strip()]
+
+    results = {}
+    print(f"{'run':<22}{'makespan':>10}{'books/min':>11}{'calls/s':>9}{'retries':>9}{'hedges':>8}{'peak RSS':>11}"
+          f"{'written':>11}")
+    with FakeOpenAIServer(config) as server:
+        for workload in workloads:
+            for size in sizes:
+                name = f"{workload}:{size}"
+                r = results[name] = measure(workload, size, args, server.base_url)
+                if "error" in r:
+                    print(f"{name:<22}  ERROR: {r['error']}")
+                    continue
+                print(f"{name:<22}{r['makespan_s']:>9.2f}s{r['books_per_min']:>11.1f}{r['calls_per_s']:>9.1f}"
+                      f"{r['retries']:>9}{r.get('hedges', 0):>8}{r['peak_rss_mb']:>9.1f}MB{r['bytes_written'] / 1e6:>9.2f}MB")
+        print(f"fake server: {server.counts}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = any("error" in r or r.get("failures") for r in results.values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name, r in results.items():
+            base = baseline.get(name)
+            if not base or "error" in r or "error" in base:
+                continue
+            for metric in ("makespan_s", "peak_rss_mb", "bytes_written"):
+                if r[metric] > base[metric] * (1 + args.tolerance):
+                    print(f"❌ {name}: {metric} regressed {base[metric]:.3f} -> {r[metric]:.3f}")
+                    failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
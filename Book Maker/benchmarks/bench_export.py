@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Export benchmark: python-docx against the streaming writer of
+`bookmaker.export`.
+
+For each book kind (kids fiction, non-fiction) a synthetic long book is
+saved once per backend, each in a fresh interpreter, and the time to save
+it and the child's peak RSS are reported. Before timing, a small book of
+each kind is saved with both backends, read back with python-docx and
+compared paragraph by paragraph (style, alignment, text, page breaks,
+Normal font), so the numbers are only reported for equivalent output.
+
+    python benchmarks/bench_export.py                         # 300 chapters of 3,000 words
+    python benchmarks/bench_export.py --chapters 200 --kinds kids --formats epub,md
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bookmaker.documents import EXPORT_BACKENDS, save_kids_fiction_book, save_nonfiction_book  # noqa: E402
+from bookmaker.engine import Section  # noqa: E402
+
+KINDS = ("kids", "nonfiction")
+WORDS = ("river lantern quiet brave garden window market paper thunder honest little morning "
+         "carefully system method result chapter question answer simple between together").split()
+
+
+def paragraph(rng: random.Random, words: int) -> str:
+    sentences, left = [], words
+    while left > 0:
+        n = min(left, rng.randint(8, 20))
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + ".")
+        left -= n
+    return " ".join(sentences)
+
+
+def chapter_text(rng: random.Random, words: int) -> str:
+    return "\n\n".join(paragraph(rng, 120) for _ in range(max(1, words // 120)))
+
+
+def make_sections(kind: str, chapters: int, words: int, seed: int = 1):
+    rng = random.Random(seed)
+    if kind == "kids":
+        sections = [Section("Bench", "prologue", "prologue", "Prologue", 1, "", text=chapter_text(rng, words))]
+        sections += [Section("Bench", f"ch{i:02d}", "chapter", f"Chapter {i}: The {rng.choice(WORDS)}", 1, "",
+                             text=chapter_text(rng, words)) for i in range(1, chapters + 1)]
+        return sections
+    sections = [Section("Bench", "intro", "intro", "Introduction", 1, "", text=chapter_text(rng, words))]
+    for i in range(1, chapters + 1):
+        sections.append(Section("Bench", f"ch{i:02d}", "chapter_intro", f"Chapter {i}", 1, "",
+                                text=f"The {rng.choice(WORDS)}\n" + chapter_text(rng, words // 4)))
+        for j in range(1, 4):
+            sections.append(Section("Bench", f"ch{i:02d}.sub{j}", "subheading", f"Part {j}", 2, "",
+                                    text=chapter_text(rng, words // 4)))
+    return sections
+
+
+def save(kind: str, path: str, sections, backend: str, formats=()) -> str:
+    if kind == "kids":
+        return save_kids_fiction_book(path, "Bench", "A. Writer", sections, backend, formats)
+    return save_nonfiction_book(path, "Bench", sections, backend, formats)
+
+
+def read_back(path: str):
+    """(style, alignment, line, page break) per body line, and the Normal font, as python-docx sees them."""
+    from docx import Document
+
+    doc = Document(path)
+    rows = []
+    for p in doc.paragraphs:
+        page_break = any(run._r.xpath('./w:br[@w:type="page"]') for run in p.runs)
+        lines = [line.strip() for line in p.text.split("\n") if line.strip()] or [""]
+        if p.style.name != "Normal" or p.alignment is not None:
+            lines = [p.text]
+        rows += [(p.style.name, str(p.alignment), line, page_break) for line in lines]
+    normal = doc.styles["Normal"].font
+    return rows, (normal.name, normal.size)
+
+
+def check_equivalence(workdir: str) -> bool:
+    ok = True
+    for kind in KINDS:
+        sections = make_sections(kind, 3, 600, seed=7)
+        reference = read_back(save(kind, os.path.join(workdir, f"check-{kind}-docx.docx"), sections, "python-docx"))
+        streamed = read_back(save(kind, os.path.join(workdir, f"check-{kind}-stream.docx"), sections, "stream"))
+        same = reference == streamed
+        ok &= same
+        print(f"{'✅' if same else '❌'} {kind}: streamed DOCX {'matches' if same else 'differs from'} python-docx "
+              f"({len(reference[0])} paragraphs)")
+    return ok
+
+
+def run_child(kind: str, backend: str, chapters: int, words: int, formats, workdir: str) -> dict:
+    sections = make_sections(kind, chapters, words)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    path = save(kind, os.path.join(workdir, f"{kind}.docx"), sections, backend, formats)
+    elapsed = time.perf_counter() - started
+    scale = 1 if sys.platform == "darwin" else 1024  # Linux reports KiB, macOS bytes
+    return {
+        "seconds": elapsed,
+        "words": sum(len(section.text.split()) for section in sections),
+        "docx_mb": os.path.getsize(path) / (1024 * 1024),
+        "baseline_rss_mb": before * scale / (1024 * 1024),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024),
+    }
+
+
+def measure(kind: str, backend: str, args) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"export-{kind}-{backend}-", dir=args.workdir)
+    result_path = os.path.join(workdir, "result.json")
+    command = [sys.executable, os.path.abspath(__file__), "--child", kind, "--backend", backend,
+               "--chapters", str(args.chapters), "--words", str(args.words), "--formats", args.formats,
+               "--workdir", workdir, "--result", result_path]
+    try:
+        out = subprocess.run(command, capture_output=True, text=True, cwd=ROOT,
+                             env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"))
+        if out.returncode != 0 or not os.path.exists(result_path):
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--kinds", default=",".join(KINDS), help="Comma-separated subset of " + ", ".join(KINDS) + ".")
+    parser.add_argument("--chapters", type=int, default=300, help="Chapters per synthetic book.")
+    parser.add_argument("--words", type=int, default=3000, help="Words per chapter.")
+    parser.add_argument("--formats", default="", help="Extra formats saved with each DOCX, e.g. epub,md.")
+    parser.add_argument("--workdir", help="Parent directory for run outputs (default: system temp).")
+    parser.add_argument("--keep", action="store_true", help="Keep each run's files.")
+    parser.add_argument("--child", choices=KINDS, help=argparse.SUPPRESS)
+    parser.add_argument("--backend", choices=EXPORT_BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+
+    if args.child:
+        result = run_child(args.child, args.backend, args.chapters, args.words, formats, args.workdir)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+        return 0
+
+    check_dir = tempfile.mkdtemp(prefix="export-check-", dir=args.workdir)
+    try:
+        failed = not check_equivalence(check_dir)
+    finally:
+        shutil.rmtree(check_dir, ignore_errors=True)
+
+    print(f"{'run':<24}{'words':>10}{'DOCX':>9}{'time':>9}{'start RSS':>12}{'peak RSS':>11}")
+    for kind in (k.strip() for k in args.kinds.split(",") if k.strip()):
+        results = {}
+        for backend in EXPORT_BACKENDS:
+            name = f"{kind}:{backend}"
+            r = results[backend] = measure(kind, backend, args)
+            if "error" in r:
+                print(f"{name:<24}  ERROR: {r['error']}")
+                failed = True
+                continue
+            print(f"{name:<24}{r['words']:>10,}{r['docx_mb']:>7.1f}MB{r['seconds']:>8.2f}s"
+                  f"{r['baseline_rss_mb']:>10.1f}MB{r['peak_rss_mb']:>9.1f}MB")
+        docx, stream = results["python-docx"], results["stream"]
+        if "error" in docx or "error" in stream:
+            continue
+        docx_growth = docx["peak_rss_mb"] - docx["baseline_rss_mb"]
+        stream_growth = stream["peak_rss_mb"] - stream["baseline_rss_mb"]
+        print(f"{kind}: stream is {docx['seconds'] / stream['seconds']:.1f}x faster, RSS growth "
+              f"{stream_growth:.1f}MB vs {docx_growth:.1f}MB")
+        failed |= stream["seconds"] > docx["seconds"] or stream["peak_rss_mb"] > docx["peak_rss_mb"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
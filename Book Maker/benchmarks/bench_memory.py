@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Peak-memory benchmark for the non-fiction builder on large prompt sheets.
+
+Starts `bookmaker.fakeserver` in this process. For every input size it
+writes a synthetic prompts sheet and runs "2. nonfiction_bookmake.py" in
+a fresh interpreter, in one of two modes:
+
+    streaming  build_books: books are planned, generated and saved a few at a
+               time, and each is released once its DOCX is saved
+    all        plan_books -> generate_books -> finish_books: every book of
+               the sheet is planned and held until the end of the run
+
+DOCX files are built on a thread (--docx-workers 0), so the child's peak
+RSS covers all the work. The run fails if the streaming peak at the
+largest size is more than --max-growth above its peak at the smallest size.
+
+    python benchmarks/bench_memory.py                       # 100 and 1,000 books, both modes
+    python benchmarks/bench_memory.py --sizes 1000 --modes streaming --books-in-flight 8
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_e2e import SCRIPTS, write_prompt_sheet  # noqa: E402
+from bookmaker.fakeserver import FakeOpenAIServer, FakeServerConfig  # noqa: E402
+
+MODES = ("streaming", "all")
+
+
+def run_child(mode: str, size: int, chapters: int, workdir: str, concurrency: int, books_in_flight: int) -> dict:
+    import asyncio
+    from bookmaker import llm
+    from bookmaker.documents import DocumentPool
+    from bookmaker.scripts import load_script
+
+    source = os.path.join(workdir, "Book_Generated_Content.xlsx")
+    write_prompt_sheet(source, load_script(SCRIPTS["prompts"]).PROMPT_COLUMNS, size, chapters)
+    builder = load_script(SCRIPTS["nonfiction"])
+    builder.WORD_OUTPUT_DIR = os.path.join(workdir, "output")
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    with DocumentPool(0) as pool:
+        if mode == "streaming":
+            saved = len(asyncio.run(builder.build_books(source, pool, concurrency, books_in_flight)))
+        else:
+            books = builder.plan_books(source)
+            journals = builder.open_journals(books)
+            asyncio.run(builder.generate_books(books, concurrency, journals))
+            saved = sum(1 for future in builder.finish_books(books, journals, pool) if future.result())
+    makespan = time.perf_counter() - started
+
+    scale = 1 if sys.platform == "darwin" else 1024  # Linux reports KiB, macOS bytes
+    return {
+        "books": saved,
+        "calls": llm.stats["calls"],
+        "makespan_s": makespan,
+        "baseline_rss_mb": before * scale / (1024 * 1024),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1024 * 1024),
+    }
+
+
+def measure(mode: str, size: int, args, base_url: str) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"memory-{mode}-{size}-", dir=args.workdir)
+    result_path = os.path.join(workdir, "result.json")
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench", BOOKMAKER_CACHE="off",
+               BOOKMAKER_RPM="1e6", BOOKMAKER_TPM="1e9", PYTHONDONTWRITEBYTECODE="1")
+    env.pop("BOOKMAKER_TRACE", None)
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--size", str(size),
+               "--chapters", str(args.chapters), "--workdir", workdir, "--result", result_path,
+               "--concurrency", str(args.concurrency), "--books-in-flight", str(args.books_in_flight)]
+    try:
+        out = subprocess.run(command, capture_output=True, text=True, env=env, cwd=ROOT)
+        if out.returncode != 0 or not os.path.exists(result_path):
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000", help="Comma-separated numbers of books per run.")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated subset of " + ", ".join(MODES) + ".")
+    parser.add_argument("--chapters", type=int, default=3, help="Chapters per synthetic book.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--books-in-flight", type=int, default=4)
+    parser.add_argument("--completion-words", type=int, default=600, help="Words per fake completion.")
+    parser.add_argument("--max-growth", type=float, default=0.15,
+                        help="Allowed growth of the streaming peak RSS from the smallest to the largest size.")
+    parser.add_argument("--workdir", help="Parent directory for run outputs (default: system temp).")
+    parser.add_argument("--keep", action="store_true", help="Keep each run's files.")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        result = run_child(args.child, args.size, args.chapters, args.workdir, args.concurrency,
+                           args.books_in_flight)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+        return 0
+
+    sizes = sorted(int(size) for size in args.sizes.split(",") if size.strip())
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    config = FakeServerConfig(min_latency=0.0, max_latency=0.005, completion_words=args.completion_words)
+    results, failed = {}, False
+    print(f"{'run':<18}{'books':>7}{'calls':>8}{'makespan':>10}{'start RSS':>12}{'peak RSS':>11}{'per book':>11}")
+    with FakeOpenAIServer(config) as server:
+        for mode in modes:
+            for size in sizes:
+                name = f"{mode}:{size}"
+                r = results[name] = measure(mode, size, args, server.base_url)
+                if "error" in r:
+                    print(f"{name:<18}  ERROR: {r['error']}")
+                    failed = True
+                    continue
+                failed |= r["books"] != size
+                per_book = (r["peak_rss_mb"] - r["baseline_rss_mb"]) / max(1, size) * 1024
+                print(f"{name:<18}{r['books']:>7}{r['calls']:>8}{r['makespan_s']:>9.1f}s{r['baseline_rss_mb']:>10.1f}MB"
+                      f"{r['peak_rss_mb']:>9.1f}MB{per_book:>9.1f}KB")
+
+    small, large = results.get(f"streaming:{sizes[0]}", {}), results.get(f"streaming:{sizes[-1]}", {})
+    if len(sizes) > 1 and "peak_rss_mb" in small and "peak_rss_mb" in large:
+        growth = large["peak_rss_mb"] / small["peak_rss_mb"] - 1
+        print(f"streaming peak RSS {sizes[0]} -> {sizes[-1]} books: {growth:+.1%}")
+        if growth > args.max_growth:
+            print(f"❌ streaming peak RSS grew more than {args.max_growth:.0%}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Section scheduler benchmark: dispatch order and output budgets.
+
+Starts `bookmaker.fakeserver` in this process with `follow_word_count`, so a
+prompt asking for N words gets N words back, paced at --tokens-per-sec. A
+synthetic prompt sheet with the stage-1 prompt lengths (a 1500-word book
+introduction, 200-word chapter introductions, 500-word sections) is then
+generated by "2. nonfiction_bookmake.py" in a fresh interpreter per mode,
+with every book in one batch (plan_books -> generate_books):
+
+    sheet    sections dispatched in sheet order, no max_tokens
+    lpt      longest expected call first, no max_tokens
+    budgets  longest expected call first, max_tokens from each target length
+
+With --books-in-flight N the sheet is streamed through build_books
+instead, N books at a time. Their sections share one PriorityGate, so
+"lpt" then orders calls across the books in flight.
+
+The scheduler's duration model is set to the fake server's speed, so its
+predicted makespan can be compared with the measured one.
+
+    python benchmarks/bench_schedule.py
+    python benchmarks/bench_schedule.py --books 20 --concurrency 16 --tokens-per-sec 2000
+    python benchmarks/bench_schedule.py --modes sheet,lpt --books-in-flight 4
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_e2e import SCRIPTS  # noqa: E402
+from bookmaker.fakeserver import FakeOpenAIServer, FakeServerConfig  # noqa: E402
+
+MODES = ("sheet", "lpt", "budgets")
+
+
+def write_sheet(path: str, columns: list, books: int, chapters: int):
+    from bookmaker.sheets import RowWriter
+    with RowWriter(path, columns) as writer:
+        for b in range(books):
+            title = f"Schedule Book {b:04d}"
+            for c in range(chapters):
+                row = {"Book_Title": title, "Chapter_Title": f"Chapter {c + 1}: Topic {c + 1}",
+                       "Intro_Prompt": "Write a 1500-word engaging introduction for the book." if c == 0 else "",
+                       "Chapter_Intro": f"Write a 200-word introduction for Chapter {c + 1}.",
+                       "Word_Goal": 2000}
+                for j in range(1, 5):
+                    row[f"Subheading_{j}"] = f"Part {c + 1}.{j}"
+                    row[f"Subheading_{j}_Prompt"] = f"Write a 500-word engaging section on 'Part {c + 1}.{j}'."
+                writer.append(row)
+
+
+def run_child(mode: str, args) -> dict:
+    import asyncio
+    from bookmaker import llm
+    from bookmaker.documents import DocumentPool
+    from bookmaker.scripts import load_script
+
+    source = os.path.join(args.workdir, "Book_Generated_Content.xlsx")
+    write_sheet(source, load_script(SCRIPTS["prompts"]).PROMPT_COLUMNS, args.books, args.chapters)
+    builder = load_script(SCRIPTS["nonfiction"])
+    builder.WORD_OUTPUT_DIR = os.path.join(args.workdir, "output")
+    builder.scheduler.lpt = mode != "sheet"
+    builder.scheduler.budgets = mode == "budgets"
+
+    if args.books_in_flight:
+        started = time.perf_counter()
+        with DocumentPool(0) as pool:
+            asyncio.run(builder.build_books(source, pool, args.concurrency, args.books_in_flight))
+        makespan = time.perf_counter() - started
+        from docx import Document
+        words = sum(len(paragraph.text.split()) for name in os.listdir(builder.WORD_OUTPUT_DIR)
+                    if name.endswith(".docx")
+                    for paragraph in Document(os.path.join(builder.WORD_OUTPUT_DIR, name)).paragraphs)
+    else:
+        books = builder.plan_books(source)
+        journals = builder.open_journals(books)
+        started = time.perf_counter()
+        asyncio.run(builder.generate_books(books, args.concurrency, journals))
+        makespan = time.perf_counter() - started
+        for journal in journals.values():
+            journal.close()
+        words = sum(len(section.text.split()) for sections in books.values() for section in sections)
+    return {"makespan_s": makespan, "calls": llm.stats["calls"], "words": words,
+            "summary": builder.scheduler.summary(args.concurrency)}
+
+
+def measure(mode: str, args, base_url: str) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"schedule-{mode}-", dir=args.workdir)
+    result_path = os.path.join(workdir, "result.json")
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench", BOOKMAKER_CACHE="off",
+               BOOKMAKER_RPM="1e6", BOOKMAKER_TPM="1e9", PYTHONDONTWRITEBYTECODE="1",
+               BOOKMAKER_TOKENS_PER_SEC=str(args.tokens_per_sec), BOOKMAKER_CALL_OVERHEAD=str(args.latency))
+    env.pop("BOOKMAKER_TRACE", None)
+    command = [sys.executable, os.path.abspath(__file__), "--child", mode, "--books", str(args.books),
+               "--chapters", str(args.chapters), "--concurrency", str(args.concurrency),
+               "--books-in-flight", str(args.books_in_flight), "--workdir", workdir, "--result", result_path]
+    try:
+        out = subprocess.run(command, capture_output=True, text=True, env=env, cwd=ROOT)
+        if out.returncode != 0 or not os.path.exists(result_path):
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated subset of " + ", ".join(MODES) + ".")
+    parser.add_argument("--books", type=int, default=8)
+    parser.add_argument("--chapters", type=int, default=3, help="Chapters per synthetic book.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--books-in-flight", type=int, default=0,
+                        help="Stream the sheet through build_books this many books at a time (0: one batch).")
+    parser.add_argument("--tokens-per-sec", type=float, default=3000.0, help="Completion speed of the fake server.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixed per-call latency of the fake server.")
+    parser.add_argument("--workdir", help="Parent directory for run outputs (default: system temp).")
+    parser.add_argument("--keep", action="store_true", help="Keep each run's files.")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        result = run_child(args.child, args)
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+        return 0
+
+    config = FakeServerConfig(min_latency=args.latency, max_latency=args.latency,
+                              tokens_per_sec=args.tokens_per_sec, follow_word_count=True)
+    failed = False
+    print(f"{'mode':<10}{'calls':>7}{'words':>10}{'makespan':>10}")
+    with FakeOpenAIServer(config) as server:
+        for mode in (m.strip() for m in args.modes.split(",") if m.strip()):
+            r = measure(mode, args, server.base_url)
+            if "error" in r:
+                print(f"{mode:<10}  ERROR: {r['error']}")
+                failed = True
+                continue
+            print(f"{mode:<10}{r['calls']:>7}{r['words']:>10,}{r['makespan_s']:>9.2f}s")
+            print(f"          {r['summary']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Sharded-run benchmark and protocol check with local processes standing in for nodes.
+
+Starts `bookmaker.fakeserver`, writes a synthetic input sheet, and runs
+the real script once per node, all at the same time. Each node gets
+`--shard i/N` (static) or a shared `--claim-dir` (work stealing). Then
+`--merge` runs, and the result is checked:
+    every input title appears in the merged workbook exactly once, in input order
+    (kids_fiction) every book's DOCX was written
+    (claim) every title has a .done marker and no claim is left behind
+With --kill-after, node 1 is killed mid-run. A recovery node then runs
+with --claim-timeout and must pick up the titles the dead node held.
+With --interleave, the kids sheet lists chapter 1 of every book, then
+chapter 2 of every book, and so on, and every book must still be built
+from all its chapters.
+
+    python benchmarks/bench_shards.py --nodes 1,2,4 --books 40
+    python benchmarks/bench_shards.py --mode claim --kill-after 1.5 --workload kids_fiction
+    python benchmarks/bench_shards.py --workload kids_fiction --interleave --nodes 1,2
+"""
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_e2e import write_kids_sheet, write_title_sheet  # noqa: E402
+from bookmaker.fakeserver import FakeOpenAIServer, FakeServerConfig  # noqa: E402
+from bookmaker.scripts import load_script  # noqa: E402
+from bookmaker.sheets import iter_groups, iter_rows, iter_sheet_groups  # noqa: E402
+
+SCRIPTS = {
+    "prompts": "2. nonfiction_prompts.py",
+    "kids_fiction": os.path.join("kids fiction stage 2", "kids_fiction_bookmake.py"),
+}
+
+
+def node_command(workload: str, workdir: str, extra: list) -> list:
+    script = [sys.executable, os.path.join(ROOT, SCRIPTS[workload])]
+    if workload == "prompts":
+        return script + ["--input", os.path.join(workdir, "book_input.xlsx"),
+                         "--output", os.path.join(workdir, "Book_Generated_Content.xlsx"),
+                         "--sidecar", "none", "--no-dedup", "--workers", "4"] + extra
+    return script + ["--input", os.path.join(workdir, "kids_fiction_output.xlsx"),
+                     "--output-dir", os.path.join(workdir, "books"), "--docx-workers", "0"] + extra
+
+
+def check(workload: str, workdir: str, titles: list, claim_dir: str | None) -> list[str]:
+    """Protocol violations found in a finished, merged run."""
+    if workload == "prompts":
+        merged, key = os.path.join(workdir, "Book_Generated_Content.xlsx"), "Book_Title"
+    else:
+        merged, key = os.path.join(workdir, "books", "Kids_Book_Author_List.xlsx"), "Book Title"
+    try:
+        got = [title for title, _ in iter_groups(iter_rows(merged), key)]
+    except ValueError as e:
+        return [str(e)]
+    found = []
+    if got != titles:
+        missing, extra = set(titles) - set(got), len(got) - len(set(got))
+        found.append(f"merged workbook: {len(missing)} title(s) missing, {extra} duplicated, "
+                     f"order {'ok' if [t for t in titles if t in got] == got else 'wrong'}")
+    if workload == "kids_fiction":
+        docx = len(glob.glob(os.path.join(workdir, "books", "*.docx")))
+        if docx != len(titles):
+            found.append(f"{docx} DOCX file(s) for {len(titles)} book(s)")
+    if claim_dir:
+        done = len(glob.glob(os.path.join(claim_dir, "*.done")))
+        claims = len(glob.glob(os.path.join(claim_dir, "*.claim")))
+        if done != len(titles) or claims:
+            found.append(f"{done} .done marker(s) for {len(titles)} title(s), {claims} claim(s) left")
+    return found
+
+
+def check_chapters(sheet: str, chapters: int) -> list[str]:
+    """Books of a kids sheet that the builder would not get all `chapters` rows of."""
+    kids = load_script(SCRIPTS["kids_fiction"])
+    short = [title for title, rows in kids.iter_books(sheet) if len(rows) != chapters]
+    return [f"{len(short)} book(s) grouped with missing chapters, e.g. {short[0]!r}"] if short else []
+
+
+def run(workload: str, mode: str, nodes: int, args, base_url: str) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"shards-{workload}-{mode}-{nodes}-", dir=args.workdir)
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench", BOOKMAKER_CACHE="off",
+               BOOKMAKER_RPM="1e6", BOOKMAKER_TPM="1e9", PYTHONDONTWRITEBYTECODE="1")
+    env.pop("BOOKMAKER_TRACE", None)
+    if workload == "prompts":
+        write_title_sheet(os.path.join(workdir, "book_input.xlsx"), args.books, args.chapters)
+        titles = [row["Book Title"] for row in iter_rows(os.path.join(workdir, "book_input.xlsx"))]
+    else:
+        sheet = os.path.join(workdir, "kids_fiction_output.xlsx")
+        write_kids_sheet(sheet, args.books, args.chapters, args.interleave)
+        titles = [title for title, _ in iter_sheet_groups(sheet, "Book Title")]
+    claim_dir = os.path.join(workdir, "claims") if mode == "claim" else None
+
+    def launch(i: int, extra=()):
+        sharding = ["--claim-dir", claim_dir, "--node", f"node-{i}"] if claim_dir else ["--shard", f"{i}/{nodes}"]
+        return subprocess.Popen(node_command(workload, workdir, sharding + list(extra)), env=env, cwd=ROOT,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    try:
+        started = time.perf_counter()
+        procs = [launch(i) for i in range(1, nodes + 1)]
+        killed = False
+        if args.kill_after and claim_dir and nodes > 1:
+            time.sleep(args.kill_after)
+            procs[0].kill()
+            killed = True
+        errors = []
+        for i, proc in enumerate(procs):
+            stderr = proc.communicate()[1].strip()
+            if proc.returncode and stderr and not (killed and i == 0):
+                errors.append(stderr.splitlines()[-1])
+        if killed:
+            # The sweep runs after the dead node's claims have gone stale.
+            time.sleep(args.claim_timeout)
+            sweep = launch(nodes + 1, ["--claim-timeout", str(args.claim_timeout)])
+            stderr = sweep.communicate()[1].strip()
+            if sweep.returncode and stderr:
+                errors.append(stderr.splitlines()[-1])
+        makespan = time.perf_counter() - started
+        merge = subprocess.run(node_command(workload, workdir, ["--merge"]), env=env, cwd=ROOT,
+                               capture_output=True, text=True)
+        if merge.returncode:
+            errors.append(merge.stderr.strip().splitlines()[-1])
+        if workload == "kids_fiction":
+            errors += check_chapters(os.path.join(workdir, "kids_fiction_output.xlsx"), args.chapters)
+        return {"makespan_s": makespan, "books_per_min": len(titles) / makespan * 60,
+                "problems": errors + check(workload, workdir, titles, claim_dir)}
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workload", choices=sorted(SCRIPTS), action="append",
+                        help="Script to shard (repeatable; default: both).")
+    parser.add_argument("--mode", choices=["static", "claim"], action="append",
+                        help="Sharding mode (repeatable; default: both).")
+    parser.add_argument("--nodes", default="1,2,4", help="Comma-separated node counts.")
+    parser.add_argument("--books", type=int, default=24)
+    parser.add_argument("--chapters", type=int, default=3)
+    parser.add_argument("--min-latency", type=float, default=0.05)
+    parser.add_argument("--max-latency", type=float, default=0.15)
+    parser.add_argument("--kill-after", type=float, default=0.0,
+                        help="Kill node 1 after this many seconds (claim mode only).")
+    parser.add_argument("--claim-timeout", type=float, default=2.0,
+                        help="--claim-timeout of the recovery node that runs after a kill.")
+    parser.add_argument("--interleave", action="store_true",
+                        help="Interleave the kids sheet's rows across books instead of grouping them.")
+    parser.add_argument("--workdir", help="Parent directory for run outputs (default: system temp).")
+    parser.add_argument("--keep", action="store_true", help="Keep each run's files.")
+    args = parser.parse_args(argv)
+
+    config = FakeServerConfig(min_latency=args.min_latency, max_latency=args.max_latency, completion_words=100)
+    failed = False
+    print(f"{'run':<28}{'makespan':>10}{'books/min':>11}  check")
+    with FakeOpenAIServer(config) as server:
+        for workload in args.workload or sorted(SCRIPTS):
+            for mode in args.mode or ["static", "claim"]:
+                for nodes in [int(n) for n in args.nodes.split(",") if n.strip()]:
+                    r = run(workload, mode, nodes, args, server.base_url)
+                    failed |= bool(r["problems"])
+                    print(f"{f'{workload}:{mode}:{nodes}':<28}{r['makespan_s']:>9.2f}s{r['books_per_min']:>11.1f}  "
+                          f"{'; '.join(r['problems']) or 'ok'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the Book Maker entry points.
+
+Loads each script as a module (without running its __main__ block) in a
+fresh interpreter, with OPENAI_API_KEY unset, and records the import time
+and peak RSS. `--help` is timed as well, since that is the cheapest offline
+invocation. Results can be saved with --json and compared against a saved
+baseline with --baseline, which exits non-zero on a regression.
+
+    python benchmarks/bench_startup.py --repeat 5 --json startup.json
+    python benchmarks/bench_startup.py --baseline startup.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    "nonfiction_prompts": "2. nonfiction_prompts.py",
+    "kids_nonfiction_prompts": os.path.join("kids non fiction stage 1", "kids_nonfiction_prompts.py"),
+    "nonfiction_bookmake": "2. nonfiction_bookmake.py",
+    "kids_fiction_bookmake": os.path.join("kids fiction stage 2", "kids_fiction_bookmake.py"),
+    "nonfiction_pipeline": "nonfiction_pipeline.py",
+    "book_worker": "book_worker.py",
+}
+
+PROBE = r"""
+import importlib.util, json, os, resource, sys, time
+path = sys.argv[1]
+sys.path.insert(0, os.path.dirname(path))
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("entry_point", path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform != "darwin":
+    peak *= 1024  # Linux reports KiB, macOS bytes
+heavy = sorted(m for m in ("torch", "sentence_transformers", "sklearn", "numpy", "openai") if m in sys.modules)
+print(json.dumps({"import_s": elapsed, "peak_rss": peak, "heavy_modules": heavy}))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def measure(script: str, repeat: int) -> dict:
+    path = os.path.join(ROOT, script)
+    imports, rss, heavy, help_times = [], [], [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", PROBE, path], capture_output=True, text=True,
+                             env=_env(), cwd=os.path.dirname(path))
+        if out.returncode != 0:
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+        record = json.loads(out.stdout.strip().splitlines()[-1])
+        imports.append(record["import_s"])
+        rss.append(record["peak_rss"])
+        heavy = record["heavy_modules"]
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, path, "--help"], capture_output=True, env=_env(), cwd=os.path.dirname(path))
+        help_times.append(time.perf_counter() - start)
+    return {
+        "import_s": statistics.median(imports),
+        "help_s": statistics.median(help_times),
+        "peak_rss_mb": max(rss) / (1024 * 1024),
+        "heavy_modules": heavy,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Write results to this file.")
+    parser.add_argument("--baseline", help="Compare against results saved with --json.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative slowdown / RSS growth before failing.")
+    args = parser.parse_args(argv)
+
+    results = {name: measure(script, args.repeat) for name, script in ENTRY_POINTS.items()}
+
+    print(f"{'entry point':<26}{'import':>10}{'--help':>10}{'peak RSS':>12}  heavy modules loaded")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:<26}  ERROR: {r['error']}")
+            continue
+        print(f"{name:<26}{r['import_s']:>9.3f}s{r['help_s']:>9.3f}s{r['peak_rss_mb']:>10.1f}MB  "
+              f"{', '.join(r['heavy_modules']) or '-'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = any("error" in r for r in results.values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name, r in results.items():
+            base = baseline.get(name)
+            if not base or "error" in r or "error" in base:
+                continue
+            for metric in ("import_s", "peak_rss_mb"):
+                if r[metric] > base[metric] * (1 + args.tolerance):
+                    print(f"❌ {name}: {metric} regressed {base[metric]:.3f} -> {r[metric]:.3f}")
+                    failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
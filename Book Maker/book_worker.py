@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Long-running book workers fed from a persistent SQLite job queue.
+
+Submitters add titles to the queue at any time, including while earlier
+batches are still being worked on, and a fixed set of worker processes
+drains it continuously. Each worker keeps its OpenAI clients, loaded
+scripts and DOCX pool warm across jobs. It works on several books at once,
+with all of their section requests sharing one concurrency limit.
+
+Jobs are book-granular and carry everything they need in their payload:
+    <type>-outline  one input title for a stage-1 outline builder; when it is
+                    done, a "nonfiction" job for the same title is queued with
+                    the generated prompt rows
+    nonfiction      the prompt rows of one non-fiction (or kids non-fiction) book
+    kids-fiction    the chapter rows of one kids fiction book
+Inside a book, progress is kept per section in the builder's journal. A
+book that is retried, or reclaimed after its worker died, only regenerates
+the sections it is missing. Kids fiction resumes through its --incremental
+manifest, so a section journaled under different inputs is regenerated.
+
+Queue calls are sqlite transactions that may wait on other processes'
+locks, so they run on a thread and never block the event loop.
+
+    python book_worker.py submit --type nonfiction --input book_input.xlsx
+    python book_worker.py submit --type kids-fiction --input kids_fiction_output.xlsx
+    python book_worker.py work --processes 4
+    python book_worker.py status
+"""
+import os
+import time
+import socket
+import asyncio
+import threading
+import argparse
+import multiprocessing
+from concurrent.futures import Future
+
+from bookmaker import llm
+from bookmaker.documents import DocumentPool
+from bookmaker.engine import DEFAULT_CONCURRENCY, PriorityGate
+from bookmaker.jobqueue import DEFAULT_LEASE, DEFAULT_QUEUE_PATH, MAX_ATTEMPTS, JobQueue
+from bookmaker.scripts import load_script
+from bookmaker.sheets import iter_rows, iter_sheet_groups
+from nonfiction_pipeline import BUILDER_SCRIPT, STAGE1_SCRIPTS
+
+# ── CONFIGURATION ──────────────────────────────────────────────────────────────
+
+KIDS_FICTION_SCRIPT = os.path.join("kids fiction stage 2", "kids_fiction_bookmake.py")
+OUTLINE_KINDS = {f"{book_type}-outline": book_type for book_type in STAGE1_SCRIPTS}
+BOOK_KINDS = ("nonfiction", "kids-fiction")
+JOBS_PER_WORKER = 2
+POLL_INTERVAL = 2.0
+
+# ── SUBMITTING ─────────────────────────────────────────────────────────────────
+
+def submission_jobs(book_type: str, input_path: str, from_prompts: bool = False):
+    """
+    Yields (kind, book, payload) jobs for a workbook: one outline job per
+    title of a stage-1 input sheet, or one book job per title of a prompts or
+    kids fiction chapter sheet.
+    """
+    rows = iter_rows(input_path)
+    if book_type == "kids-fiction":
+        # A kids sheet's chapter rows may be interleaved across books, as the old groupby allowed.
+        for title, group in iter_sheet_groups(input_path, "Book Title"):
+            yield "kids-fiction", title, {"rows": group}
+    elif from_prompts:
+        # Likewise for a prompts workbook's rows.
+        for title, group in iter_sheet_groups(input_path, "Book_Title"):
+            yield "nonfiction", title, {"rows": group}
+    else:
+        for entry in rows:
+            if entry.get("Book Title"):
+                yield f"{book_type}-outline", entry["Book Title"], {"entry": entry}
+
+# ── WORKER ─────────────────────────────────────────────────────────────────────
+
+def load_scripts(output_dir: str | None = None) -> dict:
+    """Loads the stage scripts once per process, pointing their output at `output_dir` when given."""
+    scripts = {"nonfiction": load_script(BUILDER_SCRIPT), "kids-fiction": load_script(KIDS_FICTION_SCRIPT)}
+    for kind, book_type in OUTLINE_KINDS.items():
+        scripts[kind] = load_script(STAGE1_SCRIPTS[book_type])
+    if output_dir:
+        scripts["nonfiction"].WORD_OUTPUT_DIR = output_dir
+        scripts["kids-fiction"].OUTPUT_DIR = output_dir
+    return scripts
+
+async def run_worker(queue_path: str, kinds=None, jobs: int = JOBS_PER_WORKER,
+                     concurrency: int = DEFAULT_CONCURRENCY, lease: float = DEFAULT_LEASE,
+                     docx_workers: int = 1, dedupe: bool = True, poll_interval: float = POLL_INTERVAL,
+                     drain: bool = False, output_dir: str | None = None) -> int:
+    """
+    Claims and runs jobs of `kinds` (all kinds when None), at most `jobs` at a
+    time, renewing each lease every `lease` / 3 seconds. With `drain` the
+    worker returns once the queue has nothing queued or running; otherwise
+    it polls forever. Returns the number of jobs it completed.
+    """
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    loop = asyncio.get_running_loop()
+    semaphore = PriorityGate(concurrency)
+    scripts = load_scripts(output_dir)
+    memories = {}
+    completed = 0
+
+    async def run_outline(job, pool, stop):
+        stage1 = scripts[job.kind]
+        if dedupe and job.kind not in memories:
+            memories[job.kind] = stage1.load_memory()
+        rows = await loop.run_in_executor(None, lambda: stage1.build_title_rows(job.payload["entry"],
+                                                                                 memory=memories.get(job.kind)))
+        if not rows:
+            raise RuntimeError("no chapters generated")
+        return {"rows": len(rows)}, [("nonfiction", job.book, {"rows": rows})]
+
+    async def run_nonfiction(job, pool, stop):
+        builder = scripts["nonfiction"]
+        books = builder.plan_books(job.payload["rows"])
+        # A retried or reclaimed book picks up the sections its last attempt journaled.
+        journals = builder.open_journals(books, resume=job.attempts > 1)
+        await builder.generate_books(books, concurrency, journals, semaphore=semaphore)
+        futures = builder.finish_books(books, journals, pool)
+        if len(futures) < len(books):
+            failed = sum(1 for sections in books.values() for section in sections if section.error)
+            raise RuntimeError(f"{failed} section(s) failed")
+        return {"paths": [await asyncio.wrap_future(future) for future in futures]}, []
+
+    async def run_kids_fiction(job, pool, stop):
+        kids = scripts["kids-fiction"]
+        results = []
+        for title, chapters in kids.iter_books(job.payload["rows"]):
+            # A retried or reclaimed book resumes incrementally from its journal and manifest. The builder
+            # runs on a thread that cancelling `work` cannot stop, so it also checks `stop` between calls.
+            saved = await loop.run_in_executor(None, kids.create_docx, title, chapters, pool, job.attempts > 1,
+                                               stop)
+            if isinstance(saved, Future):
+                saved = await asyncio.wrap_future(saved)
+            results.append({"path": saved, "Book Title": title, "Author Name": kids.book_author(chapters)})
+        return {"books": results}, []
+
+    runners = {"nonfiction": run_nonfiction, "kids-fiction": run_kids_fiction}
+    runners.update(dict.fromkeys(OUTLINE_KINDS, run_outline))
+
+    async def handle(queue, job, pool):
+        nonlocal completed
+        started = time.perf_counter()
+        print(f"▶️ {job.kind} '{job.book}' (attempt {job.attempts})")
+        stop = threading.Event()  # tells builder threads to give the job up
+        work = asyncio.create_task(runners[job.kind](job, pool, stop))
+        lost = asyncio.Event()
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(lease / 3)
+                if not await asyncio.to_thread(queue.heartbeat, job.id, name, lease):
+                    print(f"⚠️ Lost the lease on {job.kind} '{job.book}', abandoning it")
+                    lost.set()
+                    stop.set()
+                    work.cancel()
+                    return
+
+        beating = asyncio.create_task(heartbeat())
+        try:
+            result, follow_up = await work
+        except asyncio.CancelledError:
+            stop.set()
+            if lost.is_set():
+                return
+            # Kept synchronous: awaiting here could be cut short by a second cancel.
+            queue.release(job.id, name)
+            raise
+        except Exception as e:
+            status = await asyncio.to_thread(queue.fail, job.id, name, f"{type(e).__name__}: {e}")
+            print(f"❌ {job.kind} '{job.book}' failed ({e}); job is now {status}")
+            return
+        finally:
+            beating.cancel()
+        if await asyncio.to_thread(queue.complete, job.id, name, result, follow_up):
+            completed += 1
+            print(f"✅ {job.kind} '{job.book}' done in {time.perf_counter() - started:.1f}s")
+
+    with JobQueue(queue_path) as queue, DocumentPool(docx_workers) as pool:
+        running = set()
+        print(f"👷 Worker {name} started ({jobs} job(s) at a time, {concurrency} requests in flight)")
+        try:
+            while True:
+                while len(running) < max(1, jobs):
+                    job = await asyncio.to_thread(queue.claim, name, kinds, lease)
+                    if job is None:
+                        break
+                    running.add(asyncio.create_task(handle(queue, job, pool)))
+                if not running:
+                    if drain and await asyncio.to_thread(queue.pending) == 0:
+                        break
+                    await asyncio.sleep(poll_interval)
+                    continue
+                done, running = await asyncio.wait(running, timeout=poll_interval,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+    print(f"🏁 Worker {name} completed {completed} job(s)")
+    return completed
+
+def worker_main(queue_path: str, kinds, stream: bool, options: dict):
+    """Entry point of one worker process."""
+    llm.STREAM = stream
+    try:
+        asyncio.run(run_worker(queue_path, kinds, **options))
+    except KeyboardInterrupt:
+        pass
+    print(llm.summary())
+
+def start_workers(queue_path: str, processes: int, dedupe: bool, stream: bool, options: dict):
+    """
+    Runs `processes` worker processes until they exit. The stage-1 title
+    memory is a single-writer file, so with deduplication on only the first
+    worker takes outline jobs.
+    """
+    kinds = [None] + [list(BOOK_KINDS) if dedupe else None] * (max(1, processes) - 1)
+    options = dict(options, dedupe=dedupe)
+    if len(kinds) == 1:
+        worker_main(queue_path, None, stream, options)
+        return
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=worker_main, args=(queue_path, worker_kinds, stream, options))
+               for worker_kinds in kinds]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # The workers got the same Ctrl+C and hand their jobs back before exiting.
+        for worker in workers:
+            worker.join()
+
+# ── STATUS ─────────────────────────────────────────────────────────────────────
+
+def print_status(queue: JobQueue, limit: int = 10):
+    counts = queue.counts()
+    print(f"{'kind':<26}{'queued':>8}{'leased':>8}{'done':>8}{'failed':>8}")
+    for kind, by_status in sorted(counts.items()):
+        print(f"{kind:<26}{by_status['queued']:>8}{by_status['leased']:>8}{by_status['done']:>8}{by_status['failed']:>8}")
+    now = time.time()
+    for job in queue.jobs("leased", limit):
+        print(f"   🔄 {job['kind']} '{job['book']}' on {job['lease_owner']}, attempt {job['attempts']}, "
+              f"heartbeat {now - (job['heartbeat_at'] or now):.0f}s ago")
+    for job in queue.jobs("failed", limit):
+        print(f"   ❌ {job['kind']} '{job['book']}' after {job['attempts']} attempt(s): {job['error']}")
+
+# ── ENTRY POINT ────────────────────────────────────────────────────────────────
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Queue book jobs and run long-lived workers that generate them.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="SQLite job queue (default: $BOOKMAKER_QUEUE).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Queue every title of a workbook.")
+    submit.add_argument("--type", choices=sorted(STAGE1_SCRIPTS) + ["kids-fiction"], required=True,
+                        help="Book type; non-fiction types take a stage-1 input sheet of titles.")
+    submit.add_argument("--input", required=True, help="Workbook to queue.")
+    submit.add_argument("--from-prompts", action="store_true",
+                        help="The input is a stage-1 prompts workbook: queue the books without outlining them.")
+    submit.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help="Claims a job gets before it is marked failed.")
+    submit.add_argument("--force", action="store_true",
+                        help="Requeue titles that were already submitted, even if they are done.")
+
+    work = commands.add_parser("work", help="Run workers until interrupted (or until the queue is empty).")
+    work.add_argument("--processes", type=int, default=1, help="Worker processes.")
+    work.add_argument("--jobs", type=int, default=JOBS_PER_WORKER, help="Books each worker generates at once.")
+    work.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                      help="Section requests in flight per worker, shared by its books.")
+    work.add_argument("--lease", type=float, default=DEFAULT_LEASE,
+                      help="Seconds a claimed job stays leased without a heartbeat.")
+    work.add_argument("--docx-workers", type=int, default=1,
+                      help="DOCX assembly processes per worker (0 or 1 builds them on a background thread).")
+    work.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                      help="Seconds between queue checks when idle.")
+    work.add_argument("--output-dir", help="Where to save the books (default: each builder's own).")
+    work.add_argument("--drain", action="store_true", help="Exit once nothing is queued or running.")
+    work.add_argument("--no-dedup", action="store_true",
+                      help="Skip the chapter-title memory; outline jobs can then run on every worker.")
+    work.add_argument("--stream", action="store_true", default=llm.STREAM,
+                      help="Stream completions, journaling text as it arrives.")
+
+    status = commands.add_parser("status", help="Show job counts, running jobs and failures.")
+    status.add_argument("--limit", type=int, default=10, help="Running and failed jobs to list.")
+
+    retry = commands.add_parser("retry", help="Requeue failed jobs.")
+    retry.add_argument("--kind", action="append", help="Only jobs of this kind (repeatable).")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "submit":
+        with JobQueue(args.queue) as queue:
+            added = queue.submit_many(submission_jobs(args.type, args.input, args.from_prompts),
+                                      args.max_attempts, args.force)
+            print(f"📥 Queued {added} new job(s) from {args.input} into {args.queue}")
+    elif args.command == "work":
+        start_workers(args.queue, args.processes, not args.no_dedup, args.stream, {
+            "jobs": args.jobs, "concurrency": args.concurrency, "lease": args.lease,
+            "docx_workers": args.docx_workers, "poll_interval": args.poll_interval, "drain": args.drain,
+            "output_dir": args.output_dir})
+    elif args.command == "status":
+        with JobQueue(args.queue) as queue:
+            print_status(queue, args.limit)
+    elif args.command == "retry":
+        with JobQueue(args.queue) as queue:
+            print(f"🔁 Requeued {queue.retry_failed(args.kind)} failed job(s)")
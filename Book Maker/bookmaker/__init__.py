@@ -0,0 +1 @@
+"""Shared building blocks for the Book Maker generation scripts."""
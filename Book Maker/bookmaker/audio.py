@@ -0,0 +1,294 @@
+"""
+Audiobook rendering for the books written by the stage-2 builders.
+
+A book is read back from its DOCX. Each Heading 1 starts a chapter. The
+front matter before the first one and the kids copyright page are left
+out. Every paragraph is split into chunks of whole sentences of at most
+`max_chars` characters. The chunks of the whole book go to a TTS backend
+on `workers` threads. Their audio is appended to the chapter's WAV file in
+order as it arrives, so only a small window of chunks is ever in memory.
+A chapter or a book never is.
+
+A backend turns text into raw 16-bit mono PCM at its `sample_rate`:
+    openai  the speech endpoint (response_format="pcm", 24 kHz) through
+            `llm.speech`, with the request budget and retries of chat calls
+    tone    a local stub that renders each chunk as a sine tone. Its pitch
+            comes from a hash of the text and its length from the text
+            length. Use it for tests and benchmarks.
+
+Rendered chunks are cached on disk. The key is a hash of the backend's
+`cache_id` (model, voice, format) and the chunk text. Rendering a book
+again after an edit only synthesises the chunks whose text changed. The
+rest of the audio comes from the cache.
+"""
+import hashlib
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import wave
+from dataclasses import dataclass
+
+from bookmaker import llm
+from bookmaker.parallel import imap_ordered
+
+TTS_MODEL = os.getenv("BOOKMAKER_TTS_MODEL", "tts-1")
+TTS_VOICE = os.getenv("BOOKMAKER_TTS_VOICE", "alloy")
+DEFAULT_TTS_WORKERS = int(os.getenv("BOOKMAKER_TTS_WORKERS", "4"))
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bookmaker", "tts")
+MAX_CHUNK_CHARS = 600
+PARAGRAPH_PAUSE = 0.4
+HEADING_PAUSE = 0.8
+SKIPPED_SECTIONS = {"copyright"}
+
+# ── TEXT ───────────────────────────────────────────────────────────────────────
+
+_SENTENCE_END = re.compile(r"(?:(?<=[.!?…])|(?<=[.!?…][\"'”’)\]]))\s+")
+_CLAUSE_END = re.compile(r"(?<=[,;:—])\s+")
+
+
+@dataclass
+class Chunk:
+    """Text sent to the backend in one call, followed by `pause` seconds of silence."""
+    text: str
+    pause: float = 0.0
+
+
+@dataclass
+class Chapter:
+    heading: str
+    paragraphs: list
+
+
+def split_sentences(text: str) -> list[str]:
+    return [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence.strip()]
+
+
+def _pieces(sentence: str, max_chars: int) -> list[str]:
+    """Splits one over-long sentence at clause breaks, then at spaces."""
+    if len(sentence) <= max_chars:
+        return [sentence]
+    pieces = []
+    for part in _CLAUSE_END.split(sentence):
+        while len(part) > max_chars:
+            cut = part.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(part[:cut].strip())
+            part = part[cut:].strip()
+        if part:
+            pieces.append(part)
+    return pieces
+
+
+def chunk_text(text: str, max_chars: int = MAX_CHUNK_CHARS) -> list[str]:
+    """Packs whole sentences into chunks of at most `max_chars` characters."""
+    chunks, current = [], ""
+    for sentence in split_sentences(text):
+        for piece in _pieces(sentence, max_chars):
+            if current and len(current) + 1 + len(piece) > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chapter_chunks(chapter: Chapter, max_chars: int = MAX_CHUNK_CHARS) -> list[Chunk]:
+    """The heading, then every paragraph's chunks, with pauses after the heading and each paragraph."""
+    chunks = [Chunk(chapter.heading, HEADING_PAUSE)] if chapter.heading else []
+    for paragraph in chapter.paragraphs:
+        pieces = chunk_text(paragraph, max_chars)
+        for i, piece in enumerate(pieces):
+            chunks.append(Chunk(piece, PARAGRAPH_PAUSE if i == len(pieces) - 1 else 0.0))
+    return chunks
+
+
+def parse_docx(path: str) -> tuple[str, str, list[Chapter]]:
+    """
+    Reads (title, author, chapters) from a book DOCX. The author is taken from
+    a "By ..." line in the front matter.
+    """
+    from docx import Document
+
+    title, author, chapters = "", "", []
+    for paragraph in Document(path).paragraphs:
+        text = paragraph.text.strip()
+        style = paragraph.style.name if paragraph.style is not None else ""
+        if not text:
+            continue
+        if style == "Title":
+            title = title or text
+        elif style == "Heading 1":
+            chapters.append(Chapter(text, []))
+        elif chapters:
+            chapters[-1].paragraphs.extend(line.strip() for line in text.split("\n") if line.strip())
+        elif text.lower().startswith("by ") and not author:
+            author = text[3:].strip()
+    title = title or os.path.splitext(os.path.basename(path))[0]
+    return title, author, [chapter for chapter in chapters if chapter.heading.lower() not in SKIPPED_SECTIONS]
+
+# ── BACKENDS ───────────────────────────────────────────────────────────────────
+
+class OpenAITTS:
+    sample_rate = 24000  # what response_format="pcm" returns: 24 kHz, 16-bit, mono
+
+    def __init__(self, model: str = TTS_MODEL, voice: str = TTS_VOICE):
+        self.model, self.voice = model, voice
+        self.cache_id = f"openai:{model}:{voice}:pcm{self.sample_rate}"
+
+    def synthesize(self, text: str) -> bytes:
+        return llm.speech(text, model=self.model, voice=self.voice, response_format="pcm")
+
+
+class ToneTTS:
+    def __init__(self, sample_rate: int = 16000, seconds_per_char: float = 0.05, latency: float = 0.0):
+        self.sample_rate = sample_rate
+        self.seconds_per_char = seconds_per_char
+        self.latency = latency
+        self.cache_id = f"tone:{sample_rate}:{seconds_per_char}"
+
+    def synthesize(self, text: str) -> bytes:
+        if self.latency:
+            time.sleep(self.latency)
+        digest = hashlib.sha1(text.encode("utf-8")).digest()
+        period = 20 + digest[0] % 40  # samples per cycle, so the tone can be tiled from one cycle
+        cycle = b"".join(int(8000 * math.sin(2 * math.pi * i / period)).to_bytes(2, "little", signed=True)
+                         for i in range(period))
+        frames = max(1, int(len(text) * self.seconds_per_char * self.sample_rate))
+        return (cycle * (frames // period + 1))[:frames * 2]
+
+
+def make_tts(name: str, voice: str = TTS_VOICE, model: str = TTS_MODEL):
+    if name == "openai":
+        return OpenAITTS(model, voice)
+    if name == "tone":
+        return ToneTTS()
+    raise ValueError(f"Unknown TTS backend: {name}")
+
+# ── CHUNK CACHE ────────────────────────────────────────────────────────────────
+
+class AudioCache:
+    """Rendered chunks as raw PCM files under a two-level fan-out directory."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(cache_id: str, text: str) -> str:
+        return hashlib.sha256(f"{cache_id}\n{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pcm")
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return audio
+
+    def put(self, key: str, audio: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        os.replace(tmp, path)
+
+# ── RENDERING ──────────────────────────────────────────────────────────────────
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^\w]+", "_", name.lower()).strip("_")[:60] or "section"
+
+
+def synthesize(backend, text: str, cache: AudioCache | None = None) -> bytes:
+    key = AudioCache.key(backend.cache_id, text) if cache is not None else None
+    if cache is not None:
+        audio = cache.get(key)
+        if audio is not None:
+            return audio
+    audio = backend.synthesize(text)
+    if cache is not None:
+        cache.put(key, audio)
+    return audio
+
+
+def make_audiobook(docx_path: str, output_dir: str, backend, cache: AudioCache | None = None,
+                   workers: int = DEFAULT_TTS_WORKERS, max_chars: int = MAX_CHUNK_CHARS, author: str = "",
+                   audio_format: str = "wav") -> list[str]:
+    """
+    Renders one book to output_dir/<title>/NN_<chapter>.wav (or .mp3), with a
+    spoken intro and outro. Chunks of all chapters share one pool of
+    `workers` threads and are written in order. Returns the saved paths.
+    """
+    title, found_author, chapters = parse_docx(docx_path)
+    author = author or found_author
+    intro = f"{title}." + (f" Written by {author}." if author else "")
+    parts = ([("intro", Chapter("", [intro]))]
+             + [(_safe(chapter.heading), chapter) for chapter in chapters]
+             + [("outro", Chapter("", [f"This is the end of {title}. Thank you for listening."]))])
+    book_dir = os.path.join(output_dir, re.sub(r'[\\/:*?"<>|]', "_", title).strip() or "untitled")
+    os.makedirs(book_dir, exist_ok=True)
+    paths = [os.path.join(book_dir, f"{i:02d}_{name}.wav") for i, (name, _) in enumerate(parts)]
+    jobs = [(index, chunk) for index, (_, chapter) in enumerate(parts) for chunk in chapter_chunks(chapter, max_chars)]
+    print(f"🎙️ '{title}': {len(parts)} parts, {len(jobs)} chunks")
+
+    writer, current, saved, seconds = None, None, [], 0.0
+
+    def close_part():
+        nonlocal writer
+        if writer is not None:
+            writer.close()
+            # Closed: from here on a failure must not make the finally below remove the part.
+            writer = None
+            os.replace(paths[current] + ".tmp", paths[current])
+            saved.append(_export(paths[current], audio_format))
+
+    render = lambda job: (job[0], synthesize(backend, job[1].text, cache), job[1].pause)
+    try:
+        for index, audio, pause in imap_ordered(render, jobs, workers):
+            if index != current:
+                close_part()
+                current = index
+                writer = wave.open(paths[index] + ".tmp", "wb")
+                writer.setnchannels(1)
+                writer.setsampwidth(2)
+                writer.setframerate(backend.sample_rate)
+            writer.writeframes(audio)
+            writer.writeframes(b"\0\0" * int(pause * backend.sample_rate))
+            seconds += len(audio) / 2 / backend.sample_rate + pause
+        close_part()
+    finally:
+        if writer is not None:
+            writer.close()
+            os.remove(paths[current] + ".tmp")
+    for name in os.listdir(book_dir):
+        # Parts of an earlier render whose chapter was renamed or removed
+        if name.endswith((".wav", f".{audio_format}")) and os.path.join(book_dir, name) not in saved:
+            os.remove(os.path.join(book_dir, name))
+    print(f"🔊 Saved {len(saved)} audio file(s) for '{title}' ({seconds / 60:.1f} min) to {book_dir}")
+    return saved
+
+
+def _export(wav_path: str, audio_format: str) -> str:
+    """Converts a finished chapter WAV to MP3 with pydub (needs ffmpeg); one chapter is loaded at a time."""
+    if audio_format == "wav":
+        return wav_path
+    from pydub import AudioSegment
+
+    out_path = os.path.splitext(wav_path)[0] + f".{audio_format}"
+    AudioSegment.from_wav(wav_path).set_frame_rate(44100).export(out_path, format=audio_format, bitrate="192k")
+    os.remove(wav_path)
+    return out_path
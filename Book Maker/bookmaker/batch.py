@@ -0,0 +1,188 @@
+"""
+Offline Batch-API execution for prompts that are known before generation.
+
+`run_batch` writes every pending request to a JSONL file in the Batch API
+input format, submits it through a pluggable backend, polls until the batch
+finishes and returns the completion text per custom ID. The submitted batch
+ID is remembered next to the input file, so rerunning the same batch keeps
+polling it instead of paying for it twice.
+
+Backends:
+    OpenAIBatchBackend  uploads to the OpenAI Batch API (24h window, batch pricing)
+    LocalBatchBackend   runs the requests through bookmaker.llm in-process,
+                        producing the same output format (for tests and dry runs)
+"""
+import hashlib
+import json
+import os
+import time
+
+from bookmaker import llm
+from bookmaker.cache import ResponseCache
+from bookmaker.parallel import map_ordered
+from bookmaker.retry import GenerationError
+
+ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _sha1_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def custom_id(book: str, key: str) -> str:
+    """Stable ID for one section of one book, independent of sheet position."""
+    digest = hashlib.sha1(str(book).encode("utf-8")).hexdigest()[:12]
+    return f"{digest}:{key}"
+
+
+def export_batch(requests: list[tuple[str, dict]], path: str) -> str:
+    """Writes (custom_id, body) pairs as Batch API input lines; returns the path."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for cid, body in requests:
+            f.write(json.dumps({"custom_id": cid, "method": "POST", "url": ENDPOINT, "body": body},
+                               ensure_ascii=False) + "\n")
+    return path
+
+
+def parse_output_line(line: str) -> tuple[str, str | None, str | None]:
+    """Returns (custom_id, text, error) for one Batch API output line."""
+    record = json.loads(line)
+    cid = record.get("custom_id")
+    if record.get("error"):
+        return cid, None, json.dumps(record["error"])
+    response = record.get("response") or {}
+    if response.get("status_code", 200) != 200:
+        return cid, None, json.dumps(response.get("body"))
+    body = response.get("body") or {}
+    try:
+        return cid, (body["choices"][0]["message"]["content"] or "").strip(), None
+    except (KeyError, IndexError, TypeError):
+        return cid, None, "malformed response body"
+
+
+class OpenAIBatchBackend:
+    def __init__(self, completion_window: str = "24h"):
+        self.completion_window = completion_window
+
+    def submit(self, path: str) -> str:
+        with open(path, "rb") as f:
+            uploaded = llm.client().files.create(file=f, purpose="batch")
+        batch = llm.client().batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT,
+                                            completion_window=self.completion_window)
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return llm.client().batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str):
+        batch = llm.client().batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in llm.client().files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield parse_output_line(line)
+
+
+class LocalBatchBackend:
+    """Executes a batch file immediately through the interactive client layer."""
+
+    def __init__(self, directory: str, workers: int = 8):
+        self.directory = directory
+        self.workers = workers
+
+    def _output_path(self, batch_id: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.output.jsonl")
+
+    def submit(self, path: str) -> str:
+        with open(path, encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        batch_id = "local_" + _sha1_file(path)[:16]
+
+        def _run(line):
+            body = line["body"]
+            try:
+                text = llm.chat(body["messages"], model=body["model"], temperature=body.get("temperature"),
+                                max_tokens=body.get("max_tokens"))
+            except GenerationError as e:
+                return {"custom_id": line["custom_id"], "response": None,
+                        "error": {"code": e.kind, "message": str(e)}}
+            return {"custom_id": line["custom_id"], "error": None,
+                    "response": {"status_code": 200,
+                                 "body": {"choices": [{"message": {"role": "assistant", "content": text}}]}}}
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._output_path(batch_id), "w", encoding="utf-8") as out:
+            for record in map_ordered(_run, lines, self.workers):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        return "completed" if os.path.exists(self._output_path(batch_id)) else "failed"
+
+    def results(self, batch_id: str):
+        with open(self._output_path(batch_id), encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield parse_output_line(line)
+
+
+def make_backend(name: str, workdir: str):
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend(os.path.join(workdir, "local"))
+    raise ValueError(f"Unknown batch backend: {name!r} (expected 'openai' or 'local')")
+
+
+def run_batch(requests: list[tuple[str, dict]], backend, workdir: str,
+              poll_interval: float = 30.0) -> tuple[dict[str, str], dict[str, str]]:
+    """
+    Submits (custom_id, body) requests as one batch and waits for it.
+    Returns ({custom_id: text}, {custom_id: error}); successful completions
+    are also stored in the response cache.
+    """
+    if not requests:
+        return {}, {}
+    input_path = export_batch(requests, os.path.join(workdir, "batch_input.jsonl"))
+    digest = _sha1_file(input_path)
+    state_path = os.path.join(workdir, "batch_state.json")
+
+    batch_id = None
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state.get("input_sha1") == digest and state.get("backend") == type(backend).__name__:
+            batch_id = state["batch_id"]
+            print(f"🔁 Re-attaching to submitted batch {batch_id}")
+    if batch_id is None:
+        batch_id = backend.submit(input_path)
+        with open(state_path, "w") as f:
+            json.dump({"batch_id": batch_id, "input_sha1": digest, "backend": type(backend).__name__}, f)
+        print(f"📤 Submitted batch {batch_id} with {len(requests)} request(s)")
+
+    status = backend.status(batch_id)
+    while status not in TERMINAL_STATES:
+        print(f"⏳ Batch {batch_id}: {status}")
+        time.sleep(poll_interval)
+        status = backend.status(batch_id)
+    print(f"📥 Batch {batch_id} finished: {status}")
+
+    bodies = dict(requests)
+    texts, errors = {}, {}
+    for cid, text, error in backend.results(batch_id):
+        if error is not None or cid not in bodies:
+            errors[cid] = error or "unknown custom_id"
+            continue
+        texts[cid] = text
+        body = bodies[cid]
+        if llm.cache and text:
+            llm.cache.put(ResponseCache.key(body["model"], body["messages"], body.get("temperature"),
+                                            body.get("max_tokens")), text)
+    for cid in bodies:
+        if cid not in texts and cid not in errors:
+            errors[cid] = f"no result (batch {status})"
+    return texts, errors
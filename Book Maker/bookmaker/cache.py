@@ -0,0 +1,164 @@
+"""
+Persistent, content-addressed cache for chat completion responses.
+
+Entries are keyed by a SHA-256 of the request (model, messages, temperature,
+max_tokens) and stored one JSON file per response under a two-level fan-out
+directory. Eviction is by age and by total size (least recently used first);
+a read-only mode serves hits without ever writing.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bookmaker", "llm")
+
+
+class ResponseCache:
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int | None = None,
+                 max_age: float | None = None, read_only: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk, scanned lazily on first write
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the cache from BOOKMAKER_CACHE (rw | ro | off), BOOKMAKER_CACHE_DIR,
+        BOOKMAKER_CACHE_MAX_MB and BOOKMAKER_CACHE_MAX_AGE_DAYS. Returns None when off.
+        """
+        mode = os.getenv("BOOKMAKER_CACHE", "rw").strip().lower()
+        if mode in ("off", "0", "false", "no"):
+            return None
+        max_mb = float(os.getenv("BOOKMAKER_CACHE_MAX_MB", "512"))
+        max_days = float(os.getenv("BOOKMAKER_CACHE_MAX_AGE_DAYS", "30"))
+        return cls(
+            directory=os.getenv("BOOKMAKER_CACHE_DIR", DEFAULT_CACHE_DIR),
+            max_bytes=int(max_mb * 1024 * 1024) if max_mb > 0 else None,
+            max_age=max_days * 86400 if max_days > 0 else None,
+            read_only=mode in ("ro", "read-only", "readonly"),
+        )
+
+    @staticmethod
+    def key(model: str, messages: list, temperature=None, max_tokens=None, response_format=None) -> str:
+        request = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        if response_format is not None:
+            # Only added when set, so keys of plain-text requests stay what they were.
+            request["response_format"] = response_format
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self.max_age is not None and time.time() - stat.st_mtime > self.max_age:
+                if not self.read_only:
+                    self._remove(path, stat.st_size)
+                raise FileNotFoundError(path)
+            with open(path, encoding="utf-8") as f:
+                text = json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if not self.read_only:
+            try:
+                os.utime(path)  # keeps eviction least-recently-used
+            except OSError:
+                pass
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        if self.read_only or not text:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"text": text, "created": time.time()}, f, ensure_ascii=False)
+        size = os.path.getsize(tmp)
+        try:
+            size -= os.path.getsize(path)  # overwriting a key replaces its bytes rather than adding to them
+        except FileNotFoundError:
+            pass
+        os.replace(tmp, path)
+
+        with self._lock:
+            self.writes += 1
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size
+            over_budget = self.max_bytes is not None and self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries, then the least recently used ones until under `max_bytes`."""
+        if self.read_only:
+            return
+        now = time.time()
+        entries = []
+        for path, stat in self._entries():
+            if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                self._remove(path, stat.st_size)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if self.max_bytes is not None and total > self.max_bytes:
+            # Trim to 90% so a full cache doesn't rescan on every write.
+            target = int(self.max_bytes * 0.9)
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                self._remove(path, size)
+                total -= size
+        with self._lock:
+            self._size = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions}
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    try:
+                        yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+
+    def _scan_size(self) -> int:
+        return sum(stat.st_size for _, stat in self._entries())
+
+    def _remove(self, path: str, size: int):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.evictions += 1
+            if self._size is not None:
+                self._size -= size
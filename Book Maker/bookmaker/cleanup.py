@@ -0,0 +1,178 @@
+"""
+Post-processing of generated section text before it is laid out.
+
+A `Cleaner` is built once per set of `CleanupRules`, with its
+replacements worked out up front. It applies the character rules to a section's whole
+text, then makes one pass over its lines and returns the section's
+paragraphs, one per non-empty line, ready for the document builders:
+
+    markdown      heading and blockquote markers at the start of a line, and
+                  emphasis/code markers (*, __, `) anywhere, are removed
+    quotes        keep     double quotes are left alone (default)
+                  strip    every double quote is removed, as the builders once did
+                  straight curly quotes become straight ones
+                  curly    straight double quotes become typographic ones
+    heading echo  a line that is nothing but the section heading (or the part
+                  after "Chapter N:"), give or take case and surrounding
+                  punctuation, is dropped. With `chapter_labels` on, so is a
+                  bare "Chapter N" label, or "Chapter N: ..." of at most
+                  `echo_max_words` words. A line that merely mentions the
+                  heading, or starts with "Chapter N" as part of a sentence,
+                  is kept.
+
+The rules per section kind are in RULES. Kids fiction sections (prologue,
+chapter, epilogue) are story text, where a line like "Home," said Mia.
+is dialogue rather than an echo, so they get no echo rules at all. BOOKMAKER_QUOTES sets the default
+quote handling. `clean_sections` cleans a whole batch, inline or on
+`workers` processes, and returns each section's paragraphs in order.
+"""
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+
+QUOTE_MODES = ("keep", "strip", "straight", "curly")
+QUOTES = os.getenv("BOOKMAKER_QUOTES", "keep").strip().lower()
+
+
+@dataclass(frozen=True)
+class CleanupRules:
+    markdown: bool = True
+    quotes: str = QUOTES
+    heading_echo: bool = True
+    chapter_labels: bool = False
+    echo_max_words: int = 12
+
+
+RULES = {
+    "intro": CleanupRules(heading_echo=False),
+    "chapter_intro": CleanupRules(chapter_labels=True),
+    "subheading": CleanupRules(),
+    "prologue": CleanupRules(heading_echo=False),
+    "chapter": CleanupRules(heading_echo=False),
+    "epilogue": CleanupRules(heading_echo=False),
+}
+
+_UNDERSCORES = re.compile(r"__+")
+_CHAPTER_LABEL = re.compile(r"chapter\s*\d+(?:\s*[:.\-–—]\s*.*)?")  # matched against the whole line
+_OPENING_QUOTE = re.compile(r'(^|[\s(\[{—–-])"', re.MULTILINE)
+_ECHO_PUNCTUATION = " \t.:;,!?-–—\"'“”‘’()[]"
+_LINE_MARKERS = "#> \t"
+_QUOTE_REPLACEMENTS = {
+    "strip": (('"', ""), ("“", ""), ("”", ""), ("„", "")),
+    "straight": (("“", '"'), ("”", '"'), ("„", '"'), ("‘", "'"), ("’", "'")),
+}
+
+
+class Cleaner:
+    def __init__(self, rules: CleanupRules = CleanupRules()):
+        if rules.quotes not in QUOTE_MODES:
+            raise ValueError(f"Unknown quote handling: {rules.quotes} (expected one of {', '.join(QUOTE_MODES)})")
+        self.rules = rules
+        self._replacements = (("*", ""), ("`", "")) if rules.markdown else ()
+        self._replacements += _QUOTE_REPLACEMENTS.get(rules.quotes, ())
+
+    def apply(self, text: str) -> str:
+        """
+        `text` with the inline markdown and quote rules applied. Each rule is a
+        plain replace over the whole text, skipped when its character is absent;
+        only `__` and curly quoting need a regex.
+        """
+        for old, new in self._replacements:
+            if old in text:
+                text = text.replace(old, new)
+        if self.rules.markdown and "__" in text:
+            text = _UNDERSCORES.sub("", text)
+        if self.rules.quotes == "curly" and '"' in text:
+            text = _OPENING_QUOTE.sub("\\1“", text).replace('"', "”")
+        return text
+
+    def line(self, line: str) -> str:
+        """One stripped line, without a leading heading or blockquote marker."""
+        line = line.strip()
+        if self.rules.markdown and line and line[0] in "#>":
+            line = line.lstrip(_LINE_MARKERS)
+        return line
+
+    def echo_keys(self, heading: str) -> frozenset[str]:
+        """The normalized forms of `heading` that an echo line consists of."""
+        full = _normalize(self.line(self.apply(heading or "")))
+        subtitle = _normalize(full.split(":")[-1])
+        return frozenset(key for key in (full, subtitle) if key)
+
+    def paragraphs(self, text: str, heading: str = "") -> list[str]:
+        """The cleaned, non-empty lines of `text`, without the lines echoing `heading`."""
+        rules = self.rules
+        keys = self.echo_keys(heading) if rules.heading_echo else frozenset()
+        labels = rules.chapter_labels
+        # No echo or label is longer than this, so the long body paragraphs skip the checks below.
+        longest = max([key.count(" ") + 1 for key in keys] + [rules.echo_max_words if labels else 0])
+        paragraphs = []
+        for line in self.apply(text or "").splitlines():
+            line = self.line(line)
+            if not line:
+                continue
+            if longest and line.count(" ") < longest:
+                norm = _normalize(line)
+                if norm in keys:
+                    continue
+                if labels and norm.count(" ") < rules.echo_max_words and _CHAPTER_LABEL.fullmatch(norm):
+                    continue
+            paragraphs.append(line)
+        return paragraphs
+
+
+def _normalize(line: str) -> str:
+    """Lowercased, with surrounding punctuation stripped and inner whitespace collapsed."""
+    return " ".join(line.strip(_ECHO_PUNCTUATION).lower().split())
+
+
+_cleaners: dict[CleanupRules, Cleaner] = {}
+
+
+def cleaner(rules: CleanupRules) -> Cleaner:
+    if rules not in _cleaners:
+        _cleaners[rules] = Cleaner(rules)
+    return _cleaners[rules]
+
+
+def rules_for(kind: str, quotes: str | None = None) -> CleanupRules:
+    rules = RULES.get(kind, CleanupRules())
+    return rules if quotes is None else replace(rules, quotes=quotes)
+
+
+def clean_heading(text: str) -> str:
+    """A heading taken from a sheet: markdown markers and double quotes removed."""
+    rules = cleaner(CleanupRules(quotes="strip", heading_echo=False))
+    return rules.line(rules.apply(str(text)))
+
+
+def clean_text(kind: str, heading: str, text: str, quotes: str | None = None) -> list[str]:
+    """The paragraphs of one section of `kind`, cleaned with RULES[kind]."""
+    return cleaner(rules_for(kind, quotes)).paragraphs(text, heading)
+
+
+def _clean_chunk(items, quotes):
+    return [clean_text(kind, heading, text, quotes) for kind, heading, text in items]
+
+
+def clean_batch(items, workers: int = 0, quotes: str | None = None, chunk: int = 256) -> list[list[str]]:
+    """
+    Cleans (kind, heading, text) triples and returns their paragraph lists
+    in order. With `workers` > 1, chunks of `chunk` items are cleaned on
+    that many spawned processes (see DocumentPool for why not forked), at
+    most one per CPU.
+    """
+    items = list(items)
+    workers = min(workers, os.cpu_count() or 1)
+    if workers <= 1 or len(items) <= chunk:
+        return _clean_chunk(items, quotes)
+    chunks = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return [paragraphs for done in pool.map(_clean_chunk, chunks, [quotes] * len(chunks)) for paragraphs in done]
+
+
+def clean_sections(sections, workers: int = 0, quotes: str | None = None) -> list[list[str]]:
+    """The paragraphs of every section, in order; see clean_batch."""
+    return clean_batch(((section.kind, section.heading, section.text) for section in sections), workers, quotes)
@@ -0,0 +1,197 @@
+"""
+DOCX assembly for the stage-2 book builders, run in worker processes.
+
+Building and serialising a python-docx tree is CPU-bound and holds the GIL,
+so with concurrent generation it becomes the bottleneck for large batches.
+The builders here are plain module-level functions that take finished
+`Section`s and a target path and return the saved path, which lets
+`DocumentPool` ship them to worker processes while the main process only
+orchestrates. Output is identical to building the documents inline.
+Section text is cleaned by `bookmaker.cleanup` and laid out one paragraph
+per line.
+
+With BOOKMAKER_EXPORT=stream (or --export stream) the DOCX is written by
+`bookmaker.export` instead, straight into the zip without a python-docx
+tree. BOOKMAKER_EXPORT_FORMATS=epub,md adds EPUB and/or Markdown copies
+next to each DOCX, whichever backend writes it.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+DEFAULT_DOCX_WORKERS = int(os.getenv("BOOKMAKER_DOCX_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXPORT_BACKENDS = ("python-docx", "stream")
+EXPORT_BACKEND = os.getenv("BOOKMAKER_EXPORT", "python-docx")
+EXTRA_FORMATS = tuple(f.strip() for f in os.getenv("BOOKMAKER_EXPORT_FORMATS", "").split(",") if f.strip())
+
+# ── PARAGRAPHS ─────────────────────────────────────────────────────────────────
+
+def add_paragraphs(doc, paragraphs):
+    """One Word paragraph per cleaned paragraph (see bookmaker.cleanup); an empty list still adds one."""
+    for paragraph in paragraphs or [""]:
+        doc.add_paragraph(paragraph)
+
+# ── NON-FICTION ────────────────────────────────────────────────────────────────
+
+def nonfiction_title_page(title: str):
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    doc = Document()
+
+    # Title Page
+    title_heading = doc.add_heading(title, level=0)
+    title_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title_heading.runs[0].font.size = Pt(20)
+
+    author_para = doc.add_paragraph("By AI Book Generator")
+    author_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    author_para.runs[0].font.size = Pt(14)
+    doc.add_page_break()
+    return doc
+
+def nonfiction_doc(title: str, sections):
+    """Assembles a generated non-fiction book in section order."""
+    from bookmaker.cleanup import clean_sections
+
+    doc = nonfiction_title_page(title)
+    chapter_open = False
+
+    for section, paragraphs in zip(sections, clean_sections(sections)):
+        if section.kind == "intro":
+            if section.text.strip():
+                doc.add_heading(section.heading, level=1)
+                add_paragraphs(doc, paragraphs)
+                doc.add_paragraph("")  # spacing
+                doc.add_page_break()
+            continue
+
+        if section.kind == "chapter_intro":
+            if chapter_open:
+                doc.add_page_break()
+            chapter_open = True
+
+        doc.add_heading(section.heading, level=section.level)
+        add_paragraphs(doc, paragraphs)
+        doc.add_paragraph("")
+
+    if chapter_open:
+        doc.add_page_break()
+    return doc
+
+def save_nonfiction_book(path: str, title: str, sections, export: str | None = None, formats=None) -> str:
+    from bookmaker.export import nonfiction_blocks, write_book
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    formats = EXTRA_FORMATS if formats is None else tuple(formats)
+    if (export or EXPORT_BACKEND) == "stream":
+        return write_book(path, nonfiction_blocks(title, sections), title, formats=("docx",) + formats)
+    nonfiction_doc(title, sections).save(path)
+    if formats:
+        write_book(path, nonfiction_blocks(title, sections), title, formats=formats)
+    return path
+
+# ── KIDS FICTION ───────────────────────────────────────────────────────────────
+
+def kids_fiction_doc(book_title: str, author_name: str, sections):
+    """Title page, copyright page, then one centred heading and page per section."""
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from bookmaker.cleanup import clean_sections
+
+    doc = Document()
+
+    # Set the base style for Normal text - larger font for children
+    style = doc.styles['Normal']
+    style.font.name = 'Calibri'
+    style.font.size = Pt(12)  # Larger font for children
+
+    # Book Title (level=0, centered) - larger font for children
+    title_heading = doc.add_heading(book_title, 0)
+    title_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title_heading.runs[0].font.size = Pt(24)  # Larger title font
+
+    # "By <Author Name>" in 14pt, centered
+    publishing_para = doc.add_paragraph()
+    publishing_run = publishing_para.add_run(f"By {author_name}")
+    publishing_run.font.size = Pt(14)
+    publishing_run.font.name = "Calibri"
+    publishing_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    # Page break before Copyright
+    doc.add_page_break()
+
+    # 1) Copyright Page - child-friendly version
+    doc.add_heading('Copyright', level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
+    doc.add_paragraph(
+        "Copyright © 2025 AI Book Generator\n"
+        "This is a work of fiction for children. Names, characters, places, and incidents either "
+        "are the product of the author's imagination or are used fictitiously.\n"
+        "Any resemblance to actual events, locales, or persons, living or dead, is "
+        "entirely coincidental.\n"
+        "All rights reserved.\n"
+        "For permissions, contact support@yourplatform.com\n\n"
+        "Recommended for ages 6-12"
+    ).alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+    doc.add_page_break()
+
+    # 2) Prologue, 3) Chapters & Epilogue
+    for section, paragraphs in zip(sections, clean_sections(sections)):
+        doc.add_heading(section.heading, level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
+        add_paragraphs(doc, paragraphs)
+        doc.add_page_break()
+    return doc
+
+def save_kids_fiction_book(path: str, book_title: str, author_name: str, sections, export: str | None = None,
+                           formats=None) -> str:
+    from bookmaker.export import KIDS_NORMAL, kids_fiction_blocks, write_book
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    formats = EXTRA_FORMATS if formats is None else tuple(formats)
+    blocks = kids_fiction_blocks(book_title, author_name, sections)
+    if (export or EXPORT_BACKEND) == "stream":
+        return write_book(path, blocks, book_title, author_name, ("docx",) + formats, KIDS_NORMAL)
+    kids_fiction_doc(book_title, author_name, sections).save(path)
+    if formats:
+        write_book(path, blocks, book_title, author_name, formats)
+    return path
+
+# ── WORKER POOL ────────────────────────────────────────────────────────────────
+
+class DocumentPool:
+    """
+    Runs the `save_*_book` builders on `workers` processes and returns futures
+    of the saved paths. With `workers` <= 1 documents are built on a single
+    background thread instead, which keeps the caller's event loop free
+    without the cost of starting processes.
+
+    Workers are spawned rather than forked: the builders run alongside
+    generation threads, and forking a threaded process is not safe.
+    """
+
+    def __init__(self, workers: int = DEFAULT_DOCX_WORKERS, export: str | None = None, formats=None):
+        self.workers = max(0, int(workers))
+        # Passed to every builder explicitly: spawned workers do not see the parent's module globals.
+        self._options = {key: value for key, value in (("export", export), ("formats", formats))
+                         if value is not None}
+        if self.workers <= 1:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="docx")
+        else:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, builder, *args):
+        """Schedules `builder(*args)`, with the pool's export options; the future resolves to the saved path."""
+        return self._executor.submit(builder, *args, **self._options)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown(wait=True)
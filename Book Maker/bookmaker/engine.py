@@ -0,0 +1,133 @@
+"""
+Async generation engine shared by the stage-2 book builders.
+
+A book is planned up front as an ordered list of `Section`s. Every section's
+prompt is then sent concurrently (across all books in the batch) with a cap on
+the number of requests in flight, and the results are written back onto the
+sections so the caller can assemble documents in the original order.
+
+Callers that generate several books at once share one cap. With a
+`PriorityGate` as that cap, a free slot goes to the waiting section with
+the highest priority across all of those books, not to the one that asked
+first.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+from dataclasses import dataclass
+
+from bookmaker import telemetry
+
+DEFAULT_CONCURRENCY = int(os.getenv("BOOKMAKER_CONCURRENCY", "8"))
+
+
+@dataclass
+class Section:
+    """
+    One generated block of a book: a heading plus the prompt for its body.
+    `context` is the book-wide prompt prefix shared by every section of the book.
+    `digest` is the hash of the section's own inputs (see bookmaker.manifest).
+    `words`, `model` and `max_tokens` are set by the scheduler (see bookmaker.schedule).
+    """
+    book: str
+    key: str
+    kind: str
+    heading: str
+    level: int
+    prompt: str
+    text: str = ""
+    error: str = ""
+    context: str = ""
+    digest: str = ""
+    words: int = 0
+    model: str = ""
+    max_tokens: int | None = None
+
+
+class PriorityGate:
+    """
+    A semaphore that lets its waiters in highest `priority` first, in arrival
+    order on ties. `async with gate` waits with priority 0.
+    """
+    def __init__(self, slots: int = DEFAULT_CONCURRENCY):
+        self._free = max(1, int(slots))
+        self._waiters = []  # heap of (-priority, arrival, future)
+        self._arrivals = itertools.count()
+
+    async def acquire(self, priority: float = 0.0):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._arrivals), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot was handed over just as we were cancelled
+            raise
+
+    def release(self):
+        while self._waiters:
+            future = heapq.heappop(self._waiters)[2]
+            if not future.done():  # cancelled waiters are skipped here
+                future.set_result(None)
+                return
+        self._free += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+async def run_bounded(jobs, worker, concurrency: int = DEFAULT_CONCURRENCY, semaphore=None,
+                      priority=None) -> list:
+    """
+    Awaits `worker(job)` for every job with at most `concurrency` calls in
+    flight. Results are returned in the same order as `jobs`. Passing a shared
+    `semaphore` caps several concurrent `run_bounded` calls as one pool. With
+    `priority(job)`, a PriorityGate (the shared one, if `semaphore` is one)
+    starts the highest-priority waiting job first.
+    """
+    if semaphore is None:
+        semaphore = PriorityGate(concurrency) if priority is not None else asyncio.Semaphore(max(1, int(concurrency)))
+
+    async def _run(job):
+        if priority is not None and isinstance(semaphore, PriorityGate):
+            await semaphore.acquire(priority(job))
+            try:
+                return await worker(job)
+            finally:
+                semaphore.release()
+        async with semaphore:
+            return await worker(job)
+
+    return await asyncio.gather(*(_run(job) for job in jobs))
+
+
+async def generate_sections(sections, agenerate, concurrency: int = DEFAULT_CONCURRENCY,
+                            on_complete=None, semaphore=None, priority=None) -> list:
+    """
+    Fills in `section.text` for every section that has none yet using the async
+    `agenerate(section)`. `on_complete(section)` is called as each one succeeds;
+    a section whose call raised keeps empty text and records `section.error`.
+    `semaphore` and `priority(section)` are passed on to run_bounded.
+    """
+    async def _fill(section):
+        try:
+            with telemetry.context(book=section.book, chapter=section.key.split(".")[0],
+                                   section=section.key, kind=section.kind):
+                section.text = await agenerate(section)
+        except Exception as e:
+            section.error = str(e) or type(e).__name__
+            return section
+        section.error = ""
+        if on_complete is not None:
+            on_complete(section)
+        return section
+
+    pending = [section for section in sections if not section.text]
+    return await run_bounded(pending, _fill, concurrency, semaphore, priority)
@@ -0,0 +1,387 @@
+"""
+Streaming book export: DOCX written straight into its zip, plus EPUB and Markdown.
+
+python-docx builds an object tree for the whole document before it saves.
+The writers here skip the tree. A book's layout is a stream of `Block`s
+(`nonfiction_blocks`, `kids_fiction_blocks`) that mirror the python-docx
+builders in `bookmaker.documents`: title page, copyright page, headings,
+page breaks and the hyperlink runs of `add_hyperlink`. Each writer
+serialises the blocks as they arrive. `DocxStream` copies the styles,
+theme, settings and section properties of python-docx's default template
+and streams word/document.xml into the zip entry, so it renders like the
+python-docx output.
+
+Section text becomes one paragraph per line, from `bookmaker.cleanup`,
+in both backends. Other text, like the kids copyright notice, keeps its
+line breaks.
+"""
+import os
+import re
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from xml.sax.saxutils import escape, quoteattr
+
+EXPORT_FORMATS = ("docx", "epub", "md")
+FLUSH_BYTES = 64 * 1024
+
+# ── LAYOUT ─────────────────────────────────────────────────────────────────────
+
+@dataclass
+class Block:
+    """
+    One paragraph ("p") or page break ("break"). `style` is a Word paragraph
+    style ID such as Title or Heading1, `size` a font size in points, and a
+    block with `url` is rendered as a hyperlink like `add_hyperlink`'s.
+    """
+    kind: str
+    text: str = ""
+    style: str | None = None
+    align: str | None = None
+    size: float | None = None
+    font: str | None = None
+    url: str | None = None
+
+
+PAGE_BREAK = Block("break")
+
+KIDS_COPYRIGHT = ("Copyright © 2025 AI Book Generator\n"
+                  "This is a work of fiction for children. Names, characters, places, and incidents either "
+                  "are the product of the author's imagination or are used fictitiously.\n"
+                  "Any resemblance to actual events, locales, or persons, living or dead, is "
+                  "entirely coincidental.\n"
+                  "All rights reserved.\n"
+                  "For permissions, contact support@yourplatform.com\n\n"
+                  "Recommended for ages 6-12")
+
+# Normal style of the kids books (kids_fiction_doc sets it on the document)
+KIDS_NORMAL = {"font": "Calibri", "size": 12}
+
+
+def heading(text: str, level: int, align: str | None = None) -> Block:
+    return Block("p", text, style="Title" if level == 0 else f"Heading{level}", align=align)
+
+
+def body(paragraphs):
+    """One block per cleaned paragraph; an empty list still yields an empty one, as `documents.add_paragraphs` does."""
+    for paragraph in paragraphs or [""]:
+        yield Block("p", paragraph)
+
+
+def nonfiction_blocks(title: str, sections):
+    """The layout of `documents.nonfiction_doc`; each section is cleaned only when its blocks are reached."""
+    from bookmaker.cleanup import clean_text
+
+    yield Block("p", title, style="Title", align="center", size=20)
+    yield Block("p", "By AI Book Generator", align="center", size=14)
+    yield PAGE_BREAK
+    chapter_open = False
+
+    for section in sections:
+        paragraphs = clean_text(section.kind, section.heading, section.text)
+        if section.kind == "intro":
+            if section.text.strip():
+                yield heading(section.heading, 1)
+                yield from body(paragraphs)
+                yield Block("p")  # spacing
+                yield PAGE_BREAK
+            continue
+
+        if section.kind == "chapter_intro":
+            if chapter_open:
+                yield PAGE_BREAK
+            chapter_open = True
+
+        yield heading(section.heading, section.level)
+        yield from body(paragraphs)
+        yield Block("p")
+
+    if chapter_open:
+        yield PAGE_BREAK
+
+
+def kids_fiction_blocks(book_title: str, author_name: str, sections):
+    """The layout of `documents.kids_fiction_doc`; each section is cleaned only when its blocks are reached."""
+    from bookmaker.cleanup import clean_text
+
+    yield Block("p", book_title, style="Title", align="center", size=24)
+    yield Block("p", f"By {author_name}", align="center", size=14, font="Calibri")
+    yield PAGE_BREAK
+    yield heading("Copyright", 1, align="center")
+    yield Block("p", KIDS_COPYRIGHT, align="center")
+    yield PAGE_BREAK
+    for section in sections:
+        paragraphs = clean_text(section.kind, section.heading, section.text)
+        yield heading(section.heading, 1, align="center")
+        yield from body(paragraphs)
+        yield PAGE_BREAK
+
+# ── DOCX ───────────────────────────────────────────────────────────────────────
+
+_INVALID_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_template = None
+
+
+def _docx_template() -> dict[str, bytes]:
+    """The parts of python-docx's default.docx, read once per process."""
+    global _template
+    if _template is None:
+        import docx
+        path = os.path.join(os.path.dirname(docx.__file__), "templates", "default.docx")
+        with zipfile.ZipFile(path) as source:
+            _template = {name: source.read(name) for name in source.namelist()}
+    return _template
+
+
+def _text_xml(text: str) -> str:
+    """Run content: text with tabs and line breaks as python-docx writes them."""
+    parts = []
+    for i, line in enumerate(_INVALID_XML.sub("", text).split("\n")):
+        if i:
+            parts.append("<w:br/>")
+        for j, piece in enumerate(line.split("\t")):
+            if j:
+                parts.append("<w:tab/>")
+            if piece:
+                space = ' xml:space="preserve"' if piece != piece.strip() else ""
+                parts.append(f"<w:t{space}>{escape(piece)}</w:t>")
+    return "".join(parts)
+
+
+class DocxStream:
+    def __init__(self, path: str, title: str = "", normal: dict | None = None):
+        self.path = path
+        self.title = title
+        self.normal = normal
+        self._links = []
+        self._buffer, self._buffered = [], 0
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=directory, suffix=".docx.tmp")
+        os.close(fd)
+        self._zip = zipfile.ZipFile(self._tmp, "w", zipfile.ZIP_DEFLATED)
+        template = _docx_template()
+        for name, data in template.items():
+            if name not in ("word/document.xml", "word/_rels/document.xml.rels"):
+                self._zip.writestr(name, self._part(name, data))
+        document = template["word/document.xml"].decode("utf-8")
+        body_start = document.index("<w:body>") + len("<w:body>")
+        sect_start = document.index("<w:sectPr")
+        self._suffix = document[sect_start:]
+        self._doc = self._zip.open("word/document.xml", "w")
+        self._write(document[:body_start])
+
+    def _part(self, name: str, data: bytes) -> bytes:
+        if name == "word/styles.xml" and self.normal:
+            styles = data.decode("utf-8")
+            font, size = self.normal.get("font"), self.normal.get("size")
+            rpr = "<w:rPr>" + (f'<w:rFonts w:ascii="{font}" w:hAnsi="{font}"/>' if font else "") + \
+                  (f'<w:sz w:val="{int(size * 2)}"/>' if size else "") + "</w:rPr>"
+            styles = re.sub(r'(<w:style [^>]*w:styleId="Normal"[^>]*>.*?)(\s*</w:style>)',
+                            lambda m: m.group(1) + rpr + m.group(2), styles, count=1, flags=re.S)
+            return styles.encode("utf-8")
+        if name == "docProps/core.xml" and self.title:
+            return data.replace(b"<dc:title/>", f"<dc:title>{escape(self.title)}</dc:title>".encode("utf-8"))
+        return data
+
+    def _write(self, xml: str):
+        self._buffer.append(xml)
+        self._buffered += len(xml)
+        if self._buffered >= FLUSH_BYTES:
+            self._flush()
+
+    def _flush(self):
+        self._doc.write("".join(self._buffer).encode("utf-8"))
+        self._buffer, self._buffered = [], 0
+
+    def write(self, block: Block):
+        if block.kind == "break":
+            self._write('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+            return
+        ppr = (f'<w:pStyle w:val="{block.style}"/>' if block.style else "") + \
+              (f'<w:jc w:val="{block.align}"/>' if block.align else "")
+        xml = ["<w:p>", f"<w:pPr>{ppr}</w:pPr>" if ppr else ""]
+        if block.url:
+            self._links.append(block.url)
+            # The run add_hyperlink builds, property order included.
+            xml.append(f'<w:hyperlink r:id="rIdLink{len(self._links)}"><w:r><w:rPr><w:b w:val="true"/>'
+                       f'<w:sz w:val="{int((block.size or 12) * 2)}"/><w:color w:val="0000FF"/>'
+                       f'<w:rStyle w:val="Hyperlink"/></w:rPr>{_text_xml(block.text)}</w:r></w:hyperlink>')
+        elif block.text:
+            rpr = (f'<w:rFonts w:ascii="{block.font}" w:hAnsi="{block.font}"/>' if block.font else "") + \
+                  (f'<w:sz w:val="{int(block.size * 2)}"/>' if block.size else "")
+            xml.append(f"<w:r>{f'<w:rPr>{rpr}</w:rPr>' if rpr else ''}{_text_xml(block.text)}</w:r>")
+        xml.append("</w:p>")
+        self._write("".join(xml))
+
+    def close(self):
+        self._write(self._suffix)
+        self._flush()
+        self._doc.close()
+        rels = _docx_template()["word/_rels/document.xml.rels"].decode("utf-8")
+        links = "".join(f'<Relationship Id="rIdLink{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                        f'relationships/hyperlink" Target={quoteattr(url)} TargetMode="External"/>'
+                        for i, url in enumerate(self._links, start=1))
+        self._zip.writestr("word/_rels/document.xml.rels", rels.replace("</Relationships>", links + "</Relationships>"))
+        self._zip.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._zip.close()
+        os.remove(self._tmp)
+
+# ── EPUB ───────────────────────────────────────────────────────────────────────
+
+EPUB_CSS = """body { font-family: serif; }
+h1.title, p.center, h1.center { text-align: center; }
+.pagebreak { page-break-after: always; }
+"""
+
+
+class EpubStream:
+    """EPUB 3 with one XHTML file per Heading 1 (the front matter is the first file)."""
+
+    def __init__(self, path: str, title: str, author: str = "", language: str = "en"):
+        self.path, self.title, self.author, self.language = path, title, author, language
+        self._files = []  # (file name, heading)
+        self._entry = None
+        fd, self._tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".epub.tmp")
+        os.close(fd)
+        self._zip = zipfile.ZipFile(self._tmp, "w", zipfile.ZIP_DEFLATED)
+        self._zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr("META-INF/container.xml",
+                           '<?xml version="1.0" encoding="UTF-8"?>\n<container version="1.0" '
+                           'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                           '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                           '</rootfiles></container>')
+        self._zip.writestr("OEBPS/style.css", EPUB_CSS)
+        self._open(title)
+
+    def _open(self, heading_text: str):
+        self._close_entry()
+        name = f"part{len(self._files):04d}.xhtml"
+        self._files.append((name, heading_text))
+        self._written = False
+        self._entry = self._zip.open(f"OEBPS/{name}", "w")
+        self._entry.write(('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+                           f'<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="{self.language}"><head>'
+                           f'<title>{escape(heading_text)}</title><link rel="stylesheet" href="style.css"/>'
+                           '</head><body>\n').encode("utf-8"))
+
+    def _close_entry(self):
+        if self._entry is not None:
+            self._entry.write(b"</body></html>\n")
+            self._entry.close()
+            self._entry = None
+
+    def write(self, block: Block):
+        if block.kind == "break":
+            return
+        if block.style == "Heading1":
+            if self._written:
+                self._open(block.text)
+            else:
+                self._files[-1] = (self._files[-1][0], block.text)
+        text = "<br/>".join(escape(_INVALID_XML.sub("", line)) for line in block.text.split("\n"))
+        css = f' class="{block.align}"' if block.align else ""
+        if block.url:
+            text = f"<a href={quoteattr(block.url)}>{text}</a>"
+        if block.style == "Title":
+            xml = f'<h1 class="title">{text}</h1>'
+        elif block.style and block.style.startswith("Heading"):
+            level = min(6, int(block.style[len("Heading"):] or 1) + 1)
+            xml = f"<h{level}{css}>{text}</h{level}>"
+        else:
+            xml = f"<p{css}>{text}</p>" if text else ""
+        if xml:
+            self._entry.write((xml + "\n").encode("utf-8"))
+            self._written = True
+
+    def close(self):
+        self._close_entry()
+        items = "".join(f'<item id="p{i}" href="{name}" media-type="application/xhtml+xml"/>'
+                        for i, (name, _) in enumerate(self._files))
+        spine = "".join(f'<itemref idref="p{i}"/>' for i in range(len(self._files)))
+        self._zip.writestr("OEBPS/content.opf", (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+            'unique-identifier="bookid"><metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="bookid">urn:bookmaker:{escape(re.sub(r"[^0-9A-Za-z]+", "-", self.title))}'
+            f'</dc:identifier><dc:title>{escape(self.title)}</dc:title><dc:language>{self.language}</dc:language>'
+            + (f"<dc:creator>{escape(self.author)}</dc:creator>" if self.author else "") +
+            '<meta property="dcterms:modified">2025-01-01T00:00:00Z</meta></metadata><manifest>'
+            '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+            f'<item id="css" href="style.css" media-type="text/css"/>{items}</manifest><spine>{spine}</spine>'
+            '</package>'))
+        toc = "".join(f'<li><a href="{name}">{escape(heading_text)}</a></li>'
+                      for name, heading_text in self._files)
+        self._zip.writestr("OEBPS/nav.xhtml", (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n<html xmlns="http://www.w3.org/1999/xhtml" '
+            'xmlns:epub="http://www.idpf.org/2007/ops"><head><title>Contents</title></head><body>'
+            f'<nav epub:type="toc"><h1>Contents</h1><ol>{toc}</ol></nav></body></html>'))
+        self._zip.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._close_entry()
+        self._zip.close()
+        os.remove(self._tmp)
+
+# ── MARKDOWN ───────────────────────────────────────────────────────────────────
+
+class MarkdownStream:
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp = path + ".tmp"
+        self._file = open(self._tmp, "w", encoding="utf-8")
+
+    def write(self, block: Block):
+        if block.kind == "break" or not block.text:
+            return
+        text = block.text.replace("\n", "  \n")
+        if block.url:
+            text = f"[{text}]({block.url})"
+        if block.style == "Title":
+            text = f"# {text}"
+        elif block.style and block.style.startswith("Heading"):
+            text = "#" * min(6, int(block.style[len("Heading"):] or 1) + 1) + f" {text}"
+        self._file.write(text + "\n\n")
+
+    def close(self):
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp)
+
+# ── ENTRY POINT ────────────────────────────────────────────────────────────────
+
+def write_book(docx_path: str, blocks, title: str, author: str = "", formats=("docx",),
+               normal: dict | None = None) -> str:
+    """
+    Streams `blocks` into every requested format in one pass: "docx" at
+    `docx_path`, "epub" and "md" next to it. Returns `docx_path`.
+    """
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown export format(s): {', '.join(sorted(unknown))}")
+    base = os.path.splitext(docx_path)[0]
+    os.makedirs(os.path.dirname(docx_path) or ".", exist_ok=True)
+    writers = []
+    try:
+        if "docx" in formats:
+            writers.append(DocxStream(docx_path, title, normal))
+        if "epub" in formats:
+            writers.append(EpubStream(base + ".epub", title, author))
+        if "md" in formats:
+            writers.append(MarkdownStream(base + ".md"))
+        for block in blocks:
+            for writer in writers:
+                writer.write(block)
+    except BaseException:
+        for writer in writers:
+            writer.abort()
+        raise
+    for writer in writers:
+        writer.close()
+    return docx_path
@@ -0,0 +1,306 @@
+"""
+Local OpenAI-compatible stand-in for exercising the client layer offline.
+
+Serves POST /v1/chat/completions with canned text after a delay drawn
+from a uniform or log-normal distribution, and can inject 429s (at random
+or whenever more than `max_concurrent` requests are in flight) and requests
+that hang until the client times out. Completions are paced at
+`tokens_per_sec`, streamed as SSE chunks when asked, optionally with
+injected mid-stream stalls. Prompts that ask for the stage-1 JSON (genre and
+audience, or a chapter outline) get well-formed JSON back, so the whole
+pipeline can run offline; structured-output requests (`response_format` of
+type json_schema) get a reply shaped like the named stage-1 plan schema.
+Like the real API, a repeated system-message prefix of at least 1024
+tokens is reported as cached in `usage.prompt_tokens_details.cached_tokens`.
+With `follow_word_count`, a prompt asking for an "N-word" text gets N
+filler words. A completion longer than the request's max_tokens is cut
+there with finish_reason "length". POST /v1/audio/speech returns silent
+24 kHz 16-bit PCM whose length follows the input text. Point the scripts
+at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 and any
+OPENAI_API_KEY.
+
+    python -m bookmaker.fakeserver --port 8089 --rate-limit-prob 0.2
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+FILLER = ("the quick study of habits shows that small steady changes build lasting results "
+          "for readers who practise every day and reflect on what they learn").split()
+
+
+@dataclass
+class FakeServerConfig:
+    min_latency: float = 0.05
+    max_latency: float = 0.2
+    rate_limit_prob: float = 0.0
+    max_concurrent: int = 0  # 0 disables the overload 429s
+    retry_after: float = 0.1
+    tokens_per_sec: float = 0.0  # 0 sends the streamed words back to back
+    stall_prob: float = 0.0
+    stall_seconds: float = 60.0
+    latency_distribution: str = "uniform"  # or "lognormal": median halfway between min and max
+    latency_sigma: float = 0.5
+    timeout_prob: float = 0.0
+    timeout_seconds: float = 30.0
+    completion_words: int = 0  # 0 echoes the prompt; otherwise this many filler words
+    follow_word_count: bool = False  # answer "Write a 500-word ..." with 500 filler words
+
+
+class FakeOpenAIServer:
+    def __init__(self, config: FakeServerConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeServerConfig()
+        self.counts = {"requests": 0, "rate_limited": 0, "timed_out": 0, "completed": 0}
+        self._in_flight = 0
+        self._prefixes = set()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def completion_text(self, body: dict) -> str:
+        prompt = str(body.get("messages", [{}])[-1].get("content", ""))
+        structured = (body.get("response_format") or {}).get("json_schema")
+        if structured:
+            return json.dumps(self.structured(structured, prompt))
+        if '"genre"' in prompt and '"audience"' in prompt:
+            return json.dumps({"genre": "Self-Help", "audience": "Adults"})
+        if '{"chapters"' in prompt:
+            return json.dumps({"chapters": self.outline(prompt)})
+        asked = re.search(r"(\d+)[ -]word", prompt) if self.config.follow_word_count else None
+        words = int(asked.group(1)) if asked else self.config.completion_words
+        if words:
+            filler = FILLER * (words // len(FILLER) + 1)
+            return f"Generated text for: {prompt[:80]}\n" + " ".join(filler[:words])
+        return f"Generated text for: {prompt[:80]}"
+
+    def structured(self, json_schema: dict, prompt: str) -> dict:
+        """A reply matching one of the stage-1 plan schemas (see bookmaker.outline)."""
+        name = json_schema.get("name", "")
+        properties = json_schema.get("schema", {}).get("properties", {})
+        if name == "subheadings_repair":
+            per_chapter = re.search(r"(\d+) subheadings", prompt)
+            count = int(per_chapter.group(1)) if per_chapter else 4
+            return {"chapters": [{"chapter": int(n), "subheadings": [f"Part {n}.{j + 1}" for j in range(count)]}
+                                 for n in re.findall(r"chapter (\d+) '", prompt)]}
+        reply = {field: {"genre": "Self-Help", "audience": "Adults"}.get(field, f"Generated {field}.")
+                 for field in properties if field != "chapters"}
+        if "chapters" in properties:
+            reply["chapters"] = self.outline(prompt)
+        return reply
+
+    @staticmethod
+    def outline(prompt: str) -> list[dict]:
+        """A chapter outline shaped like the one the stage-1 prompt asks for."""
+        chapters = re.search(r"list of (\d+)", prompt)
+        subheadings = re.search(r"(\d+) (?:\w+ )?subheadings", prompt)
+        count, per_chapter = int(chapters.group(1)) if chapters else 5, int(subheadings.group(1)) if subheadings else 4
+        salt = random.getrandbits(24)
+        return [{"title": f"Topic {salt:06x}-{i + 1}",
+                 "subheadings": [f"Part {i + 1}.{j + 1}" for j in range(per_chapter)]}
+                for i in range(count)]
+
+    @staticmethod
+    def speech_audio(body: dict) -> bytes:
+        """Silence as long as reading the input would take (about 20 characters a second)."""
+        return b"\0\0" * max(1, int(len(str(body.get("input", ""))) * 0.05 * 24000))
+
+    def cached_tokens(self, body: dict) -> int:
+        """Tokens of a previously seen system prefix, in 128-token steps from 1024 as the API reports them."""
+        messages = body.get("messages") or []
+        if not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = str(messages[0].get("content", ""))
+        tokens = len(prefix) // 4
+        if tokens < 1024:
+            return 0
+        digest = hashlib.sha1(prefix.encode("utf-8")).hexdigest()
+        with self._lock:
+            seen = digest in self._prefixes
+            self._prefixes.add(digest)
+        return tokens // 128 * 128 if seen else 0
+
+    def latency(self) -> float:
+        low, high = self.config.min_latency, self.config.max_latency
+        if self.config.latency_distribution == "lognormal":
+            return max(low, (low + high) / 2 * math.exp(random.gauss(0.0, self.config.latency_sigma)))
+        return random.uniform(low, high)
+
+    def _admit(self) -> bool:
+        with self._lock:
+            self.counts["requests"] += 1
+            overloaded = self.config.max_concurrent and self._in_flight >= self.config.max_concurrent
+            if overloaded or random.random() < self.config.rate_limit_prob:
+                self.counts["rate_limited"] += 1
+                return False
+            self._in_flight += 1
+            return True
+
+    def _finish(self):
+        with self._lock:
+            self._in_flight -= 1
+            self.counts["completed"] += 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict, headers: dict | None = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, body: dict, text: str, usage: dict, finish_reason: str = "stop"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                base = {"id": f"chatcmpl-fake-{random.getrandbits(32):08x}", "object": "chat.completion.chunk",
+                        "created": int(time.time()), "model": body.get("model", "fake")}
+                words = text.split(" ")
+                stall_at = random.randrange(len(words)) if random.random() < server.config.stall_prob else -1
+                for i, word in enumerate(words):
+                    if i == stall_at:
+                        time.sleep(server.config.stall_seconds)
+                    if server.config.tokens_per_sec > 0:
+                        time.sleep(1.0 / server.config.tokens_per_sec)
+                    delta = word if i == 0 else " " + word
+                    chunk = dict(base, choices=[{"index": 0, "delta": {"content": delta}, "finish_reason": None}])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                done = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+                self.wfile.write(f"data: {json.dumps(done)}\n\n".encode("utf-8"))
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                speech = self.path.rstrip("/").endswith("/audio/speech")
+                if not speech and not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                    return
+                if not server._admit():
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                               "code": "rate_limit_exceeded"}},
+                               {"retry-after": str(server.config.retry_after)})
+                    return
+                try:
+                    if random.random() < server.config.timeout_prob:
+                        with server._lock:
+                            server.counts["timed_out"] += 1
+                        time.sleep(server.config.timeout_seconds)
+                        self._send(504, {"error": {"message": "Gateway timeout", "type": "server_error"}})
+                        return
+                    time.sleep(server.latency())
+                    if speech:
+                        audio = server.speech_audio(body)
+                        self.send_response(200)
+                        self.send_header("Content-Type", "audio/pcm")
+                        self.send_header("Content-Length", str(len(audio)))
+                        self.end_headers()
+                        self.wfile.write(audio)
+                        return
+                    text, finish_reason = server.completion_text(body), "stop"
+                    if body.get("max_tokens") and len(text) // 4 > body["max_tokens"]:
+                        text, finish_reason = text[:body["max_tokens"] * 4], "length"
+                    prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+                    completion_tokens = max(1, len(text) // 4)
+                    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                             "total_tokens": prompt_tokens + completion_tokens,
+                             "prompt_tokens_details": {"cached_tokens": server.cached_tokens(body)}}
+                    if body.get("stream"):
+                        self._stream(body, text, usage, finish_reason)
+                        return
+                    if server.config.tokens_per_sec > 0:
+                        time.sleep(completion_tokens / server.config.tokens_per_sec)
+                    self._send(200, {
+                        "id": f"chatcmpl-fake-{random.getrandbits(32):08x}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "fake"),
+                        "choices": [{"index": 0, "finish_reason": finish_reason,
+                                     "message": {"role": "assistant", "content": text}}],
+                        "usage": usage,
+                    })
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up on a stalled stream
+                finally:
+                    server._finish()
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local fake OpenAI chat-completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--min-latency", type=float, default=0.05)
+    parser.add_argument("--max-latency", type=float, default=0.2)
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0)
+    parser.add_argument("--max-concurrent", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--stall-prob", type=float, default=0.0)
+    parser.add_argument("--stall-seconds", type=float, default=60.0)
+    parser.add_argument("--latency-distribution", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--timeout-prob", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=30.0)
+    parser.add_argument("--completion-words", type=int, default=0)
+    parser.add_argument("--follow-word-count", action="store_true")
+    args = parser.parse_args(argv)
+
+    config = FakeServerConfig(args.min_latency, args.max_latency, args.rate_limit_prob,
+                              args.max_concurrent, args.retry_after, args.tokens_per_sec,
+                              args.stall_prob, args.stall_seconds, args.latency_distribution,
+                              args.latency_sigma, args.timeout_prob, args.timeout_seconds,
+                              args.completion_words, args.follow_word_count)
+    server = FakeOpenAIServer(config, args.host, args.port)
+    print(f"Fake OpenAI server listening on {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Hedged requests for completions that run far past their usual latency.
+
+Opt-in with BOOKMAKER_HEDGE=1. For every class of call, i.e. the same model,
+max_tokens and telemetry prompt kind, the policy keeps a window of recent
+request latencies. A call still running after the BOOKMAKER_HEDGE_PERCENTILE
+latency of its class (never sooner than BOOKMAKER_HEDGE_MIN_DELAY seconds)
+gets one duplicate request, and whichever finishes first is used. The
+loser is cancelled. Under asyncio the cancel is real. A sync call's losing
+thread runs to completion in the background, and its result is dropped.
+The hedge's concurrency slot is held until both threads are done, so a
+primary that lost still counts as a call in flight.
+
+Extra spend is capped: the estimated tokens of all hedges may not exceed
+BOOKMAKER_HEDGE_MAX_EXTRA times the estimated tokens of all primary calls.
+A hedge whose result is not used (it lost, failed or was cancelled) gives
+its estimate back to the cap and to the token budget. A hedge is also
+skipped when the request/token budgets or the concurrency cap have no room
+right now, so hedging never delays other calls. No deadline is set until a
+class has BOOKMAKER_HEDGE_MIN_SAMPLES latencies.
+
+The saved latency of a hedge that wins is estimated as the mean recent
+latency of that class beyond the moment the hedge finished, minus that
+moment. The cancelled primary's real finish time is never observed.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+ENABLED = os.getenv("BOOKMAKER_HEDGE", "0").strip().lower() in ("1", "true", "yes", "on")
+PERCENTILE = float(os.getenv("BOOKMAKER_HEDGE_PERCENTILE", "95"))
+MAX_EXTRA = float(os.getenv("BOOKMAKER_HEDGE_MAX_EXTRA", "0.05"))
+MIN_SAMPLES = int(os.getenv("BOOKMAKER_HEDGE_MIN_SAMPLES", "20"))
+MIN_DELAY = float(os.getenv("BOOKMAKER_HEDGE_MIN_DELAY", "1.0"))
+WINDOW = 500
+THREADS = 128
+
+
+class HedgePolicy:
+    def __init__(self, percentile: float = PERCENTILE, max_extra: float = MAX_EXTRA,
+                 min_samples: int = MIN_SAMPLES, min_delay: float = MIN_DELAY, window: int = WINDOW):
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.primaries = 0
+        self.hedges = 0
+        self.wins = 0
+        self.saved = 0.0
+        self._primary_tokens = 0
+        self._hedge_tokens = 0
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @classmethod
+    def from_env(cls):
+        """The policy configured by BOOKMAKER_HEDGE*, or None when hedging is off."""
+        return cls() if ENABLED else None
+
+    def deadline(self, key) -> float | None:
+        """Seconds after which a call of class `key` is hedged; None until enough latencies are known."""
+        with self._lock:
+            samples = sorted(self._latencies[key])
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(self.percentile / 100 * len(samples)))
+        return max(self.min_delay, samples[index])
+
+    def observe(self, key, latency: float):
+        with self._lock:
+            self._latencies[key].append(latency)
+
+    def _start(self, estimate: int):
+        with self._lock:
+            self.primaries += 1
+            self._primary_tokens += estimate
+
+    def _allow(self, estimate: int) -> bool:
+        """Books one hedge of `estimate` tokens if the spend cap allows it."""
+        with self._lock:
+            if self._hedge_tokens + estimate > self.max_extra * self._primary_tokens:
+                return False
+            self.hedges += 1
+            self._hedge_tokens += estimate
+            return True
+
+    def _won(self, key, elapsed: float):
+        with self._lock:
+            tail = [latency for latency in self._latencies[key] if latency > elapsed]
+            self.wins += 1
+            if tail:
+                self.saved += sum(tail) / len(tail) - elapsed
+
+    async def arun(self, call, key, estimate: int, reserve):
+        """
+        Awaits `call()`, and awaits a second `call()` too if the first outlives
+        the deadline of `key`; returns the first successful result. `reserve()`
+        claims the budgets for the duplicate and returns a `release(exc, used)`
+        callable, or None when there is no room for it.
+        """
+        self._start(estimate)
+        started = time.monotonic()
+        primary, hedge, winner = asyncio.ensure_future(call()), None, None
+        deadline = self.deadline(key)
+        try:
+            if deadline is not None:
+                await asyncio.wait({primary}, timeout=deadline)
+            release = None if primary.done() or deadline is None else self._reserve(estimate, reserve)
+            if release is None:
+                result = await primary
+                self.observe(key, time.monotonic() - started)
+                return result
+            hedge_started = time.monotonic()
+            hedge = asyncio.ensure_future(call())
+            pending, error = {primary, hedge}, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    winner = task
+                    if task is hedge:
+                        self.observe(key, time.monotonic() - hedge_started)
+                        self._won(key, time.monotonic() - started)
+                    else:
+                        self.observe(key, time.monotonic() - started)
+                    return task.result()
+            raise error
+        finally:
+            # Also on cancellation or an unexpected error: neither call may outlive this one.
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+            if hedge is not None:
+                self._settle(primary, hedge, winner is hedge, estimate, release)
+
+    def run(self, call, key, estimate: int, reserve):
+        """Thread-based twin of `arun` for the synchronous `llm.chat`."""
+        self._start(estimate)
+        deadline = self.deadline(key)
+        if deadline is None:
+            started = time.monotonic()
+            result = call()
+            self.observe(key, time.monotonic() - started)
+            return result
+        pool = self._executor()
+        started = time.monotonic()
+        primary = pool.submit(contextvars.copy_context().run, call)
+        done, _ = wait([primary], timeout=deadline)
+        release = None if done else self._reserve(estimate, reserve)
+        if release is None:
+            result = primary.result()
+            self.observe(key, time.monotonic() - started)
+            return result
+        hedge_started = time.monotonic()
+        hedge, winner = pool.submit(contextvars.copy_context().run, call), None
+        try:
+            pending, error = {primary, hedge}, None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        error = error or future.exception()
+                        continue
+                    winner = future
+                    if future is hedge:
+                        self.observe(key, time.monotonic() - hedge_started)
+                        self._won(key, time.monotonic() - started)
+                    else:
+                        self.observe(key, time.monotonic() - started)
+                    return future.result()
+            raise error
+        finally:
+            # The caller frees one slot when this returns; the hedge's stays taken until the loser is done too.
+            self._settle(primary, hedge, winner is hedge, estimate, release)
+
+    def _settle(self, primary, hedge, used: bool, estimate: int, release):
+        """
+        Once both calls are done, frees the hedge's slot with `release(exc,
+        used)`. A hedge whose result was not used (it lost, failed or was
+        cancelled) also gives its estimate back to the spend cap.
+        """
+        def settle():
+            if not used:
+                with self._lock:
+                    self._hedge_tokens -= estimate
+            release(None if hedge.cancelled() else hedge.exception(), used)
+
+        running = [future for future in (primary, hedge) if not future.done()]
+        if not running:
+            settle()
+            return
+        left, lock = [len(running)], threading.Lock()
+
+        def finished(_):
+            with lock:
+                left[0] -= 1
+                last = left[0] == 0
+            if last:
+                settle()
+        for future in running:
+            future.add_done_callback(finished)
+
+    def _reserve(self, estimate: int, reserve):
+        """The hedge's `release(exc, used)` if both the spend cap and `reserve()` allow one, else None."""
+        if not self._allow(estimate):
+            return None
+        release = reserve()
+        if release is None:
+            with self._lock:
+                self.hedges -= 1
+                self._hedge_tokens -= estimate
+        return release
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Every primary runs here while it is watched, so size it like the number of calls in flight.
+                self._pool = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="bookmaker-hedge")
+            return self._pool
+
+    def summary(self) -> str:
+        with self._lock:
+            primaries, hedges, wins, saved = self.primaries, self.hedges, self.wins, self.saved
+        return (f"🪁 Hedging (p{self.percentile:g} deadline, {self.max_extra:.0%} spend cap): {hedges} of "
+                f"{primaries} calls hedged ({hedges / max(1, primaries):.1%}), {wins} won by the hedge, "
+                f"~{saved:.1f}s of latency saved")
@@ -0,0 +1,230 @@
+"""
+Persistent SQLite job queue shared by submitters and book workers.
+
+Every job is one title of one kind (an outline to build, a non-fiction book
+or a kids fiction book to generate) and is identified by `kind:book`, so
+submitting a title that is already queued, running or done is a no-op
+unless it is forced. Workers claim jobs with a lease. While a job runs, its
+worker renews the lease with heartbeats. If a worker dies, the lease
+expires and another worker reclaims the job. A job that fails goes back to
+the queue until it has used `max_attempts` claims, and then stays failed
+until it is retried explicitly.
+
+Claims happen inside `BEGIN IMMEDIATE`, so two processes never lease the
+same job. The database uses WAL mode, which lets readers and the single
+writer proceed in parallel. Completing a job can enqueue follow-up jobs in
+the same transaction; an outline job hands its rows to a book job this way.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+DEFAULT_QUEUE_PATH = os.getenv("BOOKMAKER_QUEUE", "bookmaker_jobs.sqlite3")
+DEFAULT_LEASE = 120.0
+MAX_ATTEMPTS = 3
+STATUSES = ("queued", "leased", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    key           TEXT NOT NULL UNIQUE,
+    kind          TEXT NOT NULL,
+    book          TEXT NOT NULL,
+    payload       TEXT NOT NULL,
+    status        TEXT NOT NULL DEFAULT 'queued',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL DEFAULT 3,
+    lease_owner   TEXT,
+    lease_expires REAL,
+    heartbeat_at  REAL,
+    result        TEXT,
+    error         TEXT NOT NULL DEFAULT '',
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, kind, id);
+"""
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    book: str
+    payload: dict
+    attempts: int
+
+
+class JobQueue:
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, timeout: float = 30.0):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Autocommit mode: every transaction below is opened explicitly.
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self, sql_calls):
+        """Runs `sql_calls(db)` inside BEGIN IMMEDIATE and returns its result."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = sql_calls(self._db)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    @staticmethod
+    def _insert(db, kind: str, book: str, payload: dict, max_attempts: int, force: bool) -> int | None:
+        now = time.time()
+        key = f"{kind}:{book}"
+        data = json.dumps(payload, ensure_ascii=False, default=str)
+        if force:
+            # Resets a finished or failed title; a job another worker holds keeps running.
+            reset = db.execute("UPDATE jobs SET payload = ?, status = 'queued', attempts = 0, max_attempts = ?, "
+                               "result = NULL, error = '', updated_at = ? WHERE key = ? AND status != 'leased'",
+                               (data, max_attempts, now, key))
+            if reset.rowcount:
+                return db.execute("SELECT id FROM jobs WHERE key = ?", (key,)).fetchone()[0]
+        cursor = db.execute("INSERT OR IGNORE INTO jobs (key, kind, book, payload, max_attempts, created_at, "
+                            "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (key, kind, book, data, max_attempts, now, now))
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def submit(self, kind: str, book: str, payload: dict, max_attempts: int = MAX_ATTEMPTS,
+               force: bool = False) -> int | None:
+        """
+        Enqueues one job and returns its ID. Returns None if the title was already
+        submitted for `kind`, unless `force` resets that job (when no worker holds it).
+        """
+        return self._transaction(lambda db: self._insert(db, kind, str(book), payload, max_attempts, force))
+
+    def submit_many(self, jobs, max_attempts: int = MAX_ATTEMPTS, force: bool = False) -> int:
+        """Enqueues (kind, book, payload) triples in one transaction; returns how many were new."""
+        def insert(db):
+            return sum(self._insert(db, kind, str(book), payload, max_attempts, force) is not None
+                       for kind, book, payload in jobs)
+        return self._transaction(insert)
+
+    def claim(self, owner: str, kinds=None, lease: float = DEFAULT_LEASE) -> Job | None:
+        """
+        Leases the oldest runnable job of `kinds` (any kind when None) to
+        `owner`: a queued job, or a leased one whose lease has expired.
+        """
+        def take(db):
+            now = time.time()
+            db.execute("UPDATE jobs SET status = 'failed', lease_owner = NULL, updated_at = ?, "
+                       "error = 'lease expired after ' || attempts || ' attempt(s)' "
+                       "WHERE status = 'leased' AND lease_expires < ? AND attempts >= max_attempts", (now, now))
+            where, params = "(status = 'queued' OR (status = 'leased' AND lease_expires < ?))", [now]
+            if kinds:
+                where += f" AND kind IN ({', '.join('?' * len(kinds))})"
+                params += list(kinds)
+            row = db.execute(f"SELECT id, kind, book, payload, attempts FROM jobs WHERE {where} "
+                             "ORDER BY id LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                       "lease_expires = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                       (owner, now + lease, now, now, row[0]))
+            return Job(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1)
+        return self._transaction(take)
+
+    def heartbeat(self, job_id: int, owner: str, lease: float = DEFAULT_LEASE) -> bool:
+        """Extends the lease; False means `owner` no longer holds the job and should stop working on it."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET lease_expires = ?, heartbeat_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = 'leased'", (now + lease, now, job_id, owner))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: int, owner: str, result=None, follow_up=(),
+                 max_attempts: int = MAX_ATTEMPTS) -> bool:
+        """
+        Marks a job done and enqueues the (kind, book, payload) `follow_up`
+        jobs in the same transaction. Returns False, and changes nothing, if
+        the lease was lost in the meantime.
+        """
+        def finish(db):
+            now = time.time()
+            cursor = db.execute("UPDATE jobs SET status = 'done', result = ?, error = '', lease_owner = NULL, "
+                                "updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                                (json.dumps(result, ensure_ascii=False, default=str), now, job_id, owner))
+            if cursor.rowcount != 1:
+                return False
+            for kind, book, payload in follow_up:
+                self._insert(db, kind, str(book), payload, max_attempts, force=True)
+            return True
+        return self._transaction(finish)
+
+    def fail(self, job_id: int, owner: str, error: str) -> str | None:
+        """Records a failed attempt; returns the new status ("queued" or "failed"), or None if the lease was lost."""
+        def record(db):
+            row = db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND lease_owner = ? "
+                             "AND status = 'leased'", (job_id, owner)).fetchone()
+            if row is None:
+                return None
+            status = "queued" if row[0] < row[1] else "failed"
+            db.execute("UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated_at = ? WHERE id = ?",
+                       (status, str(error), time.time(), job_id))
+            return status
+        return self._transaction(record)
+
+    def release(self, job_id: int, owner: str) -> bool:
+        """Hands a job back to the queue without counting the attempt, e.g. when its worker shuts down."""
+        return self._transaction(lambda db: db.execute(
+            "UPDATE jobs SET status = 'queued', attempts = MAX(0, attempts - 1), lease_owner = NULL, "
+            "updated_at = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (time.time(), job_id, owner)).rowcount == 1)
+
+    def retry_failed(self, kinds=None) -> int:
+        """Puts every failed job (of `kinds`) back in the queue with a fresh attempt budget."""
+        where, params = "status = 'failed'", []
+        if kinds:
+            where += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params = list(kinds)
+        return self._transaction(lambda db: db.execute(
+            f"UPDATE jobs SET status = 'queued', attempts = 0, error = '', updated_at = ? WHERE {where}",
+            [time.time()] + params).rowcount)
+
+    def counts(self) -> dict[str, dict[str, int]]:
+        """kind -> status -> number of jobs."""
+        with self._lock:
+            rows = self._db.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status").fetchall()
+        counts = {}
+        for kind, status, count in rows:
+            counts.setdefault(kind, dict.fromkeys(STATUSES, 0))[status] = count
+        return counts
+
+    def pending(self, kinds=None) -> int:
+        """Jobs that are queued or leased, i.e. not finished one way or the other."""
+        return sum(by_status["queued"] + by_status["leased"]
+                   for kind, by_status in self.counts().items() if not kinds or kind in kinds)
+
+    def jobs(self, status: str, limit: int = 20) -> list[dict]:
+        """The most recently updated jobs with `status`, for status reports."""
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT id, kind, book, attempts, lease_owner, heartbeat_at, error, result, updated_at "
+                "FROM jobs WHERE status = ? ORDER BY updated_at DESC LIMIT ?", (status, limit))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
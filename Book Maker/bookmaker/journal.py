@@ -0,0 +1,61 @@
+"""
+Append-only journal of generated sections for one book.
+
+Each completed section is appended as a single JSON line and fsynced, so a
+crash loses at most the calls that were still in flight. A resumed run
+loads the journal and only generates sections it does not already contain.
+
+Streamed generations also append their chunks as `delta` records while they
+arrive (flushed, not fsynced). They show live progress on disk but never
+count as a finished section.
+"""
+import json
+import os
+import re
+
+
+def journal_path(directory: str, title: str) -> str:
+    safe = re.sub(r'[\\/:*?"<>|]', "_", str(title)).strip() or "untitled"
+    return os.path.join(directory, ".journal", f"{safe}.jsonl")
+
+
+class SectionJournal:
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not resume and os.path.exists(path):
+            os.remove(path)
+        self._file = None
+
+    def load(self) -> dict[str, str]:
+        """Returns key -> text for every complete line; a torn final line is ignored."""
+        sections = {}
+        if not os.path.exists(self.path):
+            return sections
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "text" in record:
+                    sections[record["key"]] = record["text"]
+        return sections
+
+    def append(self, key: str, text: str):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"key": key, "text": text}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append_delta(self, key: str, delta: str, attempt: int = 0):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"key": key, "attempt": attempt, "delta": delta}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,400 @@
+"""
+Shared chat-completion layer for all Book Maker scripts.
+
+`chat` and `achat` consult the on-disk response cache first, then call the
+OpenAI API through a request/token budget, an adaptive concurrency cap and
+a retry loop for transient errors. Anything that still fails is raised as
+`GenerationError`, so callers never mistake a failed call for empty text.
+The openai package is imported on first use, and a missing OPENAI_API_KEY
+only raises when a request actually needs the API.
+
+With streaming on (BOOKMAKER_STREAM=1 or stream=True) completions are
+consumed chunk by chunk: deltas are handed to `on_delta` as they arrive,
+time-to-first-token and tokens/sec are recorded per call, and a stream that
+goes quiet for BOOKMAKER_STALL_TIMEOUT seconds is abandoned and re-issued.
+
+Every call, cache hits included, is reported to `bookmaker.telemetry`, which
+writes a JSONL trace when BOOKMAKER_TRACE is set.
+
+With BOOKMAKER_HEDGE=1, non-streamed calls that outlive a latency deadline
+learned per call class get a duplicate request (see `bookmaker.hedge`).
+"""
+import asyncio
+import os
+import threading
+import time
+
+from bookmaker import telemetry
+from bookmaker.cache import ResponseCache
+from bookmaker.hedge import HedgePolicy
+from bookmaker.ratelimit import AdaptiveConcurrency, TokenBucket
+from bookmaker.retry import (MAX_RETRIES, RATE_LIMIT, RETRYABLE, TIMEOUT, GenerationError,
+                             backoff_delay, classify_error)
+
+DEFAULT_MODEL = "gpt-4o-mini"
+REQUESTS_PER_MINUTE = float(os.getenv("BOOKMAKER_RPM", "500"))
+TOKENS_PER_MINUTE = float(os.getenv("BOOKMAKER_TPM", "200000"))
+MAX_IN_FLIGHT = int(os.getenv("BOOKMAKER_MAX_IN_FLIGHT", "32"))
+REQUEST_TIMEOUT = float(os.getenv("BOOKMAKER_TIMEOUT", "120"))
+STREAM = os.getenv("BOOKMAKER_STREAM", "0").strip().lower() in ("1", "true", "yes", "on")
+STALL_TIMEOUT = float(os.getenv("BOOKMAKER_STALL_TIMEOUT", "30"))
+DEFAULT_COMPLETION_TOKENS = 1000
+
+cache = ResponseCache.from_env()
+request_bucket = TokenBucket(REQUESTS_PER_MINUTE)
+token_bucket = TokenBucket(TOKENS_PER_MINUTE)
+concurrency = AdaptiveConcurrency(MAX_IN_FLIGHT)
+hedging = HedgePolicy.from_env()
+
+stats = {"calls": 0, "retries": 0, "rate_limited": 0, "stalled": 0, "failures": 0,
+         "prompt_tokens": 0, "cached_tokens": 0, "hedges": 0}
+stream_stats = []  # one {"ttft", "duration", "tokens", "tokens_per_sec"} per finished stream
+_stats_lock = threading.Lock()
+_client = None
+_async_client = None
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        stats[name] += amount
+
+
+def _api_key() -> str:
+    key = os.getenv("OPENAI_API_KEY", "").strip()
+    if not key:
+        raise RuntimeError("OPENAI_API_KEY environment variable not set.")
+    return key
+
+
+def client():
+    global _client
+    if _client is None:
+        import openai
+        # Retries are handled here, not by the SDK, so they respect the shared budgets.
+        _client = openai.OpenAI(api_key=_api_key(), max_retries=0, timeout=REQUEST_TIMEOUT)
+    return _client
+
+
+def async_client():
+    global _async_client
+    if _async_client is None:
+        import openai
+        _async_client = openai.AsyncOpenAI(api_key=_api_key(), max_retries=0, timeout=REQUEST_TIMEOUT)
+    return _async_client
+
+
+def _request(model, messages, temperature, max_tokens, response_format=None) -> dict:
+    kwargs = {"model": model, "messages": messages}
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    return kwargs
+
+
+def estimate_tokens(messages: list, max_tokens: int | None = None) -> int:
+    """Rough prompt size (4 chars per token) plus the completion allowance."""
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_chars // 4 + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def _settle(usage, estimate: int):
+    if usage is None:
+        return
+    with _stats_lock:
+        stats["prompt_tokens"] += usage.prompt_tokens or 0
+        stats["cached_tokens"] += telemetry.cached_tokens(usage)
+    if usage.total_tokens:
+        unused = estimate - usage.total_tokens
+        if unused > 0:
+            token_bucket.refund(unused)
+
+
+class _StreamMeter:
+    """Accumulates one streamed completion and its timing."""
+
+    def __init__(self, on_delta, attempt: int):
+        self.on_delta = on_delta
+        self.attempt = attempt
+        self.started = time.monotonic()
+        self.first_token = None
+        self.parts = []
+        self.usage = None
+
+    def feed(self, chunk):
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        for choice in chunk.choices or []:
+            delta = getattr(choice.delta, "content", None)
+            if not delta:
+                continue
+            if self.first_token is None:
+                self.first_token = time.monotonic()
+            self.parts.append(delta)
+            if self.on_delta is not None:
+                self.on_delta(delta, self.attempt)
+
+    def finish(self) -> str:
+        text = "".join(self.parts)
+        now = time.monotonic()
+        ttft = (self.first_token or now) - self.started
+        tokens = self.usage.completion_tokens if self.usage is not None else max(1, len(text) // 4)
+        generating = now - (self.first_token or now)
+        with _stats_lock:
+            stream_stats.append({"ttft": ttft, "duration": now - self.started, "tokens": tokens,
+                                 "tokens_per_sec": tokens / generating if generating > 0 else 0.0})
+        return text.strip()
+
+
+def _stream_kwargs() -> dict:
+    import openai
+    # The read timeout bounds the gap between chunks, which is what detects a stall.
+    return {"stream": True, "stream_options": {"include_usage": True},
+            "timeout": openai.Timeout(REQUEST_TIMEOUT, read=STALL_TIMEOUT)}
+
+
+def _complete(request: dict, stream: bool, on_delta, attempt: int) -> tuple[str, object]:
+    if not stream:
+        response = client().chat.completions.create(**request)
+        return (response.choices[0].message.content or "").strip(), response.usage
+    meter = _StreamMeter(on_delta, attempt)
+    for chunk in client().chat.completions.create(**request, **_stream_kwargs()):
+        meter.feed(chunk)
+    return meter.finish(), meter.usage
+
+
+async def _acomplete(request: dict, stream: bool, on_delta, attempt: int) -> tuple[str, object]:
+    if not stream:
+        response = await async_client().chat.completions.create(**request)
+        return (response.choices[0].message.content or "").strip(), response.usage
+    meter = _StreamMeter(on_delta, attempt)
+    async for chunk in await async_client().chat.completions.create(**request, **_stream_kwargs()):
+        meter.feed(chunk)
+    return meter.finish(), meter.usage
+
+
+def _hedge_class(request: dict) -> tuple:
+    """Calls that should take about as long: same model, completion allowance and prompt kind."""
+    return request["model"], request.get("max_tokens"), telemetry.current("kind")
+
+
+def _reserve_hedge(estimate: int):
+    """Claims budgets for a hedge only if they are free right now; returns its release callback or None."""
+    if not request_bucket.try_reserve(1):
+        return None
+    if not token_bucket.try_reserve(estimate):
+        request_bucket.refund(1)
+        return None
+    if not concurrency.try_acquire():
+        request_bucket.refund(1)
+        token_bucket.refund(estimate)
+        return None
+    _count("calls")
+    _count("hedges")
+
+    def release(exc, used: bool):
+        throttled = exc is not None and classify_error(exc) == RATE_LIMIT
+        if throttled:
+            _count("rate_limited")
+        if not used:
+            token_bucket.refund(estimate)  # the winner's usage is settled against the primary's estimate
+        concurrency.release(throttled)
+    return release
+
+
+def _fail(exc: BaseException, kind: str, attempts: int) -> GenerationError:
+    _count("failures")
+    return GenerationError(f"{kind}: {exc}", kind=kind, attempts=attempts)
+
+
+def _call(request: dict, stream: bool = False, on_delta=None) -> tuple[str, object, int]:
+    client()  # a missing API key is a setup error, not a retryable call failure
+    estimate = estimate_tokens(request["messages"], request.get("max_tokens"))
+    for attempt in range(MAX_RETRIES + 1):
+        time.sleep(max(request_bucket.reserve(1), token_bucket.reserve(estimate)))
+        concurrency.acquire()
+        throttled = False
+        try:
+            _count("calls")
+            if hedging is not None and not stream:
+                text, usage = hedging.run(lambda: _complete(request, False, None, attempt), _hedge_class(request),
+                                          estimate, lambda: _reserve_hedge(estimate))
+            else:
+                text, usage = _complete(request, stream, on_delta, attempt)
+        except Exception as exc:
+            kind = classify_error(exc)
+            throttled = kind == RATE_LIMIT
+            if throttled:
+                _count("rate_limited")
+            elif stream and kind == TIMEOUT:
+                _count("stalled")
+            if kind not in RETRYABLE or attempt == MAX_RETRIES:
+                raise _fail(exc, kind, attempt + 1) from exc
+            delay = backoff_delay(attempt, exc)
+        else:
+            _settle(usage, estimate)
+            return text, usage, attempt + 1
+        finally:
+            concurrency.release(throttled)
+        _count("retries")
+        time.sleep(delay)
+
+
+async def _acall(request: dict, stream: bool = False, on_delta=None) -> tuple[str, object, int]:
+    async_client()
+    estimate = estimate_tokens(request["messages"], request.get("max_tokens"))
+    for attempt in range(MAX_RETRIES + 1):
+        await asyncio.sleep(max(request_bucket.reserve(1), token_bucket.reserve(estimate)))
+        await concurrency.acquire_async()
+        throttled = False
+        try:
+            _count("calls")
+            if hedging is not None and not stream:
+                text, usage = await hedging.arun(lambda: _acomplete(request, False, None, attempt),
+                                                 _hedge_class(request), estimate, lambda: _reserve_hedge(estimate))
+            else:
+                text, usage = await _acomplete(request, stream, on_delta, attempt)
+        except Exception as exc:
+            kind = classify_error(exc)
+            throttled = kind == RATE_LIMIT
+            if throttled:
+                _count("rate_limited")
+            elif stream and kind == TIMEOUT:
+                _count("stalled")
+            if kind not in RETRYABLE or attempt == MAX_RETRIES:
+                raise _fail(exc, kind, attempt + 1) from exc
+            delay = backoff_delay(attempt, exc)
+        else:
+            _settle(usage, estimate)
+            return text, usage, attempt + 1
+        finally:
+            concurrency.release(throttled)
+        _count("retries")
+        await asyncio.sleep(delay)
+
+
+def chat(messages: list, model: str = DEFAULT_MODEL, temperature: float | None = None,
+         max_tokens: int | None = None, stream: bool | None = None, on_delta=None,
+         response_format: dict | None = None) -> str:
+    """
+    Returns the stripped completion text for `messages`, served from cache when
+    possible. When streaming, `on_delta(text, attempt)` receives each chunk; a
+    higher `attempt` means an earlier partial stream was abandoned.
+    `response_format` is passed through for structured (JSON schema) output.
+    """
+    started = time.monotonic()
+    key = ResponseCache.key(model, messages, temperature, max_tokens, response_format) if cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            telemetry.record_call(model, started, cached=True)
+            if on_delta is not None:
+                on_delta(cached, 0)
+            return cached
+
+    stream = STREAM if stream is None else stream
+    try:
+        text, usage, attempts = _call(_request(model, messages, temperature, max_tokens, response_format), stream, on_delta)
+    except GenerationError as e:
+        telemetry.record_call(model, started, attempts=e.attempts, stream=stream, error=e.kind)
+        raise
+    telemetry.record_call(model, started, usage, attempts, stream=stream)
+    if cache:
+        cache.put(key, text)
+    return text
+
+
+async def achat(messages: list, model: str = DEFAULT_MODEL, temperature: float | None = None,
+                max_tokens: int | None = None, stream: bool | None = None, on_delta=None,
+                response_format: dict | None = None) -> str:
+    """Async twin of `chat` for the concurrent stage-2 engine."""
+    started = time.monotonic()
+    key = ResponseCache.key(model, messages, temperature, max_tokens, response_format) if cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            telemetry.record_call(model, started, cached=True)
+            if on_delta is not None:
+                on_delta(cached, 0)
+            return cached
+
+    stream = STREAM if stream is None else stream
+    try:
+        text, usage, attempts = await _acall(_request(model, messages, temperature, max_tokens, response_format), stream, on_delta)
+    except GenerationError as e:
+        telemetry.record_call(model, started, attempts=e.attempts, stream=stream, error=e.kind)
+        raise
+    telemetry.record_call(model, started, usage, attempts, stream=stream)
+    if cache:
+        cache.put(key, text)
+    return text
+
+
+def speech(text: str, model: str, voice: str, response_format: str = "pcm") -> bytes:
+    """
+    Returns the audio the speech endpoint renders for `text`. Speech calls
+    share the request budget, concurrency cap and retry policy of chat calls;
+    they are not cached here (see `bookmaker.audio` for the chunk cache).
+    """
+    client()
+    started = time.monotonic()
+    for attempt in range(MAX_RETRIES + 1):
+        time.sleep(request_bucket.reserve(1))
+        concurrency.acquire()
+        throttled = False
+        try:
+            _count("calls")
+            response = client().audio.speech.create(model=model, voice=voice, input=text,
+                                                    response_format=response_format)
+            audio = response.content
+        except Exception as exc:
+            kind = classify_error(exc)
+            throttled = kind == RATE_LIMIT
+            if throttled:
+                _count("rate_limited")
+            if kind not in RETRYABLE or attempt == MAX_RETRIES:
+                telemetry.record_call(model, started, attempts=attempt + 1, error=kind)
+                raise _fail(exc, kind, attempt + 1) from exc
+            delay = backoff_delay(attempt, exc)
+        else:
+            telemetry.record_call(model, started, attempts=attempt + 1, audio_bytes=len(audio))
+            return audio
+        finally:
+            concurrency.release(throttled)
+        _count("retries")
+        time.sleep(delay)
+
+
+def cache_summary() -> str:
+    if not cache:
+        return "🗄️ Response cache disabled"
+    cache_stats = cache.stats()
+    mode = "read-only" if cache.read_only else "read-write"
+    return (f"🗄️ Response cache ({mode}): {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['writes']} writes, {cache_stats['evictions']} evictions")
+
+
+def summary() -> str:
+    """End-of-run report covering the API calls and the response cache."""
+    with _stats_lock:
+        calls = dict(stats)
+        streams = list(stream_stats)
+    lines = [f"📡 OpenAI calls: {calls['calls']} sent, {calls['retries']} retried, "
+             f"{calls['rate_limited']} rate-limited, {calls['stalled']} stalled, {calls['failures']} failed "
+             f"(concurrency limit now {int(concurrency.limit)})"]
+    if streams:
+        ttfts = sorted(record["ttft"] for record in streams)
+        rates = [record["tokens_per_sec"] for record in streams if record["tokens_per_sec"] > 0]
+        lines.append(f"🌊 Streams: {len(streams)} finished, median TTFT {ttfts[len(ttfts) // 2]:.2f}s, "
+                     f"mean {sum(rates) / max(1, len(rates)):.1f} tokens/sec")
+    if calls["prompt_tokens"]:
+        lines.append(f"🧩 Prompt cache: {calls['cached_tokens']} of {calls['prompt_tokens']} input tokens cached "
+                     f"({calls['cached_tokens'] / calls['prompt_tokens']:.0%})")
+    if hedging is not None:
+        lines.append(hedging.summary())
+    lines.append(cache_summary())
+    if telemetry.enabled():
+        lines.append(telemetry.summary())
+    return "\n".join(lines)
@@ -0,0 +1,80 @@
+"""
+Input manifests for incremental regeneration.
+
+A section's input hash covers what decides its text: the request it is
+sent with (model, parameters, messages), its heading and the book-level
+part of its context.
+After a run, each book's manifest maps section keys to the hashes of the
+sections that were generated. The manifest sits next to the book's section
+journal, which holds the texts. An incremental run loads both. It keeps
+the journaled text of every section whose hash still matches and only
+sends the others. A book with no regenerated section is not reassembled
+if its document already exists.
+
+The shared book prefix (`Section.context`) is not hashed as a whole. It
+repeats the whole outline, and in kids fiction every chapter prompt, so
+hashing it would regenerate the entire book whenever a single prompt
+changed. The builders pass only its book-level part instead: the style
+rules, title, description or author, and profile fields. Editing any of
+those regenerates the whole book. Known gap: editing the outline (a
+chapter or subheading title, or another chapter's prompt) only
+regenerates the sections it belongs to. Run without --incremental to
+regenerate everything after restructuring a book.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from bookmaker.journal import journal_path
+
+
+def input_hash(request: dict, heading: str = "", book: str = "") -> str:
+    """
+    Hash of a section's request body (without the shared book context), its
+    heading and `book`, the book-level part of that context.
+    """
+    payload = json.dumps({"request": request, "heading": heading, "book": book},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def manifest_path(directory: str, title: str) -> str:
+    return os.path.splitext(journal_path(directory, title))[0] + ".manifest.json"
+
+
+def load_manifest(path: str) -> dict[str, str]:
+    """Section key -> input hash from the previous run; empty if there is none."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("sections", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_manifest(path: str, sections) -> dict[str, str]:
+    """Records the hash of every section that has text, replacing the file atomically; returns the hashes."""
+    hashes = {section.key: section.digest for section in sections if section.digest and section.text.strip()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"sections": hashes}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    return hashes
+
+
+def reuse_unchanged(sections, texts: dict[str, str], previous: dict[str, str]) -> int:
+    """
+    Fills in the journaled text of every section whose input hash matches
+    `previous` and clears the rest, marking them for regeneration. Returns
+    the number of sections reused.
+    """
+    reused = 0
+    for section in sections:
+        text = texts.get(section.key, "")
+        if text.strip() and section.digest and previous.get(section.key) == section.digest:
+            section.text = text
+            reused += 1
+        else:
+            section.text = ""
+    return reused
@@ -0,0 +1,160 @@
+"""
+Structured book plans for stage 1: one call, schema validation, targeted repair.
+
+A title's genre, audience, description and chapter/subheading outline come
+back from a single structured-output call constrained by `plan_schema`.
+The reply is then checked against what the sheet asked for: the exact
+chapter count and the exact number of subheadings per chapter. Problems
+that can be fixed locally are fixed without another call, such as extra
+chapters or subheadings and stray whitespace. Anything still missing is
+requested with a small follow-up turn that asks only for the missing part
+(blank profile fields, the remaining chapters, or the subheadings of
+specific chapters) and is merged into the plan. Only an unparseable reply
+triggers a full re-send.
+
+Callers pass `chat(messages, response_format, kind)`, so the script keeps
+control of the model and of how errors are reported.
+"""
+import json
+import re
+
+REPAIR_ATTEMPTS = 2
+PROFILE_FIELDS = ("genre", "audience", "description")
+
+
+def response_format(name: str, schema: dict) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def _object(properties: dict) -> dict:
+    return {"type": "object", "additionalProperties": False, "required": list(properties),
+            "properties": properties}
+
+
+def _strings() -> dict:
+    return {"type": "array", "items": {"type": "string"}}
+
+
+def chapters_schema() -> dict:
+    return {"type": "array", "items": _object({"title": {"type": "string"}, "subheadings": _strings()})}
+
+
+def plan_schema(with_profile: bool = True) -> dict:
+    """Schema of a full plan; without the profile it is just {"chapters": [...]}."""
+    properties = {field: {"type": "string"} for field in PROFILE_FIELDS} if with_profile else {}
+    properties["chapters"] = chapters_schema()
+    return _object(properties)
+
+
+def parse(reply: str):
+    """Parses a JSON reply, tolerating a ```json fence around it; returns None if it is not JSON."""
+    fenced = re.findall(r'```(?:json)?(.*?)```', reply or "", re.DOTALL)
+    try:
+        return json.loads(fenced[0] if fenced else reply)
+    except (TypeError, ValueError):
+        return None
+
+
+def _text(value) -> str:
+    return " ".join(value.split()) if isinstance(value, str) else ""
+
+
+def normalize(data: dict, chapters: int, subheadings: int, with_profile: bool = True) -> dict:
+    """Applies the local fixes: trims text, drops blank entries and cuts extra chapters and subheadings."""
+    plan = {field: _text(data.get(field)) for field in PROFILE_FIELDS} if with_profile else {}
+    plan["chapters"] = []
+    for chapter in data.get("chapters") or []:
+        if not isinstance(chapter, dict) or not _text(chapter.get("title")):
+            continue
+        subs = [_text(sub) for sub in chapter.get("subheadings") or [] if _text(sub)]
+        plan["chapters"].append({"title": _text(chapter["title"]), "subheadings": subs[:subheadings]})
+    plan["chapters"] = plan["chapters"][:chapters]
+    return plan
+
+
+def problems(plan: dict, chapters: int, subheadings: int, with_profile: bool = True) -> list[str]:
+    """Human-readable validation failures of a normalized plan; empty when it is complete."""
+    found = [f"'{field}' is empty" for field in PROFILE_FIELDS if with_profile and not plan.get(field)]
+    if len(plan["chapters"]) < chapters:
+        found.append(f"only {len(plan['chapters'])} of {chapters} chapters")
+    for number, chapter in enumerate(plan["chapters"], start=1):
+        if len(chapter["subheadings"]) < subheadings:
+            found.append(f"chapter {number} has {len(chapter['subheadings'])} of {subheadings} subheadings")
+    return found
+
+
+def _repair(plan: dict, chapters: int, subheadings: int, with_profile: bool) -> tuple[str, dict, str]:
+    """Picks the next targeted repair: (instruction, schema, what it fixes)."""
+    missing_fields = [field for field in PROFILE_FIELDS if with_profile and not plan.get(field)]
+    if missing_fields:
+        return (f"Your reply left {', '.join(missing_fields)} empty. Return only those fields.",
+                _object({field: {"type": "string"} for field in missing_fields}), "profile")
+    have = len(plan["chapters"])
+    if have < chapters:
+        titles = "; ".join(chapter["title"] for chapter in plan["chapters"])
+        return (f"Your outline has only {have} of the {chapters} chapters ({titles}). Create a list of "
+                f"{chapters - have} more chapter titles, chapters {have + 1} to {chapters}, with {subheadings} "
+                f"subheadings per chapter. Return only the new chapters.",
+                _object({"chapters": chapters_schema()}), "chapters")
+    short = [(number, chapter) for number, chapter in enumerate(plan["chapters"], start=1)
+             if len(chapter["subheadings"]) < subheadings]
+    listing = "; ".join(f"chapter {number} '{chapter['title']}' has {len(chapter['subheadings'])}"
+                        for number, chapter in short)
+    return (f"Every chapter needs exactly {subheadings} subheadings, but {listing}. Return only these "
+            f"chapters, by number, each with its complete list of {subheadings} subheadings.",
+            _object({"chapters": {"type": "array", "items": _object({"chapter": {"type": "integer"},
+                                                                      "subheadings": _strings()})}}),
+            "subheadings")
+
+
+def _merge(plan: dict, target: str, data: dict, chapters: int, subheadings: int):
+    if target == "profile":
+        for field, value in data.items():
+            if field in PROFILE_FIELDS and _text(value):
+                plan[field] = _text(value)
+    elif target == "chapters":
+        extra = normalize({"chapters": data.get("chapters")}, chapters, subheadings, with_profile=False)
+        plan["chapters"] = (plan["chapters"] + extra["chapters"])[:chapters]
+    else:
+        for fix in data.get("chapters") or []:
+            number = fix.get("chapter") if isinstance(fix, dict) else None
+            if isinstance(number, int) and 1 <= number <= len(plan["chapters"]):
+                subs = [_text(sub) for sub in fix.get("subheadings") or [] if _text(sub)]
+                if len(subs) > len(plan["chapters"][number - 1]["subheadings"]):
+                    plan["chapters"][number - 1]["subheadings"] = subs[:subheadings]
+
+
+def request_plan(chat, prompt: str, chapters: int, subheadings: int, with_profile: bool = True,
+                 repairs: int = REPAIR_ATTEMPTS) -> tuple[dict | None, list[str]]:
+    """
+    Asks for a plan with one structured call and repairs it with at most
+    `repairs` follow-up turns. Returns (plan, remaining problems). The plan is
+    None only if no parseable reply came back at all.
+    """
+    schema = response_format("book_plan" if with_profile else "book_outline", plan_schema(with_profile))
+    messages = [{"role": "user", "content": prompt}]
+    reply = chat(messages, schema, "plan" if with_profile else "outline")
+    data = parse(reply)
+    if not isinstance(data, dict) and repairs > 0:
+        # Nothing usable to repair in place: re-send once with the parse error.
+        retry = messages + [{"role": "assistant", "content": reply or ""},
+                            {"role": "user", "content": "That reply was not valid JSON. Return the complete "
+                                                        "answer again as JSON matching the schema."}]
+        reply = chat(retry, schema, "repair")
+        data = parse(reply)
+        repairs -= 1
+    if not isinstance(data, dict):
+        return None, ["reply was not valid JSON"]
+
+    plan = normalize(data, chapters, subheadings, with_profile)
+    messages.append({"role": "assistant", "content": json.dumps(plan, ensure_ascii=False)})
+    for _ in range(repairs):
+        if not problems(plan, chapters, subheadings, with_profile):
+            break
+        instruction, repair_schema, target = _repair(plan, chapters, subheadings, with_profile)
+        fix = parse(chat(messages + [{"role": "user", "content": instruction}],
+                         response_format(f"{target}_repair", repair_schema), "repair"))
+        if isinstance(fix, dict):
+            _merge(plan, target, fix, chapters, subheadings)
+        messages[-1]["content"] = json.dumps(plan, ensure_ascii=False)
+    return plan, problems(plan, chapters, subheadings, with_profile)
@@ -0,0 +1,57 @@
+"""
+Thread-based fan-out for the blocking stage-1 generators.
+
+The stage-1 scripts use the synchronous OpenAI client, so independent calls
+are overlapped on threads rather than an event loop. Results always come back
+in input order, which keeps the generated workbooks deterministic. Each call
+runs in a copy of the submitting thread's context, so telemetry tags set by
+the caller follow the work onto the pool threads.
+"""
+import contextvars
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = int(os.getenv("BOOKMAKER_STAGE1_WORKERS", "1"))
+
+
+def _in_context(fn):
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+
+def map_ordered(fn, items, workers: int = DEFAULT_WORKERS) -> list:
+    """Applies `fn` to every item on up to `workers` threads, preserving order."""
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        return list(pool.map(_in_context(fn), items))
+
+
+def imap_ordered(fn, items, workers: int = DEFAULT_WORKERS):
+    """
+    Streaming `map_ordered`: yields results in input order as soon as they are
+    ready, keeping at most `2 * workers` items submitted ahead of the consumer.
+    """
+    if workers <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(_in_context(fn), item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_concurrently(*calls) -> list:
+    """Runs zero-argument callables on their own threads and returns their results in order."""
+    if len(calls) <= 1:
+        return [call() for call in calls]
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        futures = [pool.submit(_in_context(call)) for call in calls]
+        return [future.result() for future in futures]
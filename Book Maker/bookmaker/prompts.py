@@ -0,0 +1,97 @@
+"""
+Shared-prefix prompt layout for the stage-2 builders.
+
+Every section of a book is sent as a system message holding the whole book
+context, followed by a short user message asking for one section. The
+system message is assembled in the same order every time: style rules
+first (identical across every book of a kind), then the book profile and
+its full outline (identical across every section of that book). This lets
+provider-side prompt caching reuse the prefix, which OpenAI does
+automatically for prompts longer than 1024 tokens. Cached input tokens are
+reported per call in the telemetry trace and summed in `llm.summary()`.
+
+Anything that changes from one section to the next, such as the section
+name, chapter number and word count, belongs in the user message. Putting
+it in the prefix would break caching for the rest of the book.
+"""
+
+NONFICTION_RULES = """\
+You are an experienced non-fiction author writing one section of a book at a time. Each request names
+the section to write; reply with that section's body text only.
+
+- Write flowing prose paragraphs. Do not add headings, titles, chapter numbers or section labels; the
+  book layout supplies them. Never repeat the chapter title or the section name as an opening line.
+- Use a warm, professional tone. Explain ideas clearly, then make them concrete with real-world
+  examples, short case stories and useful, actionable strategies the reader can apply.
+- Maintain continuity with the outline: build on earlier chapters, set up later ones, and avoid
+  restating material that another section of the outline is responsible for.
+- Respect the book profile: write for the stated target audience, keep to the tone, style, pacing,
+  language and readability level given, and stay within the requested word count.
+- Do not use Markdown formatting such as asterisks, hash marks or bullet syntax, and do not wrap the
+  answer in quotation marks.
+- Avoid filler phrases, generic motivational clichés and closing summaries such as "In conclusion".
+"""
+
+KIDS_NONFICTION_RULES = """\
+You are a children's non-fiction author writing one section of a book for kids aged 6-12 at a time.
+Each request names the section to write; reply with that section's body text only.
+
+- Use simple, age-appropriate words and short sentences. Explain every new idea with a fun example,
+  a comparison to everyday life, or a surprising fact.
+- Keep the tone fun, friendly and educational; make learning feel like an adventure or a discovery.
+  Invite the reader in with questions and small interactive moments ("Try this...", "Can you guess...").
+- Do not add headings, titles, chapter numbers or section labels, and never repeat the chapter title or
+  the section name as an opening line; the book layout supplies them.
+- Maintain continuity with the outline and avoid repeating what other sections cover.
+- Respect the book profile and the requested word count.
+- Do not use Markdown formatting such as asterisks, hash marks or bullet syntax.
+"""
+
+KIDS_FICTION_RULES = """\
+You are a helpful assistant who writes engaging children's stories. You are writing one part of a
+children's book at a time; each request names the part to write and gives its prompt.
+
+- Write for children aged 6-12: vivid but simple language, short paragraphs, lively dialogue and a
+  warm, positive tone. Keep content age-appropriate.
+- Keep characters, names, settings and events consistent with the chapter plan below, so the book
+  reads as one continuous story.
+- Do not add the chapter heading or a title line; the book layout supplies them.
+- Do not use Markdown formatting such as asterisks or hash marks.
+"""
+
+PROFILE_FIELDS = ("Genre", "Target_Audience", "Tone", "Style", "Pacing", "Language", "Readability")
+
+
+def nonfiction_context(title: str, profile: dict, outline: list, rules: str = NONFICTION_RULES) -> str:
+    """
+    Builds the shared system message for one non-fiction book. `profile` holds
+    the prompt-sheet columns (plus an optional "Book_Description"), and
+    `outline` is a list of (chapter title, [subheadings]) pairs.
+    """
+    lines = [rules.rstrip(), "", f'BOOK: "{title}"']
+    description = profile.get("Book_Description")
+    if isinstance(description, str) and description.strip():
+        lines.append(f"Description: {description.strip()}")
+    for field in PROFILE_FIELDS:
+        value = profile.get(field)
+        if value not in (None, ""):
+            lines.append(f"{field.replace('_', ' ')}: {value}")
+    lines += ["", "OUTLINE"]
+    for chapter_title, subheadings in outline:
+        lines.append(chapter_title)
+        lines.extend(f"  - {subheading}" for subheading in subheadings)
+    return "\n".join(lines)
+
+
+def kids_fiction_context(title: str, author: str, chapters: list, rules: str = KIDS_FICTION_RULES) -> str:
+    """
+    Builds the shared system message for one kids fiction book from its
+    (heading, chapter prompt) plan, which doubles as the story outline.
+    """
+    lines = [rules.rstrip(), "", f'BOOK: "{title}"']
+    if author:
+        lines.append(f"Author: {author}")
+    lines += ["", "CHAPTER PLAN"]
+    for heading, prompt in chapters:
+        lines.append(f"{heading}: {' '.join(str(prompt).split())}")
+    return "\n".join(lines)
@@ -0,0 +1,103 @@
+"""
+Client-side throttling for OpenAI calls.
+
+`TokenBucket` enforces a per-minute budget (requests or tokens) by handing
+out reservations: a caller debits the bucket immediately and sleeps for
+however long the deficit takes to refill. `AdaptiveConcurrency` caps calls
+in flight and adjusts the cap AIMD-style: it halves on 429s and creeps back
+up by one slot per window of successful calls.
+
+Both are thread-safe and usable from sync code (threads) and asyncio alike.
+"""
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: float | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute
+        self._level = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Debits `amount` and returns how many seconds to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._level -= amount
+            return 0.0 if self._level >= 0 else -self._level / self.rate
+
+    def try_reserve(self, amount: float = 1.0) -> bool:
+        """Debits `amount` only if it is available right now; never creates a wait."""
+        if self.rate <= 0:
+            return True
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._level < amount:
+                return False
+            self._level -= amount
+            return True
+
+    def refund(self, amount: float):
+        """Returns an over-estimated reservation to the bucket."""
+        with self._lock:
+            self._level = min(self.capacity, self._level + amount)
+
+
+class AdaptiveConcurrency:
+    def __init__(self, initial: int, minimum: int = 1, maximum: int | None = None,
+                 decrease_factor: float = 0.5, cooldown: float = 5.0):
+        self.maximum = maximum or initial
+        self.minimum = max(1, minimum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        """Takes a slot if one is free right now."""
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait(0.1)
+            self.in_flight += 1
+
+    async def acquire_async(self):
+        delay = 0.005
+        while not self.try_acquire():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # One multiplicative decrease per cooldown so a burst of 429s
+                # from the same overload doesn't collapse the limit to the floor.
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
@@ -0,0 +1,93 @@
+"""
+Error classification and retry backoff for OpenAI calls.
+
+Every exception raised by the client is mapped to an `ErrorKind`; only
+transient kinds are retried, with capped exponential backoff and full
+jitter (never shorter than a server-supplied Retry-After).
+"""
+import os
+import random
+
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER = "server"
+QUOTA = "quota"
+CLIENT = "client"
+UNKNOWN = "unknown"
+
+RETRYABLE = {RATE_LIMIT, TIMEOUT, CONNECTION, SERVER}
+
+MAX_RETRIES = int(os.getenv("BOOKMAKER_MAX_RETRIES", "6"))
+BASE_DELAY = float(os.getenv("BOOKMAKER_RETRY_BASE_DELAY", "1.0"))
+MAX_DELAY = float(os.getenv("BOOKMAKER_RETRY_MAX_DELAY", "60"))
+
+
+class GenerationError(Exception):
+    """Raised when a completion could not be produced, after any retries."""
+
+    def __init__(self, message: str, kind: str = UNKNOWN, attempts: int = 1):
+        super().__init__(message)
+        self.kind = kind
+        self.attempts = attempts
+
+
+def classify_error(exc: BaseException) -> str:
+    import openai  # deferred with the rest of the client stack
+
+    if isinstance(exc, openai.APITimeoutError):
+        return TIMEOUT
+    if isinstance(exc, openai.APIConnectionError):
+        return CONNECTION
+    if isinstance(exc, openai.RateLimitError):
+        # An exhausted quota also comes back as 429 but will not clear by waiting.
+        code = getattr(exc, "code", None) or ""
+        return QUOTA if code == "insufficient_quota" else RATE_LIMIT
+    if isinstance(exc, openai.APIStatusError):
+        status = exc.status_code
+        if status == 429:
+            return RATE_LIMIT
+        if status in (408, 409) or status >= 500:
+            return SERVER
+        return CLIENT
+    if isinstance(exc, TimeoutError):
+        return TIMEOUT
+    # Mid-stream transport failures surface as the HTTP library's own
+    # exceptions rather than openai ones; match them by class name.
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if any("Timeout" in name for name in names):
+        return TIMEOUT
+    if names & {"TransportError", "NetworkError", "RemoteProtocolError", "ConnectionError"}:
+        return CONNECTION
+    return UNKNOWN
+
+
+def retry_after(exc: BaseException) -> float | None:
+    """Seconds the server asked us to wait, if it said so."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def backoff_delay(attempt: int, exc: BaseException | None = None,
+                  base: float = BASE_DELAY, cap: float = MAX_DELAY) -> float:
+    """Full-jitter exponential backoff for the given 0-based retry attempt."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    hinted = retry_after(exc) if exc is not None else None
+    if hinted is not None:
+        delay = max(delay, min(hinted, cap))
+    return delay
@@ -0,0 +1,169 @@
+"""
+Output budgets, model routing and dispatch order for section calls.
+
+A section's target length is the word count its prompt asks for ("Write a
+500-word section ..."). Prompts that name none share what is left of
+their row's Word_Goal after the prompts that do. From the target the
+scheduler derives:
+
+    max_tokens  target words x TOKENS_PER_WORD x BUDGET_HEADROOM, clamped to
+                [MIN_TOKENS, MAX_TOKENS]. Only sent with budgets on
+                (BOOKMAKER_SCHEDULE=1 or --schedule), since it changes the
+                request and so the cache keys and incremental manifests.
+    model       BOOKMAKER_FAST_MODEL for sections of at most
+                BOOKMAKER_FAST_MAX_WORDS words, when budgets are on and a
+                fast model is configured; the builder's model otherwise
+    duration    CALL_OVERHEAD plus the expected completion tokens at the
+                model's tokens/sec
+
+Pending sections are dispatched longest expected duration first (LPT).
+With a cap of N calls in flight, starting the long introductions last
+would leave them running alone at the end of the batch. The nonfiction
+builder shares its cap between the books in flight as a PriorityGate
+(see bookmaker.engine), so the order holds across those books, not only
+within each. The kids builder makes one call at a time and keeps sheet
+order (lpt=False).
+
+Every finished call is recorded with its predicted and actual duration.
+`summary()` compares the makespan that list scheduling of the predicted
+durations gives, in LPT and in sheet order, with the measured one. The
+prediction treats all calls of the run as one pool of `slots`, so it is a
+lower bound when only a few books are in flight at a time.
+"""
+import contextlib
+import heapq
+import math
+import os
+import re
+import threading
+import time
+
+TOKENS_PER_WORD = 1.35
+BUDGET_HEADROOM = float(os.getenv("BOOKMAKER_BUDGET_HEADROOM", "1.5"))
+MIN_TOKENS = 256
+MAX_TOKENS = int(os.getenv("BOOKMAKER_MAX_TOKENS", "4000"))
+DEFAULT_WORDS = 600  # expected length of a section whose prompt and row give none
+SCHEDULE = os.getenv("BOOKMAKER_SCHEDULE", "0").strip().lower() in ("1", "true", "yes", "on")
+FAST_MODEL = os.getenv("BOOKMAKER_FAST_MODEL", "").strip()
+FAST_MAX_WORDS = int(os.getenv("BOOKMAKER_FAST_MAX_WORDS", "300"))
+TOKENS_PER_SEC = float(os.getenv("BOOKMAKER_TOKENS_PER_SEC", "60"))
+FAST_TOKENS_PER_SEC = float(os.getenv("BOOKMAKER_FAST_TOKENS_PER_SEC", "120"))
+CALL_OVERHEAD = float(os.getenv("BOOKMAKER_CALL_OVERHEAD", "1.0"))
+
+_WORD_COUNT = re.compile(r"\b(\d{1,3}(?:,\d{3})+|\d+)[\s-]*words?\b", re.IGNORECASE)
+
+
+def target_words(prompt) -> int:
+    """The word count a prompt asks for ("a 500-word section", "in 300 words"); 0 if it names none."""
+    match = _WORD_COUNT.search(prompt) if isinstance(prompt, str) else None
+    return int(match.group(1).replace(",", "")) if match else 0
+
+
+def share_goal(prompts, word_goal=None) -> list[int]:
+    """
+    Target words for each prompt of one sheet row. Prompts without a count
+    split the row's Word_Goal left after the stated counts (or the whole goal
+    evenly, if nothing is left); 0 where neither gives a length.
+    """
+    words = [target_words(prompt) for prompt in prompts]
+    unstated = words.count(0)
+    try:
+        goal = int(float(word_goal))
+    except (TypeError, ValueError):
+        goal = 0
+    if not unstated or goal <= 0:
+        return words
+    left = goal - sum(words)
+    share = left // unstated if left > 0 else goal // len(words)
+    return [count or share for count in words]
+
+
+def token_budget(words: int) -> int:
+    return max(MIN_TOKENS, min(MAX_TOKENS, math.ceil(words * TOKENS_PER_WORD * BUDGET_HEADROOM)))
+
+
+def makespan(durations, slots: int) -> float:
+    """Finish time of the last job when `durations` start in order on `slots` parallel workers."""
+    finish = [0.0] * max(1, int(slots))
+    for duration in durations:
+        heapq.heapreplace(finish, finish[0] + duration)
+    return max(finish)
+
+
+class Scheduler:
+    def __init__(self, model: str, budgets: bool = SCHEDULE, fast_model: str = FAST_MODEL,
+                 fast_max_words: int = FAST_MAX_WORDS, lpt: bool = True):
+        self.model = model
+        self.budgets = budgets
+        self.fast_model = fast_model
+        self.fast_max_words = fast_max_words
+        self.lpt = lpt
+        self.routed = 0
+        self._predicted = []  # predicted seconds of every dispatched call, in sheet order
+        self._actual = []  # (predicted, actual) seconds of every finished call
+        self._first = None
+        self._last = None
+        self._lock = threading.Lock()
+
+    def assign(self, section, words: int, default_tokens: int | None = None):
+        """
+        Records a section's target length and picks its model and max_tokens
+        (`default_tokens` when budgets are off or the length is unknown).
+        """
+        section.words = words
+        section.model = self.model
+        section.max_tokens = default_tokens
+        if self.budgets and words:
+            budget = token_budget(words)
+            section.max_tokens = budget if default_tokens is None else min(default_tokens, budget)
+            if self.fast_model and words <= self.fast_max_words:
+                section.model = self.fast_model
+                self.routed += 1
+
+    def predict(self, section) -> float:
+        """Expected seconds for one call of `section`."""
+        tokens = (section.words or DEFAULT_WORDS) * TOKENS_PER_WORD
+        if section.max_tokens:
+            tokens = min(tokens, section.max_tokens)
+        rate = FAST_TOKENS_PER_SEC if self.fast_model and section.model == self.fast_model else TOKENS_PER_SEC
+        return CALL_OVERHEAD + tokens / rate
+
+    def dispatch(self, sections) -> list:
+        """
+        The sections still without text, longest predicted call first (in
+        sheet order with LPT off; ties keep sheet order either way).
+        """
+        pending = [section for section in sections if not section.text]
+        with self._lock:
+            self._predicted.extend(self.predict(section) for section in pending)
+        return sorted(pending, key=self.predict, reverse=True) if self.lpt else pending
+
+    @contextlib.contextmanager
+    def timed(self, section):
+        """Records the duration of the call made inside the block, if it succeeds."""
+        started = time.monotonic()
+        yield
+        finished = time.monotonic()
+        with self._lock:
+            self._actual.append((self.predict(section), finished - started))
+            self._first = started if self._first is None else min(self._first, started)
+            self._last = finished if self._last is None else max(self._last, finished)
+
+    def summary(self, slots: int) -> str:
+        with self._lock:
+            predicted, runs = list(self._predicted), list(self._actual)
+            actual = (self._last - self._first) if runs else 0.0
+        if not predicted:
+            return "🗓️ Scheduler: no calls dispatched"
+        lpt = makespan(sorted(predicted, reverse=True), slots)
+        sheet = makespan(predicted, slots)
+        mode = "budgets on" if self.budgets else "budgets off"
+        if self.budgets and self.fast_model:
+            mode += f", {self.routed} section(s) of ≤{self.fast_max_words} words on {self.fast_model}"
+        line = (f"🗓️ Scheduler ({mode}, {'LPT' if self.lpt else 'sheet'} order, {slots} slot(s)): "
+                f"{len(predicted)} calls, predicted makespan {lpt:.1f}s LPT / {sheet:.1f}s sheet order, "
+                f"actual {actual:.1f}s")
+        if runs:
+            error = sum(run[1] - run[0] for run in runs) / len(runs)
+            line += f"; calls took {error:+.2f}s vs prediction on average"
+        return line
@@ -0,0 +1,32 @@
+"""
+Imports the stage scripts as modules.
+
+The stage scripts live at paths such as "2. nonfiction_prompts.py" that are
+not valid module names, so they are loaded by file path. Each script is only
+executed once per process; its `__main__` block does not run.
+"""
+import importlib.util
+import os
+import re
+import sys
+
+BOOK_MAKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(relative_path: str):
+    """Loads a script under the Book Maker directory and returns it as a module."""
+    path = os.path.join(BOOK_MAKER_DIR, relative_path)
+    name = "bookmaker_script_" + re.sub(r"\W+", "_", os.path.splitext(relative_path)[0]).strip("_")
+    if name in sys.modules:
+        return sys.modules[name]
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Stage script not found: {path}")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
@@ -0,0 +1,214 @@
+"""
+Append-only semantic memory of generated headings.
+
+Embeddings live in a single contiguous float32 `.npy` matrix (rows are
+L2-normalised) that is memory-mapped for queries, with a JSONL sidecar
+holding one ID per row. The `.npy` header is written at a fixed width, so
+appending rows only writes the new bytes and patches the shape in place;
+the header update is the commit point, and anything past it after a crash
+is ignored and overwritten by the next append.
+
+Similarity checks are a blocked matrix product over the stored rows, so a
+batch of candidates is compared against hundreds of thousands of headings
+without any per-pair Python loop.
+"""
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+HEADER_BYTES = 128  # fixed .npy header width (multiple of 64), leaves room for any row count
+MAGIC = b"\x93NUMPY\x01\x00"
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+
+class SemanticIndex:
+    def __init__(self, prefix: str, dim: int):
+        self.matrix_path = f"{prefix}.npy"
+        self.ids_path = f"{prefix}.ids.jsonl"
+        self.dim = dim
+        self.rows = self._read_rows()
+        self._ids = None
+        self._repair_ids()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _header(self, rows: int) -> bytes:
+        header = repr({"descr": "<f4", "fortran_order": False, "shape": (rows, self.dim)})
+        body_len = HEADER_BYTES - len(MAGIC) - 2
+        header = header.ljust(body_len - 1) + "\n"
+        return MAGIC + struct.pack("<H", body_len) + header.encode("latin1")
+
+    def _read_rows(self) -> int:
+        if not os.path.exists(self.matrix_path):
+            return 0
+        matrix = np.load(self.matrix_path, mmap_mode="r")
+        if matrix.ndim != 2 or matrix.shape[1] != self.dim:
+            raise ValueError(f"{self.matrix_path} holds shape {matrix.shape}, expected (*, {self.dim})")
+        return matrix.shape[0]
+
+    def matrix(self) -> np.ndarray:
+        if not self.rows:
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.load(self.matrix_path, mmap_mode="r")[: self.rows]
+
+    def ids(self) -> list[str]:
+        if self._ids is None:
+            self._ids = []
+            if os.path.exists(self.ids_path):
+                with open(self.ids_path, encoding="utf-8") as f:
+                    self._ids = [json.loads(line) for _, line in zip(range(self.rows), f)]
+        return self._ids
+
+    def _repair_ids(self):
+        # Drop sidecar lines left behind by an append that never committed.
+        if not os.path.exists(self.ids_path):
+            return
+        with open(self.ids_path, encoding="utf-8") as f:
+            lines = sum(1 for _ in f)
+        if lines > self.rows:
+            kept = list(self.ids())
+            with open(self.ids_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(i, ensure_ascii=False) + "\n" for i in kept)
+
+    def append(self, vectors: np.ndarray, ids: list[str]):
+        vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        if len(vectors) != len(ids):
+            raise ValueError("vectors and ids must have the same length")
+        if not len(vectors):
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.matrix_path)), exist_ok=True)
+        if not os.path.exists(self.matrix_path):
+            with open(self.matrix_path, "wb") as f:
+                f.write(self._header(0))
+
+        new_rows = self.rows + len(vectors)
+        with open(self.matrix_path, "r+b") as f:
+            f.seek(HEADER_BYTES + self.rows * self.dim * 4)
+            f.write(np.ascontiguousarray(vectors).tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+            with open(self.ids_path, "a", encoding="utf-8") as sidecar:
+                sidecar.writelines(json.dumps(i, ensure_ascii=False) + "\n" for i in ids)
+                sidecar.flush()
+                os.fsync(sidecar.fileno())
+
+            f.seek(0)
+            f.write(self._header(new_rows))
+            f.flush()
+            os.fsync(f.fileno())
+        self.rows = new_rows
+        if self._ids is not None:
+            self._ids.extend(ids)
+
+    def max_similarity(self, queries: np.ndarray, block_rows: int = 65536) -> tuple[np.ndarray, np.ndarray]:
+        """Best cosine similarity and matching row for each query (-1 rows when the index is empty)."""
+        queries = normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        best = np.full(len(queries), -1.0, dtype=np.float32)
+        where = np.full(len(queries), -1, dtype=np.int64)
+        matrix = self.matrix()
+        for start in range(0, len(matrix), block_rows):
+            block = np.asarray(matrix[start:start + block_rows])
+            sims = block @ queries.T  # (block, queries)
+            rows = sims.argmax(axis=0)
+            scores = sims[rows, np.arange(len(queries))]
+            better = scores > best
+            best[better] = scores[better]
+            where[better] = rows[better] + start
+        return best, where
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+class Embedder:
+    """Lazily loaded sentence-transformers model shared across threads."""
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            vectors = self._model.encode(list(texts), batch_size=64, convert_to_numpy=True,
+                                         normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+    @property
+    def dim(self) -> int:
+        return int(self.encode(["dimension probe"]).shape[1])
+
+
+class TitleMemory:
+    """
+    Heading memory for a stage-1 script, with one index for chapter titles
+    (`<prefix>.titles`) and one for subheadings (`<prefix>.subheadings`).
+    `check_and_add` rejects an outline whose titles or subheadings are
+    near-duplicates of stored ones of the same kind (or of each other) and
+    otherwise records them, atomically with respect to other threads.
+    """
+
+    KINDS = ("titles", "subheadings")
+
+    def __init__(self, prefix: str, threshold: float = 0.9, embedder: Embedder | None = None):
+        self.prefix = prefix
+        self.threshold = threshold
+        self.embedder = embedder or Embedder()
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index(self, kind: str = "titles") -> SemanticIndex:
+        if kind not in self._indexes:
+            self._indexes[kind] = SemanticIndex(f"{self.prefix}.{kind}", self.embedder.dim)
+        return self._indexes[kind]
+
+    def _duplicates(self, index: SemanticIndex, headings: list[str], vectors: np.ndarray) -> list:
+        # Headings within the same outline must not echo each other either.
+        within = vectors @ vectors.T
+        np.fill_diagonal(within, -1.0)
+        dupes = [(headings[i], headings[int(within[i].argmax())], float(within[i].max()))
+                 for i in np.flatnonzero(within.max(axis=1) >= self.threshold)]
+        scores, rows = index.max_similarity(vectors)
+        hits = np.flatnonzero(scores >= self.threshold)
+        if len(hits):
+            stored = index.ids()
+            dupes += [(headings[i], stored[rows[i]], float(scores[i])) for i in hits]
+        return dupes
+
+    def check_and_add(self, book: str, titles: list[str], force: bool = False,
+                      subheadings=()) -> list[tuple[str, str, float]]:
+        """
+        Returns [(candidate, existing, similarity)] for every near-duplicate
+        title or subheading. When there are none (or `force` is set) both
+        are appended.
+        """
+        groups = {kind: [str(h).strip() for h in headings if str(h).strip()]
+                  for kind, headings in zip(self.KINDS, (titles, subheadings))}
+        groups = {kind: headings for kind, headings in groups.items() if headings}
+        if not groups:
+            return []
+        # One encode call for the whole outline, split back per kind.
+        vectors = self.embedder.encode([h for headings in groups.values() for h in headings])
+        bounds = np.cumsum([0] + [len(headings) for headings in groups.values()])
+        encoded = {kind: vectors[bounds[i]:bounds[i + 1]] for i, kind in enumerate(groups)}
+
+        with self._lock:
+            dupes = []
+            for kind, headings in groups.items():
+                dupes += self._duplicates(self.index(kind), headings, encoded[kind])
+            if not dupes or force:
+                for kind, headings in groups.items():
+                    self.index(kind).append(encoded[kind], [f"{book} :: {h}" for h in headings])
+        return dupes
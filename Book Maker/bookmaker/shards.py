@@ -0,0 +1,209 @@
+"""
+Splitting one run across several machines that share a filesystem.
+
+Each node runs the same script on the same input and takes whole books,
+in one of two ways:
+    StaticShard  --shard i/N: a node takes every N-th book of the input,
+                 starting with the i-th, so the split is fixed and needs no
+                 coordination
+    ClaimDir     --claim-dir DIR: work stealing. A node claims each book just
+                 before starting it by creating DIR/<book>.claim with
+                 O_CREAT|O_EXCL, so fast nodes simply take more books. Once
+                 the node has saved its outputs, the claims of its finished
+                 books become <book>.done. A claim whose
+                 holder stopped refreshing it for --claim-timeout seconds is
+                 taken over. A book that failed is released, so another node
+                 or a rerun with the same DIR can take it.
+Nodes only write their own outputs. Files that used to be shared, such as
+the prompts workbook or Kids_Book_Author_List.xlsx, are written per node
+(see `part_path`), and `merge_parts` rebuilds the single workbook in input
+order once all nodes are done.
+"""
+import glob
+import hashlib
+import os
+import re
+import socket
+import threading
+import time
+
+from bookmaker.sheets import RowWriter, iter_rows
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parses "i/N" (1-based) for argparse."""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", value or "")
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"shard must look like i/N with 1 <= i <= N, got {value!r}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def _digest(book) -> str:
+    return hashlib.sha1(str(book).encode("utf-8")).hexdigest()
+
+
+class StaticShard:
+    def __init__(self, index: int, count: int):
+        self.index, self.count = index, count
+        self.label = f"shard-{index}-of-{count}"
+
+    def take(self, book, position: int) -> bool:
+        """`position` is the book's 0-based place in the input, which every node reads the same way."""
+        return position % self.count == self.index - 1
+
+    def finish(self, book):
+        pass
+
+    def release(self, book):
+        pass
+
+    def close(self):
+        pass
+
+
+class ClaimDir:
+    def __init__(self, directory: str, node: str | None = None, stale_after: float | None = None):
+        self.directory = directory
+        self.node = node or f"{socket.gethostname()}-{os.getpid()}"
+        self.label = re.sub(r"[^\w.-]", "_", self.node)
+        self.stale_after = stale_after
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        if stale_after:
+            threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _path(self, book, suffix: str) -> str:
+        safe = re.sub(r'[\\/:*?"<>|\s]+', "_", str(book)).strip("_")[:80] or "untitled"
+        return os.path.join(self.directory, f"{safe}-{_digest(book)[:10]}{suffix}")
+
+    def _create(self, path: str) -> bool:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{self.node} {time.time():.0f}\n")
+        return True
+
+    def take(self, book, position: int = 0) -> bool:
+        """Claims `book` for this node; False if it is done or another node holds a live claim."""
+        claim = self._path(book, ".claim")
+        if os.path.exists(self._path(book, ".done")):
+            return False
+        if not self._create(claim):
+            if not self._stale(claim):
+                return False
+            # Exactly one node wins the rename of a stale claim; the others see it vanish.
+            try:
+                os.rename(claim, f"{claim}.stale-{self.label}")
+            except OSError:
+                return False
+            print(f"🪝 Taking over stale claim on '{book}'")
+            if not self._create(claim):
+                return False
+        if os.path.exists(self._path(book, ".done")):
+            # Another node finished it between our check and our claim.
+            os.remove(claim)
+            return False
+        with self._lock:
+            self._held.add(claim)
+        return True
+
+    def _stale(self, claim: str) -> bool:
+        try:
+            return bool(self.stale_after) and time.time() - os.stat(claim).st_mtime > self.stale_after
+        except FileNotFoundError:
+            return False
+
+    def finish(self, book):
+        """Marks a claimed book done, so no node takes it again."""
+        claim = self._path(book, ".claim")
+        with self._lock:
+            self._held.discard(claim)
+        try:
+            os.replace(claim, self._path(book, ".done"))
+        except FileNotFoundError:
+            self._create(self._path(book, ".done"))
+
+    def release(self, book):
+        """Gives up a claim without finishing the book, so another node (or a rerun) can take it."""
+        claim = self._path(book, ".claim")
+        with self._lock:
+            self._held.discard(claim)
+        try:
+            os.remove(claim)
+        except FileNotFoundError:
+            pass
+
+    def _refresh(self):
+        # Touches held claims well within `stale_after`, so live work is never taken over.
+        while not self._stop.wait(self.stale_after / 3):
+            with self._lock:
+                held = list(self._held)
+            for claim in held:
+                try:
+                    os.utime(claim)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        self._stop.set()
+
+
+def add_shard_args(parser):
+    """Adds the --shard / --claim-dir options shared by the batch scripts."""
+    group = parser.add_argument_group("sharding across nodes")
+    group.add_argument("--shard", type=parse_shard, metavar="i/N",
+                       help="Only process every N-th book of the input, starting with the i-th.")
+    group.add_argument("--claim-dir", help="Shared directory for work stealing: each node claims books as it goes.")
+    group.add_argument("--node", help="This node's name in claim files and per-node outputs (default: host-pid).")
+    group.add_argument("--claim-timeout", type=float, default=None,
+                       help="Seconds after which an unrefreshed claim is taken over (default: never).")
+    group.add_argument("--merge", action="store_true",
+                       help="Merge the per-node outputs of a sharded run instead of generating.")
+
+
+def from_args(args):
+    """The StaticShard or ClaimDir selected on the command line, or None for an unsharded run."""
+    if args.shard and args.claim_dir:
+        raise SystemExit("Use either --shard or --claim-dir, not both.")
+    if args.shard:
+        return StaticShard(*args.shard)
+    if args.claim_dir:
+        return ClaimDir(args.claim_dir, args.node, args.claim_timeout)
+    return None
+
+
+def part_path(path: str, label: str) -> str:
+    """Per-node name of a shared output: Book.xlsx -> Book.<label>.xlsx."""
+    base, ext = os.path.splitext(path)
+    return f"{base}.{label}{ext}"
+
+
+def merge_parts(path: str, columns: list[str], key: str, order=(), sidecars=()) -> int:
+    """
+    Rebuilds `path` from every `part_path(path, *)` file. Rows stay grouped
+    per `key` (a book title), and groups follow `order`, the titles in input
+    order; titles missing from `order` go last. A title found in several parts
+    (its stale claim was taken over after the first node wrote it) keeps the
+    rows of the first part only. Returns the number of books.
+    """
+    base, ext = os.path.splitext(path)
+    parts = sorted(glob.glob(f"{glob.escape(base)}.*{ext}"))
+    groups = {}
+    for part in parts:
+        found = {}
+        for row in iter_rows(part):
+            found.setdefault(row.get(key), []).append(row)
+        for title, rows in found.items():
+            groups.setdefault(title, rows)
+    rank = {title: i for i, title in enumerate(order)}
+    titles = sorted(groups, key=lambda title: rank.get(title, len(rank)))
+    with RowWriter(path, columns, sidecars) as writer:
+        for title in titles:
+            for row in groups[title]:
+                writer.append(row)
+    print(f"🧩 Merged {len(titles)} book(s) from {len(parts)} part file(s) into {path}")
+    return len(titles)
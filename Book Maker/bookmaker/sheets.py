@@ -0,0 +1,183 @@
+"""
+Streaming spreadsheet I/O for input and prompt workbooks.
+
+`iter_rows` yields one dict per data row without materialising the sheet
+(openpyxl read-only mode for .xlsx, csv/pyarrow for sidecar formats).
+`RowWriter` appends rows to a write-only workbook as they are produced and
+can mirror them to CSV (flushed per row, so a crash keeps everything written
+so far) and Parquet (pyarrow, written in row groups) sidecars.
+"""
+import csv
+import os
+
+PARQUET_ROW_GROUP = 1000
+
+
+def iter_rows(path: str, sheet: str | None = None):
+    """Yields {header: value} per row; blank cells are None and blank rows are skipped."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                values = {k: (v if v != "" else None) for k, v in row.items()}
+                if any(v is not None for v in values.values()):
+                    yield values
+        return
+    if ext == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.worksheets[0]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        for values in rows:
+            if values is None or all(v is None or (isinstance(v, str) and not v.strip()) for v in values):
+                continue
+            yield dict(zip(columns, values))
+    finally:
+        workbook.close()
+
+
+def iter_groups(rows, key: str, ends: dict | None = None):
+    """
+    Groups rows sharing `row[key]`, yielding (value, [rows]) in order of first
+    appearance. Without `ends` only one group is held at a time, so rows for a
+    value must be contiguous; a value that reappears after its group closed
+    raises ValueError. With `ends` (see group_ends, over the same rows), a
+    value's rows are merged wherever they are, like pandas'
+    groupby(sort=False), and a group is held only until its last row.
+    """
+    if ends is not None:
+        yield from _merged_groups(rows, key, ends)
+        return
+    seen = set()
+    current, group = None, []
+    for row in rows:
+        value = row.get(key)
+        if value is None:
+            continue
+        if group and value != current:
+            yield current, group
+            group = []
+        if not group:
+            if value in seen:
+                raise ValueError(f"Rows for {key}={value!r} are not contiguous; sort the sheet by '{key}'.")
+            seen.add(value)
+            current = value
+        group.append(row)
+    if group:
+        yield current, group
+
+
+def group_ends(rows, key: str) -> dict:
+    """Index of the last row of each `row[key]` value, counting every row."""
+    return {row.get(key): index for index, row in enumerate(rows) if row.get(key) is not None}
+
+
+def _merged_groups(rows, key: str, ends: dict):
+    open_groups = {}  # value -> rows, in order of first appearance
+    done = set()
+    for index, row in enumerate(rows):
+        value = row.get(key)
+        if value is None:
+            continue
+        open_groups.setdefault(value, []).append(row)
+        if index >= ends.get(value, index):
+            done.add(value)
+        # An earlier title still waiting for rows holds back the ones after it, to keep first-appearance order.
+        while open_groups and next(iter(open_groups)) in done:
+            first = next(iter(open_groups))
+            yield first, open_groups.pop(first)
+    yield from open_groups.items()
+
+
+def iter_sheet_groups(path: str, key: str, sheet: str | None = None):
+    """
+    iter_groups over a sheet file that tolerates non-contiguous rows: a first
+    pass records where each value's last row is, the second groups the rows.
+    """
+    return iter_groups(iter_rows(path, sheet), key, group_ends(iter_rows(path, sheet), key))
+
+
+class RowWriter:
+    """
+    Appends dict rows with a fixed column list to `path` (.xlsx) and optional
+    sidecars next to it (`sidecars` may contain "csv" and/or "parquet").
+    Keys outside `columns` are ignored.
+    """
+
+    def __init__(self, path: str, columns: list[str], sidecars=(), sheet_title: str = "Sheet1"):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.columns = list(columns)
+        self.rows_written = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet(sheet_title)
+        self._sheet.append(self.columns)
+
+        base = os.path.splitext(path)[0]
+        self._csv_file = self._csv = None
+        if "csv" in sidecars:
+            self._csv_file = open(f"{base}.csv", "w", newline="", encoding="utf-8")
+            self._csv = csv.writer(self._csv_file)
+            self._csv.writerow(self.columns)
+            self._csv_file.flush()
+
+        self._parquet = None
+        self._parquet_buffer = []
+        if "parquet" in sidecars:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise RuntimeError("The parquet sidecar needs pyarrow (pip install pyarrow).") from e
+            # Every column is stored as string so row groups always share one schema.
+            self._schema = pa.schema([(c, pa.string()) for c in self.columns])
+            self._parquet = pq.ParquetWriter(f"{base}.parquet", self._schema)
+
+    def append(self, row: dict):
+        values = [row.get(c) for c in self.columns]
+        self._sheet.append(values)
+        if self._csv is not None:
+            self._csv.writerow(["" if v is None else v for v in values])
+            self._csv_file.flush()
+        if self._parquet is not None:
+            self._parquet_buffer.append({c: None if v is None else str(v) for c, v in zip(self.columns, values)})
+            if len(self._parquet_buffer) >= PARQUET_ROW_GROUP:
+                self._flush_parquet()
+        self.rows_written += 1
+
+    def _flush_parquet(self):
+        import pyarrow as pa
+        if self._parquet_buffer:
+            self._parquet.write_table(pa.Table.from_pylist(self._parquet_buffer, schema=self._schema))
+            self._parquet_buffer = []
+
+    def close(self):
+        if self._parquet is not None:
+            self._flush_parquet()
+            self._parquet.close()
+            self._parquet = None
+        if self._csv_file is not None:
+            self._csv_file.close()
+            self._csv_file = self._csv = None
+        if self._workbook is not None:
+            self._workbook.save(self.path)
+            self._workbook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
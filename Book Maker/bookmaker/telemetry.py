@@ -0,0 +1,165 @@
+"""
+Per-call telemetry for the OpenAI layer.
+
+Set BOOKMAKER_TRACE to a file path and every `llm.chat`/`llm.achat` call is
+appended to it as one JSON line: wall time (including rate-limit waits and
+retries), prompt/completion tokens from `response.usage` (and how many prompt
+tokens the provider's prompt cache served), model, retry count, whether the
+response cache answered, and the book/chapter/section it was made for.
+`llm.speech` calls are traced too, with the size of the audio in `bytes`.
+Scripts describe what they are generating with `context(...)`, which is
+carried through threads and asyncio tasks by a context variable, so the
+layers in between never pass it along explicitly.
+
+`summary()` turns the records of this run into p50/p95 latency per prompt
+kind, completion tokens/sec and an estimated cost per book. Prices are USD
+per million tokens and can be overridden with BOOKMAKER_PRICES, a JSON object
+of {"model": [input, output]}; cached input tokens are billed at
+CACHED_INPUT_DISCOUNT of the input price.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+TRACE_PATH = os.getenv("BOOKMAKER_TRACE", "").strip()
+
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1": (2.00, 8.00),
+}
+CACHED_INPUT_DISCOUNT = 0.5
+PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv("BOOKMAKER_PRICES", "{}")).items()})
+
+_context = contextvars.ContextVar("bookmaker_telemetry_context", default={})
+_calls = []  # (kind, book, latency, prompt_tokens, completion_tokens, cached_tokens, cost) per successful call
+_traced = 0
+_lock = threading.Lock()
+_file = None
+
+
+def enabled() -> bool:
+    return bool(TRACE_PATH)
+
+
+@contextlib.contextmanager
+def context(**fields):
+    """Tags every call made inside the block (and tasks it starts) with `fields`."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current(field: str, default=None):
+    """A field of the active `context(...)`, e.g. the prompt kind of the call being made."""
+    return _context.get().get(field, default)
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """Estimated USD cost of one call; unknown models cost 0."""
+    prices = PRICES.get(model)
+    if prices is None:
+        # Dated snapshots ("gpt-4o-mini-2024-07-18") are priced like their base model.
+        base = max((name for name in PRICES if model.startswith(name)), key=len, default=None)
+        prices = PRICES.get(base, (0.0, 0.0))
+    prompt_cost = (prompt_tokens - cached_tokens + cached_tokens * CACHED_INPUT_DISCOUNT) * prices[0]
+    return (prompt_cost + completion_tokens * prices[1]) / 1_000_000
+
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens the provider served from its prompt cache, 0 when not reported."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+
+def record_call(model: str, started: float, usage=None, attempts: int = 1, cached: bool = False,
+                stream: bool = False, error: str = "", audio_bytes: int = 0):
+    """Writes one trace record for a call that began at `started` (time.monotonic())."""
+    if not enabled():
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cached_prompt = cached_tokens(usage)
+    record = {
+        "ts": time.time(),
+        "model": model,
+        **_context.get(),
+        "latency": round(time.monotonic() - started, 4),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_prompt,
+        "retries": max(0, attempts - 1),
+        "cached": cached,
+        "stream": stream,
+        "cost": cost(model, prompt_tokens, completion_tokens, cached_prompt),
+        "bytes": audio_bytes,
+        "error": error,
+    }
+    _write(record)
+
+
+def _write(record: dict):
+    global _file, _traced
+    line = json.dumps(record, ensure_ascii=False)
+    with _lock:
+        if _file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(TRACE_PATH)), exist_ok=True)
+            _file = open(TRACE_PATH, "a", encoding="utf-8", buffering=1)
+        _file.write(line + "\n")
+        _traced += 1
+        if not record["cached"] and not record["error"]:
+            _calls.append((record.get("kind") or "-", record.get("book") or "-", record["latency"],
+                           record["prompt_tokens"], record["completion_tokens"], record["cached_tokens"],
+                           record["cost"]))
+
+
+def _percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary(top_books: int = 10) -> str:
+    """Latency, throughput and cost report for the calls traced in this run."""
+    if not enabled():
+        return ""
+    with _lock:
+        calls, traced = list(_calls), _traced
+    if not calls:
+        return f"📈 Trace: {traced} call(s) recorded in {TRACE_PATH}"
+
+    latencies = [call[2] for call in calls]
+    prompt_tokens = sum(call[3] for call in calls)
+    completion_tokens = sum(call[4] for call in calls)
+    cached = sum(call[5] for call in calls)
+    lines = [f"📈 Trace ({TRACE_PATH}): {traced} calls, p50 {_percentile(latencies, 0.5):.2f}s, "
+             f"p95 {_percentile(latencies, 0.95):.2f}s, "
+             f"{completion_tokens / max(sum(latencies), 1e-9):.1f} completion tokens/sec per call, "
+             f"{cached / max(prompt_tokens, 1):.0%} of input tokens from the prompt cache"]
+
+    by_kind = defaultdict(list)
+    for call in calls:
+        by_kind[call[0]].append(call)
+    for kind, group in sorted(by_kind.items(), key=lambda item: -sum(call[2] for call in item[1])):
+        kind_latencies = [call[2] for call in group]
+        lines.append(f"   {kind:<16} {len(group):>6} calls  p50 {_percentile(kind_latencies, 0.5):6.2f}s  "
+                     f"p95 {_percentile(kind_latencies, 0.95):6.2f}s  "
+                     f"{sum(call[3] + call[4] for call in group):>9} tokens  "
+                     f"{sum(call[5] for call in group):>9} cached  ${sum(call[6] for call in group):.4f}")
+
+    by_book = defaultdict(float)
+    for call in calls:
+        by_book[call[1]] += call[6]
+    total = sum(by_book.values())
+    lines.append(f"💰 Estimated cost ${total:.4f} for {len(by_book)} book(s), "
+                 f"${total / len(by_book):.4f} per book on average")
+    for book, book_cost in sorted(by_book.items(), key=lambda item: -item[1])[:top_books]:
+        lines.append(f"   ${book_cost:.4f}  {book}")
+    return "\n".join(lines)
@@ -1,22 +1,37 @@
-import openai
 import pandas as pd
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 import os
-import re
-
-# Set your OpenAI API key from environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY", "").strip()
-if not openai.api_key:
-    raise RuntimeError("OPENAI_API_KEY environment variable not set.")
+import sys
+import argparse
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bookmaker import llm, telemetry
+from bookmaker.batch import custom_id, make_backend, run_batch
+from bookmaker.cleanup import clean_heading
+from bookmaker.documents import (DEFAULT_DOCX_WORKERS, EXPORT_BACKEND, EXPORT_BACKENDS, EXTRA_FORMATS, DocumentPool,
+                                 save_kids_fiction_book)
+from bookmaker.engine import Section
+from bookmaker.journal import SectionJournal, journal_path
+from bookmaker.manifest import input_hash, load_manifest, manifest_path, reuse_unchanged, save_manifest
+from bookmaker.prompts import kids_fiction_context
+from bookmaker.retry import GenerationError
+from bookmaker.schedule import FAST_MODEL, SCHEDULE, Scheduler, share_goal
+from bookmaker.shards import add_shard_args, from_args, merge_parts, part_path
+from bookmaker.sheets import group_ends, iter_groups, iter_sheet_groups
 
 # Input and Output Paths
 INPUT_PATH = "/Users/kuldeepsharma/Desktop/projectcode/Excel/kids_fiction_output.xlsx"
 OUTPUT_DIR = "/Users/kuldeepsharma/Desktop/projectcode/Kids Fiction Books"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+MODEL = "gpt-4o-mini"
+MAX_TOKENS = 4000  # Reduced for children's content
+
+# Section calls skipped and books kept by an --incremental run
+incremental_stats = {"skipped": 0, "sections": 0, "kept": 0}
+
+# Output budgets and model routing of the chapter calls; books are written one call at a time
+scheduler = Scheduler(MODEL, lpt=False)
 
 def add_hyperlink(paragraph, url, text):
     """
@@ -58,91 +73,55 @@ def add_hyperlink(paragraph, url, text):
     paragraph._p.append(hyperlink)
     return hyperlink
 
-def clean(text):
+def request_body(prompt, context="", model=MODEL, max_tokens=MAX_TOKENS):
     """
-    Basic cleanup to remove stray characters from text.
+    Chat completion parameters for one kids fiction prompt, shared by the
+    interactive and batch paths so both hit the same cache entries.
+    `context` is the book's shared system prefix (see plan_book); `model` and
+    `max_tokens` come from the scheduler.
     """
-    return re.sub(r'[\*#"]', '', str(text))
-
-def generate_text(prompt):
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": context or "You are a helpful assistant who writes engaging children's stories."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0.7
+    }
+
+def section_body(section, context=""):
+    return request_body(section.prompt, context, section.model or MODEL, section.max_tokens or MAX_TOKENS)
+
+def generate_text(prompt, context="", model=MODEL, max_tokens=MAX_TOKENS):
     """
     Uses the OpenAI ChatCompletion endpoint to generate text from a prompt.
     Adapted for children's content with appropriate token limits.
     """
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",  # same engine as earlier
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant who writes engaging children's stories."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=4000,  # Reduced for children's content
-            temperature=0.7
-        )
-        return response.choices[0].message['content'].strip()
-    except Exception as e:
-        print(f"Error generating text: {e}")
-        return "[Error generating content]"
-
-def create_docx(book_title, chapters):
+        return llm.chat(**request_body(prompt, context, model, max_tokens))
+    except GenerationError as e:
+        # Propagate so a failed chapter never gets written into the book.
+        print(f"Error generating text ({e.kind}, {e.attempts} attempt(s)): {e}")
+        raise
+
+def plan_book(book_title, chapters):
     """
-    Creates a DOCX file for a given kids book_title and its associated chapters DataFrame.
-    Adapted for children's books with age-appropriate formatting and content.
+    Lists the sections (prologue, chapters, epilogue) to generate for one book, in order.
+    All sections share one system prefix holding the style rules and the whole chapter plan,
+    so the provider can cache it across the book's calls. Target lengths come from each
+    prompt's word count, or the row's Word_Goal if the sheet has one.
     """
-    print(f"Creating kids DOCX for '{book_title}'")
-    doc = Document()
-
-    # Set the base style for Normal text - larger font for children
-    style = doc.styles['Normal']
-    style.font.name = 'Calibri'
-    style.font.size = Pt(12)  # Larger font for children
-
-    # Attempt to read the author's name from the first row
-    author_name = ""
-    if len(chapters) > 0:
-        author_name = str(chapters.iloc[0].get("Author Name", "")).strip()
-
-    # Book Title (level=0, centered) - larger font for children
-    title_heading = doc.add_heading(book_title, 0)
-    title_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    title_heading.runs[0].font.size = Pt(24)  # Larger title font
-
-    # "By <Author Name>" in 14pt, centered
-    publishing_para = doc.add_paragraph()
-    publishing_run = publishing_para.add_run(f"By {author_name}")
-    publishing_run.font.size = Pt(14)
-    publishing_run.font.name = "Calibri"
-    publishing_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    # Page break before Copyright
-    doc.add_page_break()
-
-    # 1) Copyright Page - child-friendly version
-    doc.add_heading('Copyright', level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
-    doc.add_paragraph(
-        "Copyright © 2025 AI Book Generator\n"
-        "This is a work of fiction for children. Names, characters, places, and incidents either "
-        "are the product of the author's imagination or are used fictitiously.\n"
-        "Any resemblance to actual events, locales, or persons, living or dead, is "
-        "entirely coincidental.\n"
-        "All rights reserved.\n"
-        "For permissions, contact support@yourplatform.com\n\n"
-        "Recommended for ages 6-12"
-    ).alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    doc.add_page_break()
-
-    # 2) Prologue (if any text is in the 'Prologue' column of the first row)
+    sections = []
+
+    # Prologue (if any text is in the 'Prologue' column of the first row)
     prologue_prompt = chapters.iloc[0]['Prologue'] if isinstance(chapters.iloc[0].get('Prologue', ''), str) else ""
     if prologue_prompt.strip():
-        prologue_text = generate_text(prologue_prompt)
-        # Remove heading instruction; start directly with the text
-        doc.add_heading("Prologue", level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
-        doc.add_paragraph(prologue_text)
-        doc.add_page_break()
-
-    # 3) Chapters & Epilogue
-    for idx, row in chapters.iterrows():
+        sections.append(Section(book_title, "prologue", "prologue", "Prologue", 1, prologue_prompt))
+        scheduler.assign(sections[-1], share_goal([prologue_prompt], chapters.iloc[0].get('Word_Goal'))[0],
+                         MAX_TOKENS)
+
+    for number, (idx, row) in enumerate(chapters.iterrows(), start=1):
         chap_title = str(row.get('Chapter', '')).strip()
         chap_prompt = row.get('Chapter Prompt', '')
 
@@ -150,63 +129,270 @@ def create_docx(book_title, chapters):
         if not chap_title or not chap_prompt:
             continue
 
-        # If it's an epilogue, handle final piece
         if chap_title.lower().startswith("epilogue"):
-            epilogue_text = generate_text(chap_prompt)
-            doc.add_heading("Epilogue", level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
-            doc.add_paragraph(epilogue_text)
-            doc.add_page_break()
+            sections.append(Section(book_title, f"ch{number:02d}", "epilogue", "Epilogue", 1, chap_prompt))
         else:
-            # Normal chapter: generate chapter text using the chapter prompt
-            generated_chap_text = generate_text(chap_prompt)
-            doc.add_heading(clean(chap_title), level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
-            doc.add_paragraph(generated_chap_text)
-            doc.add_page_break()
-
-    # Save the DOCX
-    filename = os.path.join(OUTPUT_DIR, f"{book_title}.docx")
-    doc.save(filename)
+            sections.append(Section(book_title, f"ch{number:02d}", "chapter", clean_heading(chap_title), 1, chap_prompt))
+        scheduler.assign(sections[-1], share_goal([chap_prompt], row.get('Word_Goal'))[0], MAX_TOKENS)
+
+    context = kids_fiction_context(book_title, book_author(chapters),
+                                   [(section.heading, section.prompt) for section in sections])
+    # The context without its chapter plan: rules, title and author (see bookmaker.manifest).
+    book = kids_fiction_context(book_title, book_author(chapters), [])
+    for section in sections:
+        section.context = context
+        section.digest = input_hash(section_body(section), section.heading, book)
+    return sections
+
+def build_docx(book_title, author_name, sections, pool=None):
+    """
+    Builds and saves the DOCX for a kids book from its generated sections.
+    Adapted for children's books with age-appropriate formatting.
+    With a DocumentPool the book is assembled in a worker and a future of the
+    filename is returned instead.
+    """
+    filename = book_path(book_title)
+    if pool is not None:
+        return pool.submit(save_kids_fiction_book, filename, book_title, author_name, sections)
+    save_kids_fiction_book(filename, book_title, author_name, sections)
     print(f"Saved kids book: {filename}")
+    return filename
 
-def process_books():
-    # Read the Excel file
-    df = pd.read_excel(INPUT_PATH)
-    
-    # Group by Book Title to get each set of rows for that book
-    grouped = df.groupby("Book Title", sort=False)
-    
-    for book_title, chapters in grouped:
-        # Ignore rows where "Chapter" is empty or NaN.
-        chapters_filtered = chapters.dropna(subset=["Chapter"])
-        chapters_filtered = chapters_filtered[chapters_filtered["Chapter"].str.strip() != ""]
-        
-        # Now create the DOCX only with these filtered chapter rows
-        create_docx(book_title, chapters_filtered)
+def book_path(book_title):
+    return os.path.join(OUTPUT_DIR, f"{book_title}.docx")
 
-if __name__ == "__main__":
-    all_titles = []
+def open_book_journal(book_title, sections, incremental=False):
+    """
+    Opens the journal of a book's generated sections. An incremental run fills
+    in every section whose inputs match the book's manifest from the last run.
+    """
+    journal = SectionJournal(journal_path(OUTPUT_DIR, book_title), resume=incremental)
+    if incremental:
+        reused = reuse_unchanged(sections, journal.load(), load_manifest(manifest_path(OUTPUT_DIR, book_title)))
+        incremental_stats["skipped"] += reused
+        incremental_stats["sections"] += len(sections)
+        if reused < len(sections):
+            print(f"✏️ '{book_title}': {len(sections) - reused} of {len(sections)} sections changed or missing")
+    return journal
+
+def close_book_journal(book_title, sections, journal):
+    """
+    Closes the journal and records the book's manifest.
+    Returns True if no section was regenerated since the previous run.
+    """
+    journal.close()
+    path = manifest_path(OUTPUT_DIR, book_title)
+    previous = load_manifest(path)
+    return save_manifest(path, sections) == previous
+
+def keep_unchanged(book_title, unchanged, incremental):
+    """True if an incremental run can keep the book's existing DOCX."""
+    if incremental and unchanged and os.path.exists(book_path(book_title)):
+        incremental_stats["kept"] += 1
+        print(f"⏩ Kids book '{book_title}' is unchanged, keeping {book_path(book_title)}")
+        return True
+    return False
+
+def book_author(chapters):
+    """
+    Reads the author's name from the first row of a book's chapters.
+    """
+    if len(chapters) == 0:
+        return ""
+    return str(chapters.iloc[0].get("Author Name", "")).strip()
 
-    # Read the Excel file
-    df = pd.read_excel(INPUT_PATH)
+def create_docx(book_title, chapters, pool=None, incremental=False, stop=None):
+    """
+    Creates a DOCX file for a given kids book_title and its associated chapters DataFrame.
+    Adapted for children's books with age-appropriate formatting and content.
+    With `incremental`, only sections whose inputs changed are regenerated.
+    Once the threading.Event `stop` is set, no further call is made and nothing is saved.
+    """
+    print(f"Creating kids DOCX for '{book_title}'")
+    sections = plan_book(book_title, chapters)
+    journal = open_book_journal(book_title, sections, incremental)
+    try:
+        for section in scheduler.dispatch(sections):
+            if stop is not None and stop.is_set():
+                raise GenerationError(f"'{book_title}' stopped before {section.key}")
+            with telemetry.context(book=book_title, chapter=section.key, section=section.key, kind=section.kind), \
+                    scheduler.timed(section):
+                section.text = generate_text(section.prompt, section.context, section.model or MODEL,
+                                             section.max_tokens or MAX_TOKENS)
+            if section.text.strip():
+                journal.append(section.key, section.text)
+    finally:
+        unchanged = close_book_journal(book_title, sections, journal)
+    if stop is not None and stop.is_set():
+        raise GenerationError(f"'{book_title}' stopped before it was saved")
+    if keep_unchanged(book_title, unchanged, incremental):
+        return book_path(book_title)
+    return build_docx(book_title, book_author(chapters), sections, pool)
+
+def iter_book_groups(rows):
+    """
+    (book_title, rows) per book in order of first appearance, like the groupby(sort=False) this replaced:
+    a book's rows are merged even when other books' rows sit between them. `rows` is a sheet path, which
+    is read twice and streamed, or a list of row dicts.
+    """
+    if isinstance(rows, str):
+        return iter_sheet_groups(rows, "Book Title")
+    rows = list(rows)
+    return iter_groups(rows, "Book Title", group_ends(rows, "Book Title"))
 
+def iter_books(rows, shard=None):
+    """
+    Yields (book_title, chapter rows) per book, ignoring rows where "Chapter" is empty or NaN.
+    `rows` is a sheet path or a list of row dicts (see iter_book_groups).
+    With a `shard`, only the books this node takes are yielded.
+    """
     # Group by Book Title to get each set of rows for that book
-    grouped = df.groupby("Book Title", sort=False)
-
-    for book_title, chapters in grouped:
-        # Ignore rows where "Chapter" is empty or NaN.
+    for position, (book_title, group) in enumerate(iter_book_groups(rows)):
+        if shard is not None and not shard.take(book_title, position):
+            continue
+        chapters = pd.DataFrame(group)
         chapters_filtered = chapters.dropna(subset=["Chapter"])
         chapters_filtered = chapters_filtered[chapters_filtered["Chapter"].str.strip() != ""]
+        yield book_title, chapters_filtered
 
+def collect_saved(pending):
+    """
+    Waits for queued DOCX builds and returns the (book title, author) pairs of the saved books.
+    `pending` holds (build_docx result, entry) pairs; books built inline are already saved.
+    """
+    saved = []
+    for result, entry in pending:
+        if isinstance(result, Future):
+            print(f"Saved kids book: {result.result()}")
+        saved.append(entry)
+    return saved
+
+def process_books_batch(rows, backend="openai", poll_interval=60.0, pool=None, shard=None, incremental=False):
+    """
+    Generates every book's sections through a single Batch API job, then builds the DOCX files.
+    `rows` is a sheet path or a list of row dicts. Returns the (book title, author) pairs of the books that were saved.
+    """
+    books = []
+    for book_title, chapters in iter_books(rows, shard):
+        sections = plan_book(book_title, chapters)
+        books.append((book_title, chapters, sections, open_book_journal(book_title, sections, incremental)))
+    requests = [(custom_id(section.book, section.key), section_body(section, section.context))
+                for _, _, sections, _ in books for section in sections if not section.text]
+    # Nodes sharing OUTPUT_DIR each keep their own batch input and state, so none re-attaches to another's batch.
+    workdir = os.path.join(OUTPUT_DIR, ".batch" if shard is None else f".batch-{shard.label}")
+    texts, errors = run_batch(requests, make_backend(backend, workdir), workdir, poll_interval)
+
+    pending = []
+    for book_title, chapters, sections, journal in books:
+        missing = []
+        for section in sections:
+            if section.text:
+                continue
+            cid = custom_id(section.book, section.key)
+            if cid not in texts:
+                missing.append(section)
+                continue
+            section.text = texts[cid]
+            if section.text.strip():
+                journal.append(section.key, section.text)
+        unchanged = close_book_journal(book_title, sections, journal)
+        if missing:
+            print(f"⚠️ Skipped kids book '{book_title}': {len(missing)} section(s) failed in the batch")
+            if shard is not None:
+                shard.release(book_title)
+            continue
+        author = book_author(chapters)
+        if keep_unchanged(book_title, unchanged, incremental):
+            pending.append((book_path(book_title), {"Book Title": book_title, "Author Name": author}))
+            continue
+        pending.append((build_docx(book_title, author, sections, pool),
+                        {"Book Title": book_title, "Author Name": author}))
+    return collect_saved(pending)
+
+def process_books(pool=None, shard=None, incremental=False):
+    """
+    Generates and saves every book in the input workbook, one book at a time.
+    With a DocumentPool, each book is assembled in a worker while the next one generates.
+    Returns the (book title, author) pairs of the books that were saved.
+    """
+    pending = []
+    # Stream the Excel file
+    for book_title, chapters_filtered in iter_books(INPUT_PATH, shard):
         # Now create the DOCX only with these filtered chapter rows
-        create_docx(book_title, chapters_filtered)
+        try:
+            result = create_docx(book_title, chapters_filtered, pool, incremental)
+        except GenerationError:
+            print(f"⚠️ Skipped kids book '{book_title}': generation failed")
+            if shard is not None:
+                shard.release(book_title)
+            continue
 
         # Get author name (from first row in group)
-        author_name = str(chapters_filtered.iloc[0].get("Author Name", "")).strip()
-        all_titles.append({"Book Title": book_title, "Author Name": author_name})
+        pending.append((result, {"Book Title": book_title, "Author Name": book_author(chapters_filtered)}))
+    return collect_saved(pending)
 
-    # Save book-author list to Excel
-    summary_df = pd.DataFrame(all_titles)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate kids fiction books from the chapter prompts workbook.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit every chapter prompt as one Batch API job instead of interactive calls.")
+    parser.add_argument("--batch-backend", choices=["openai", "local"], default="openai",
+                        help="Where to run the batch; 'local' executes it in-process.")
+    parser.add_argument("--poll-interval", type=float, default=60.0,
+                        help="Seconds between batch status checks.")
+    parser.add_argument("--docx-workers", type=int, default=DEFAULT_DOCX_WORKERS,
+                        help="Processes assembling DOCX files (0 or 1 builds them on a background thread).")
+    parser.add_argument("--export", choices=EXPORT_BACKENDS, default=EXPORT_BACKEND,
+                        help="DOCX writer: python-docx, or 'stream' to write the zip directly.")
+    parser.add_argument("--formats", default=",".join(EXTRA_FORMATS),
+                        help="Extra formats written next to each DOCX, comma-separated: epub, md.")
+    parser.add_argument("--input", default=INPUT_PATH, help="Chapter prompts workbook.")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Where to save the books and the author list.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only regenerate chapters whose prompt, model or parameters changed since the last "
+                             "run, and only rebuild the books they belong to. Changing the author or style "
+                             "rules regenerates the whole book; editing one chapter's prompt or heading does "
+                             "not regenerate the others, although it is repeated in their chapter plan.")
+    parser.add_argument("--schedule", action="store_true", default=SCHEDULE,
+                        help="Cap each chapter's max_tokens (at most 4000) from its prompt's word count, and send "
+                             "short chapters to --fast-model. Chapters are generated one call at a time in "
+                             "sheet order, so there is no dispatch order to schedule.")
+    parser.add_argument("--fast-model", default=FAST_MODEL,
+                        help="Model for sections of at most BOOKMAKER_FAST_MAX_WORDS words (needs --schedule).")
+    add_shard_args(parser)
+    args = parser.parse_args()
+    INPUT_PATH, OUTPUT_DIR = args.input, args.output_dir
+    scheduler.budgets, scheduler.fast_model = args.schedule, args.fast_model
     summary_path = os.path.join(OUTPUT_DIR, "Kids_Book_Author_List.xlsx")
+
+    if args.merge:
+        order = [book_title for book_title, _ in iter_book_groups(INPUT_PATH)]
+        merge_parts(summary_path, ["Book Title", "Author Name"], "Book Title", order)
+        sys.exit(0)
+
+    shard = from_args(args)
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    with DocumentPool(args.docx_workers, args.export, formats) as pool:
+        if args.batch:
+            all_titles = process_books_batch(INPUT_PATH, args.batch_backend, args.poll_interval, pool,
+                                             shard, args.incremental)
+        else:
+            all_titles = process_books(pool, shard, args.incremental)
+
+    # Save book-author list to Excel; a sharded node writes its own part for --merge
+    summary_df = pd.DataFrame(all_titles, columns=["Book Title", "Author Name"])
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    if shard is not None:
+        summary_path = part_path(summary_path, shard.label)
     summary_df.to_excel(summary_path, index=False)
+    if shard is not None:
+        # Books count as done once they are in a saved author list, so a node that dies loses no entries.
+        for entry in all_titles:
+            shard.finish(entry["Book Title"])
+        shard.close()
     print(f"📘 Saved kids book-author list to: {summary_path}")
-
+    if args.incremental:
+        print(f"⏭️ Incremental run: skipped {incremental_stats['skipped']} of {incremental_stats['sections']} "
+              f"section calls, kept {incremental_stats['kept']} unchanged book(s)")
+    if not args.batch:
+        print(scheduler.summary(1))
+    print(llm.summary())
@@ -1,169 +1,232 @@
 #!/usr/bin/env python3
 import os
-import json
-import pandas as pd
-import openai
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
-import re
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bookmaker import llm, telemetry
+from bookmaker.retry import GenerationError
+from bookmaker.outline import request_plan
+from bookmaker.parallel import DEFAULT_WORKERS, imap_ordered
+from bookmaker.prompts import KIDS_NONFICTION_RULES
+from bookmaker.shards import add_shard_args, from_args, merge_parts, part_path
+from bookmaker.sheets import RowWriter, iter_rows
 
 # ── CONFIGURATION ────────────────────────────────────────────
 
-openai.api_key = os.getenv("OPENAI_API_KEY", "").strip()
-if not openai.api_key:
-    raise RuntimeError("OPENAI_API_KEY environment variable not set.")
-if not openai.api_key:
-    raise RuntimeError("OpenAI API key not set.")
-
 MODEL = "gpt-4o-mini"
-MEMORY_FILE = "kids_chapter_memory.json"
+MEMORY_INDEX = "kids_chapter_memory"  # kids_chapter_memory.{titles,subheadings}.npy + .ids.jsonl
+DEDUP_THRESHOLD = 0.9
+DEDUP_ATTEMPTS = 3
 INPUT_EXCEL = "kids_book_input.xlsx"
 PROMPTS_EXCEL = "Kids_Book_Generated_Content.xlsx"
+MAX_SUBHEADINGS = 4
+SUBHEADINGS_PER_CHAPTER = 3
+PROMPT_COLUMNS = (
+    ["Book_Title", "Intro_Prompt", "Chapter_Title", "Chapter_Intro"]
+    + [f"Subheading_{j}" for j in range(1, MAX_SUBHEADINGS + 1)]
+    + [f"Subheading_{j}_Prompt" for j in range(1, MAX_SUBHEADINGS + 1)]
+    + ["Genre", "Target_Audience", "Tone", "Style", "Pacing", "Language", "Readability", "Word_Goal"]
+    + ["Book_Description", "Style_Rules"]
+)
 
 # ── MEMORY HELPERS ───────────────────────────────────
 
-def load_memory():
-    if os.path.exists(MEMORY_FILE):
-        return json.load(open(MEMORY_FILE))
-    return {"titles": [], "subheadings": []}
-
-def save_memory(mem):
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(mem, f)
-
-# ── UTIL ─────────────────────────────────────
-
-def clean_json_string(response: str) -> str:
-    matches = re.findall(r'```(?:json)?(.*?)```', response, re.DOTALL)
-    if matches:
-        return matches[0].strip()
-    return response.strip()
+def load_memory(index: str = MEMORY_INDEX):
+    # numpy and sentence-transformers load here, not at import, keeping startup fast.
+    from bookmaker.semantic_index import TitleMemory
+    return TitleMemory(index, threshold=DEDUP_THRESHOLD)
 
 # ── CORE OPENAI CALL ────────────────────────────────
 
-def generate_content(prompt: str) -> str:
-    try:
-        response = openai.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print("OpenAI error:", e)
-        return ""
+def plan_chat(book: str):
+    """The `chat` callback for bookmaker.outline: one structured call, errors reported and turned into ""."""
+    def chat(messages: list, response_format: dict, kind: str) -> str:
+        try:
+            with telemetry.context(book=book, kind=kind):
+                return llm.chat(messages, model=MODEL, response_format=response_format)
+        except GenerationError as e:
+            print(f"OpenAI error ({e.kind}, {e.attempts} attempt(s)):", e)
+            return ""
+    return chat
 
 # ── DOMAIN‐SPECIFIC GENERATORS FOR KIDS ───────────────────────────
 
-def generate_book_description(book_title: str) -> str:
+def generate_book_plan(title: str, chapters: int, structure: str) -> dict | None:
+    """Genre, audience, description and outline for one title, from a single validated structured call."""
     prompt = (
-        f"Using the title '{book_title}', assume this is a non-fiction book for children ages 6-12. "
-        "Write an engaging, two-sentence description that introduces the topic in a fun way, "
-        "explains why it's interesting, and hints at what young readers will learn. "
-        "Use simple, exciting language that makes kids want to read more."
+        f"Plan the children's non-fiction book titled '{title}' for kids ages 6-12. Give the most suitable "
+        "educational genre and ideal age range, and an engaging, two-sentence description that introduces the "
+        "topic in a fun way, explains why it's interesting, and hints at what young readers will learn, using "
+        "simple, exciting language. "
+        f"Then create a list of {chapters} fun chapter titles and {SUBHEADINGS_PER_CHAPTER} simple subheadings per "
+        f"chapter based on that description. Structure should be {structure}. Make titles exciting and "
+        "educational, and keep subheadings simple and engaging for kids."
     )
-    return generate_content(prompt)
-
-def generate_genre_and_target_audience(title: str) -> tuple[str, str]:
-    prompt = f"For the children's book titled '{title}', suggest the most suitable educational genre and ideal age range. Return as JSON: {{\"genre\": \"...\", \"audience\": \"...\"}}"
-    out = generate_content(prompt)
-    try:
-        data = json.loads(clean_json_string(out))
-        return data["genre"], data["audience"]
-    except Exception as e:
-        print(f"❌ Failed to parse genre/audience for '{title}'. Response was:\n{out}")
-        return "Educational", "Ages 6-12"
-
-def generate_chapter_titles_and_subheadings(title, chapters, description, structure):
+    plan, issues = request_plan(plan_chat(title), prompt, chapters, SUBHEADINGS_PER_CHAPTER)
+    if plan is None:
+        print(f"❌ Failed to get a book plan for '{title}': the reply was not valid JSON.")
+        return None
+    if issues:
+        print(f"⚠️ Book plan for '{title}' still incomplete after repair: {'; '.join(issues)}")
+    plan["genre"] = plan["genre"] or "Educational"
+    plan["audience"] = plan["audience"] or "Ages 6-12"
+    return plan
+
+def generate_chapter_titles_and_subheadings(title, chapters, description, structure, avoid=None):
     prompt = (
-        f"Create a list of {chapters} fun chapter titles and 3 simple subheadings per chapter for a children's book titled '{title}' "
-        f"based on this description: {description}. Structure should be {structure}. "
-        f"Make titles exciting and educational. Keep subheadings simple and engaging for kids. "
-        f"Return as JSON like: {{\"chapters\": [{{\"title\": \"...\", \"subheadings\": [\"...\", \"...\", \"...\"]}}, ...]}}"
+        f"Create a list of {chapters} fun chapter titles and {SUBHEADINGS_PER_CHAPTER} simple subheadings per chapter "
+        f"for a children's book titled '{title}' based on this description: {description}. "
+        f"Structure should be {structure}. Make titles exciting and educational. "
+        "Keep subheadings simple and engaging for kids."
     )
-    out = generate_content(prompt)
-    try:
-        j = json.loads(clean_json_string(out))
-        titles = [c["title"] for c in j["chapters"]]
-        subheads = [c["subheadings"] for c in j["chapters"]]
-        return titles, subheads
-    except Exception as e:
-        print(f"❌ Failed to parse chapter titles JSON for '{title}'. Response was:\n{out}")
+    if avoid:
+        prompt += " Do not reuse or closely paraphrase these existing headings: " + "; ".join(avoid) + "."
+    plan, issues = request_plan(plan_chat(title), prompt, chapters, SUBHEADINGS_PER_CHAPTER, with_profile=False)
+    if plan is None:
+        print(f"❌ Failed to parse chapter titles JSON for '{title}'.")
         return [], []
+    return [c["title"] for c in plan["chapters"]], [c["subheadings"] for c in plan["chapters"]]
 
 # ── BUILD PROMPTS EXCEL ──────────────────────────────
 
-def create_prompts_excel(input_path: str, output_path: str):
-    df_in = pd.read_excel(input_path)
+def dedupe_outline(title, chapters, desc, structure, chap_titles, subheads, memory):
+    """
+    Regenerates the outline while its chapter titles or subheadings are near-duplicates of ones already in
+    memory (titles are compared with titles, subheadings with subheadings) or of each other.
+    """
+    for attempt in range(1, DEDUP_ATTEMPTS + 1):
+        dupes = memory.check_and_add(title, chap_titles, force=attempt == DEDUP_ATTEMPTS,
+                                     subheadings=[s for chapter in subheads for s in chapter])
+        if not dupes or attempt == DEDUP_ATTEMPTS:
+            return chap_titles, subheads
+        print(f"🔁 '{title}': {len(dupes)} near-duplicate heading(s), regenerating outline "
+              f"(e.g. '{dupes[0][0]}' ~ '{dupes[0][1]}', {dupes[0][2]:.2f})")
+        new_titles, new_subheads = generate_chapter_titles_and_subheadings(
+            title, chapters, desc, structure, avoid=sorted({d[0] for d in dupes}))
+        if not new_titles:
+            memory.check_and_add(title, chap_titles, force=True,
+                                 subheadings=[s for chapter in subheads for s in chapter])
+            return chap_titles, subheads
+        chap_titles, subheads = new_titles, new_subheads
+    return chap_titles, subheads
+
+def build_title_rows(entry, memory=None) -> list[dict]:
+    """Generates the prompt rows for one input title from a single structured book-plan call."""
     rows = []
-    mem = load_memory()
-
-    for _, entry in df_in.iterrows():
-        title = entry["Book Title"]
-        chapters = int(entry["Chapters_required"])
-        structure = entry["Chapter_Structure"]
-
-        genre, audience = generate_genre_and_target_audience(title)
-        desc = generate_book_description(title)
-        chap_titles, subheads = generate_chapter_titles_and_subheadings(title, chapters, desc, structure)
-
-        if not chap_titles:
-            print(f"⚠️ Skipping '{title}' — no chapters generated.")
-            continue
-
-        intro_prompt = (
-            f"Write a 800-word engaging and fun introduction for the children's book '{title}'. "
-            f"Focus on the key themes: {desc}. Use simple language, fun facts, and exciting examples. "
-            f"Make it interesting for kids ages 6-12. Avoid using headings."
-        )
-
-        max_chaps = min(len(chap_titles), len(subheads))
-        if max_chaps < chapters:
-            print(f"⚠️ Partial generation for '{title}': only {max_chaps} of {chapters} chapters available.")
-
-        for i in range(max_chaps):
-            ct = chap_titles[i]
-            try:
-                ci = (
-                    f"Write a 100-word fun introduction for Chapter {i+1}, titled '{ct}', in the children's book '{title}'. "
-                    "Start with an exciting hook that makes kids curious. Use simple language. "
-                    "Do not repeat the chapter title. Make it sound like an adventure or discovery."
-                )
-                sh_prompts = [
-                    f"Write a 300-word engaging section on '{sh}' for Chapter {i+1} of the children's book '{title}'. "
-                    f"Include fun examples, simple explanations, and interactive elements. "
-                    f"Use age-appropriate language for kids ages 6-12. Make it exciting and educational. "
-                    f"Maintain continuity and avoid repeating the chapter title."
-                    for sh in subheads[i]
-                ]
-
-                row = {
-                    "Book_Title": title,
-                    "Intro_Prompt": intro_prompt if i == 0 else "",
-                    "Chapter_Title": f"Chapter {i+1}: {ct}",
-                    "Chapter_Intro": ci,
-                    **{f"Subheading_{j+1}": subheads[i][j] for j in range(len(subheads[i]))},
-                    **{f"Subheading_{j+1}_Prompt": sh_prompts[j] for j in range(len(sh_prompts))},
-                    "Genre": genre,
-                    "Target_Audience": audience,
-                    "Tone": "Fun and educational",
-                    "Style": "Simple and engaging",
-                    "Pacing": "Easy to follow",
-                    "Language": "English",
-                    "Readability": "Elementary Level",
-                    "Word_Goal": 1000
-                }
-                rows.append(row)
-            except Exception as e:
-                print(f"⚠️ Skipped Chapter {i+1} of '{title}' due to error: {e}")
-
-    pd.DataFrame(rows).to_excel(output_path, index=False)
-    save_memory(mem)
+    title = entry["Book Title"]
+    chapters = int(entry["Chapters_required"])
+    structure = entry["Chapter_Structure"]
+
+    plan = generate_book_plan(title, chapters, structure)
+    if not plan or not plan["chapters"]:
+        print(f"⚠️ Skipping '{title}' — no chapters generated.")
+        return []
+    genre, audience, desc = plan["genre"], plan["audience"], plan["description"]
+    chap_titles = [chapter["title"] for chapter in plan["chapters"]]
+    subheads = [chapter["subheadings"] for chapter in plan["chapters"]]
+
+    if memory is not None:
+        chap_titles, subheads = dedupe_outline(title, chapters, desc, structure, chap_titles, subheads, memory)
+
+    # Book-level context (description, outline, style rules) goes in the shared prefix built by
+    # stage 2, so the per-section prompts only say which section to write.
+    intro_prompt = (
+        "Write a 800-word engaging and fun introduction for the book. "
+        "Focus on its key themes. Use simple language, fun facts, and exciting examples. Avoid using headings."
+    )
+
+    max_chaps = min(len(chap_titles), len(subheads))
+    if max_chaps < chapters:
+        print(f"⚠️ Partial generation for '{title}': only {max_chaps} of {chapters} chapters available.")
+
+    for i in range(max_chaps):
+        ct = chap_titles[i]
+        try:
+            ci = (
+                f"Write a 100-word fun introduction for Chapter {i+1}, titled '{ct}'. "
+                "Start with an exciting hook that makes kids curious. "
+                "Do not repeat the chapter title. Make it sound like an adventure or discovery."
+            )
+            sh_prompts = [f"Write a 300-word engaging section on '{sh}' for Chapter {i+1}." for sh in subheads[i]]
+
+            row = {
+                "Book_Title": title,
+                "Intro_Prompt": intro_prompt if i == 0 else "",
+                "Chapter_Title": f"Chapter {i+1}: {ct}",
+                "Chapter_Intro": ci,
+                **{f"Subheading_{j+1}": subheads[i][j] for j in range(len(subheads[i]))},
+                **{f"Subheading_{j+1}_Prompt": sh_prompts[j] for j in range(len(sh_prompts))},
+                "Genre": genre,
+                "Target_Audience": audience,
+                "Tone": "Fun and educational",
+                "Style": "Simple and engaging",
+                "Pacing": "Easy to follow",
+                "Language": "English",
+                "Readability": "Elementary Level",
+                "Word_Goal": 1000,
+                "Book_Description": desc if i == 0 else "",
+                "Style_Rules": KIDS_NONFICTION_RULES if i == 0 else "",
+            }
+            rows.append(row)
+        except Exception as e:
+            print(f"⚠️ Skipped Chapter {i+1} of '{title}' due to error: {e}")
+    return rows
+
+def create_prompts_excel(input_path: str, output_path: str, workers: int = DEFAULT_WORKERS, sidecars=("csv",),
+                         dedupe: bool = True, shard=None):
+    """
+    Streams titles from `input_path` and appends each title's prompt rows to
+    `output_path` (plus sidecars) as soon as it is done, in input order.
+    With `dedupe` off, outlines are not checked against the heading memory.
+    With a `shard` (bookmaker.shards), only the titles this node takes are
+    outlined, into its own part of the workbook and its own heading memory
+    (the memory files have a single writer).
+    """
+    entries = iter_rows(input_path)
+    index = MEMORY_INDEX
+    if shard is not None:
+        entries = (entry for position, entry in enumerate(entries) if shard.take(entry["Book Title"], position))
+        output_path = part_path(output_path, shard.label)
+        index = part_path(MEMORY_INDEX, shard.label)
+    mem = load_memory(index) if dedupe else None
+
+    written = []
+    with RowWriter(output_path, PROMPT_COLUMNS, sidecars) as writer:
+        for entry, title_rows in imap_ordered(lambda entry: (entry, build_title_rows(entry, memory=mem)),
+                                              entries, workers):
+            for row in title_rows:
+                writer.append(row)
+            if title_rows:
+                written.append(entry["Book Title"])
+            elif shard is not None:
+                shard.release(entry["Book Title"])
+    if shard is not None:
+        # Only now are the rows in a saved workbook; a node that dies earlier leaves its claims to be taken over.
+        for title in written:
+            shard.finish(title)
+        shard.close()
     print(f"✅ Kids prompts Excel written to: {output_path}")
+    print(llm.summary())
 
 # ── ENTRY POINT ────────────────────────────────
 
 if __name__ == "__main__":
-    create_prompts_excel(INPUT_EXCEL, PROMPTS_EXCEL)
-
-
+    parser = argparse.ArgumentParser(description="Build the stage-1 prompts workbook.")
+    parser.add_argument("--input", default=INPUT_EXCEL, help="Input workbook with one row per title.")
+    parser.add_argument("--output", default=PROMPTS_EXCEL, help="Prompts workbook to write.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Titles processed in parallel (1 keeps the sequential behaviour).")
+    parser.add_argument("--sidecar", action="append", choices=["csv", "parquet", "none"],
+                        help="Also stream rows to a CSV and/or Parquet file next to the workbook (default: csv).")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Skip the chapter-title and subheading memory (no embedding model is loaded).")
+    add_shard_args(parser)
+    args = parser.parse_args()
+    sidecars = [] if "none" in (args.sidecar or []) else (args.sidecar or ["csv"])
+    if args.merge:
+        merge_parts(args.output, PROMPT_COLUMNS, "Book_Title",
+                    [entry["Book Title"] for entry in iter_rows(args.input)], sidecars)
+    else:
+        create_prompts_excel(args.input, args.output, args.workers, sidecars, dedupe=not args.no_dedup,
+                             shard=from_args(args))
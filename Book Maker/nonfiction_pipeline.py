@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Runs stage 1 and stage 2 as one in-process pipeline.
+
+Each title's outline is handed straight from the stage-1 outline builder to
+stage-2 chapter generation, so the first book is finished after one book's
+worth of work instead of after the whole batch has been outlined. The prompts
+workbook is still written row by row as an audit record of the outlines.
+"""
+import os
+import time
+import asyncio
+import argparse
+import threading
+
+from bookmaker import llm
+from bookmaker.documents import DEFAULT_DOCX_WORKERS, DocumentPool
+from bookmaker.engine import DEFAULT_CONCURRENCY, PriorityGate
+from bookmaker.parallel import DEFAULT_WORKERS, imap_ordered
+from bookmaker.scripts import load_script
+from bookmaker.sheets import RowWriter, iter_rows
+
+# ── CONFIGURATION ──────────────────────────────────────────────────────────────
+
+STAGE1_SCRIPTS = {
+    "nonfiction": "2. nonfiction_prompts.py",
+    "kids-nonfiction": os.path.join("kids non fiction stage 1", "kids_nonfiction_prompts.py"),
+}
+BUILDER_SCRIPT = "2. nonfiction_bookmake.py"
+BOOKS_IN_FLIGHT = 2
+
+# ── PIPELINE ───────────────────────────────────────────────────────────────────
+
+async def run_pipeline(stage1, builder, input_path: str, prompts_path: str, workers: int = DEFAULT_WORKERS,
+                       concurrency: int = DEFAULT_CONCURRENCY, books_in_flight: int = BOOKS_IN_FLIGHT,
+                       resume: bool = False, sidecars=("csv",),
+                       docx_workers: int = DEFAULT_DOCX_WORKERS) -> list[str]:
+    """
+    Outlines titles on a producer thread and generates each finished outline's
+    book on the event loop. At most `books_in_flight` outlines wait in the
+    queue, all books share one pool of `concurrency` requests in flight, and
+    documents are assembled on `docx_workers` processes. Returns the paths of
+    the saved books.
+    """
+    loop = asyncio.get_running_loop()
+    outlines = asyncio.Queue(maxsize=max(1, books_in_flight))
+    semaphore = PriorityGate(concurrency)
+    stopped = threading.Event()
+    started = time.perf_counter()
+    saved = []
+
+    def put(item) -> bool:
+        # Blocks the producer while the queue is full, giving up if the consumers have stopped.
+        future = asyncio.run_coroutine_threadsafe(outlines.put(item), loop)
+        while not stopped.is_set():
+            try:
+                future.result(timeout=0.5)
+                return True
+            except TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def produce():
+        try:
+            memory = stage1.load_memory()
+            with RowWriter(prompts_path, stage1.PROMPT_COLUMNS, sidecars) as writer:
+                for title_rows in imap_ordered(
+                        lambda entry: stage1.build_title_rows(entry, memory=memory),
+                        iter_rows(input_path), workers):
+                    for row in title_rows:
+                        writer.append(row)
+                    if title_rows and not put(title_rows):
+                        return
+            print(f"✅ Prompts Excel written to: {prompts_path}")
+        finally:
+            for _ in range(books_in_flight):
+                put(None)
+
+    async def consume():
+        while True:
+            rows = await outlines.get()
+            if rows is None:
+                return
+            books = builder.plan_books(rows)
+            journals = builder.open_journals(books, resume=resume)
+            await builder.generate_books(books, concurrency, journals, semaphore=semaphore)
+            for future in builder.finish_books(books, journals, pool):
+                path = await asyncio.wrap_future(future)
+                print(f"💾 Saved book to: {path}")
+                if not saved:
+                    print(f"⏱️ First book finished after {time.perf_counter() - started:.1f}s")
+                saved.append(path)
+
+    with DocumentPool(docx_workers) as pool:
+        consumers = [asyncio.create_task(consume()) for _ in range(max(1, books_in_flight))]
+        producer = loop.run_in_executor(None, produce)
+        try:
+            await asyncio.gather(producer, *consumers)
+        finally:
+            stopped.set()
+            for task in consumers:
+                task.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+    print(f"🏁 {len(saved)} book(s) finished in {time.perf_counter() - started:.1f}s")
+    return saved
+
+# ── ENTRY POINT ────────────────────────────────────────────────────────────────
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Outline and generate books in one pass, book by book.")
+    parser.add_argument("--stage1", choices=sorted(STAGE1_SCRIPTS), default="nonfiction",
+                        help="Which stage-1 outline builder to run.")
+    parser.add_argument("--input", help="Input workbook with one row per title (default: the stage-1 script's).")
+    parser.add_argument("--prompts", help="Audit copy of the prompts workbook (default: the stage-1 script's).")
+    parser.add_argument("--output-dir", help="Where to save the books (default: the builder's WORD_OUTPUT_DIR).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Titles outlined in parallel.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Maximum number of section requests in flight across all books.")
+    parser.add_argument("--books-in-flight", type=int, default=BOOKS_IN_FLIGHT,
+                        help="Books generated at the same time; finished outlines beyond this wait.")
+    parser.add_argument("--docx-workers", type=int, default=DEFAULT_DOCX_WORKERS,
+                        help="Processes assembling DOCX files (0 or 1 builds them on a background thread).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse sections already in each book's journal instead of regenerating them.")
+    parser.add_argument("--stream", action="store_true", default=llm.STREAM,
+                        help="Stream completions, journaling text as it arrives.")
+    parser.add_argument("--sidecar", action="append", choices=["csv", "parquet", "none"],
+                        help="Also stream prompt rows to a CSV and/or Parquet file (default: csv).")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    llm.STREAM = args.stream
+    stage1 = load_script(STAGE1_SCRIPTS[args.stage1])
+    builder = load_script(BUILDER_SCRIPT)
+    if args.output_dir:
+        builder.WORD_OUTPUT_DIR = args.output_dir
+    sidecars = [] if "none" in (args.sidecar or []) else (args.sidecar or ["csv"])
+    asyncio.run(run_pipeline(stage1, builder, args.input or stage1.INPUT_EXCEL, args.prompts or stage1.PROMPTS_EXCEL,
+                             args.workers, args.concurrency, args.books_in_flight, args.resume, sidecars,
+                             args.docx_workers))
+    print(llm.summary())